@@ -0,0 +1,216 @@
+'''
+Frequency response (Bode) analysis of sine wave experiments.
+
+Each capture file is one experiment run with a sine wave at a known frequency.  Input and output columns
+are fit with a sine at that frequency (least squares, all at once with numpy) to get gain and phase,
+and files are processed in parallel with a process pool.
+
+Captures from an experiment plan that sweeps "wave.freq" can be analyzed straight from the manifest:
+
+    python bode.py eeva_output/output_.../freq_sweep_manifest.csv --input d1 --output d2 --plot bode.png
+
+Needs numpy, and matplotlib for --plot.
+'''
+import os
+import sys
+import csv
+import json
+import math
+import argparse
+import multiprocessing
+import numpy as np
+
+# Column names in exported capture files.
+capture_columns = ('time', 'd1', 'd2', 'd3', 'd4', 'd5', 'd6', 'd7', 'd8')
+
+bode_table_columns = ('freq', 'gain', 'gain_db', 'phase_deg', 'input_amplitude', 'output_amplitude', 'fit_r2', 'file')
+
+def fit_sine(t, values, freq):
+    '''
+    Least squares fit of values = a*sin(wt) + b*cos(wt) + c for every column of values.
+    Returns (amplitudes, phases in radians, r2) arrays with one entry per column.
+    '''
+    w = 2 * math.pi * freq
+    basis = np.column_stack((np.sin(w * t), np.cos(w * t), np.ones_like(t)))
+    coefficients, _, _, _ = np.linalg.lstsq(basis, values, rcond=None)
+
+    a, b = coefficients[0], coefficients[1]
+    amplitudes = np.hypot(a, b)
+    phases = np.arctan2(b, a)
+
+    residuals = values - basis.dot(coefficients)
+    total = ((values - values.mean(axis=0)) ** 2).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r2 = np.where(total > 0, 1 - (residuals ** 2).sum(axis=0) / total, 0.0)
+
+    return amplitudes, phases, r2
+
+def load_capture(filepath):
+    '''Return capture file as 2D array with one column per capture_columns.'''
+    return np.loadtxt(filepath, delimiter=',', skiprows=1, ndmin=2)
+
+def analyze_capture(filepath, freq, input_column='d1', output_column='d2', skip_periods=1):
+    '''
+    Return Bode table row (dictionary) for one capture. First skip_periods periods are ignored so start up
+    transients don't affect the fit, and only whole periods are used after that.
+    '''
+    data = load_capture(filepath)
+    t = data[:, 0] - data[0, 0]
+
+    period = 1.0 / freq
+    start_time = skip_periods * period
+    num_periods = math.floor((t[-1] - start_time) / period) if len(t) else 0
+    if num_periods < 1:
+        # Not enough data to skip anything, use everything there is.
+        start_time = 0
+        num_periods = max(1, math.floor(t[-1] / period)) if len(t) else 0
+    end_time = start_time + num_periods * period
+
+    used = (t >= start_time) & (t <= end_time)
+    if used.sum() < 4:
+        raise ValueError('Not enough samples in {} to fit {} Hz.'.format(filepath, freq))
+
+    columns = [capture_columns.index(input_column), capture_columns.index(output_column)]
+    amplitudes, phases, r2 = fit_sine(t[used], data[used][:, columns], freq)
+
+    gain = amplitudes[1] / amplitudes[0] if amplitudes[0] > 0 else float('nan')
+    phase = math.degrees(phases[1] - phases[0])
+    phase = (phase + 180.0) % 360.0 - 180.0 # wrap to [-180, 180)
+
+    return {'freq': freq,
+            'gain': gain,
+            'gain_db': 20 * math.log10(gain) if gain > 0 else float('nan'),
+            'phase_deg': phase,
+            'input_amplitude': amplitudes[0],
+            'output_amplitude': amplitudes[1],
+            'fit_r2': r2[1],
+            'file': os.path.basename(filepath)}
+
+def analyze_capture_args(args):
+    # Pool.map only passes one argument.
+    try:
+        return analyze_capture(*args)
+    except (IOError, ValueError) as e:
+        return {'freq': args[1], 'error': str(e), 'file': os.path.basename(args[0])}
+
+def analyze_captures(captures, input_column='d1', output_column='d2', skip_periods=1, processes=None):
+    '''
+    Captures is a list of (filepath, freq). Returns Bode table (list of rows sorted by frequency) for files that
+    could be analyzed and list of rows with an 'error' key for those that couldn't.
+    Processes is the size of the process pool (default number of cores, 1 to run in this process).
+    '''
+    jobs = [(filepath, float(freq), input_column, output_column, skip_periods) for filepath, freq in captures]
+
+    if processes == 1 or len(jobs) <= 1:
+        results = [analyze_capture_args(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(analyze_capture_args, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    rows = sorted([r for r in results if 'error' not in r], key=lambda r: r['freq'])
+    errors = [r for r in results if 'error' in r]
+    return rows, errors
+
+def captures_from_manifest(manifest_path):
+    '''Return list of (filepath, freq) for every point of an experiment plan manifest that has a data file.'''
+
+    directory = os.path.dirname(manifest_path)
+    captures = []
+    with open(manifest_path, 'rb') as manifest_file:
+        for row in csv.DictReader(manifest_file):
+            if not row['file']:
+                continue # point didn't get any data
+            params = json.loads(row['params'])
+            captures.append((os.path.join(directory, row['file']), float(params['wave']['freq'])))
+    return captures
+
+def bode_plot_data(rows):
+    '''Return dictionary of numpy arrays freq, gain_db and phase_deg (unwrapped so it doesn't jump 360 degrees).'''
+    freq = np.array([r['freq'] for r in rows])
+    gain_db = np.array([r['gain_db'] for r in rows])
+    phase_deg = np.degrees(np.unwrap(np.radians([r['phase_deg'] for r in rows])))
+    return {'freq': freq, 'gain_db': gain_db, 'phase_deg': phase_deg}
+
+def write_bode_table(filepath, rows):
+
+    with open(filepath, 'wb') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(bode_table_columns)
+        for row in rows:
+            writer.writerow([row[column] for column in bode_table_columns])
+
+def plot_bode(filepath, rows, title=None):
+    '''Save Bode plot image to filepath.'''
+
+    import matplotlib
+    matplotlib.use('Agg') # no window needed
+    import matplotlib.pyplot as plt
+
+    data = bode_plot_data(rows)
+    figure, (gain_axis, phase_axis) = plt.subplots(2, 1, sharex=True)
+    gain_axis.semilogx(data['freq'], data['gain_db'], 'o-')
+    gain_axis.set_ylabel('Gain (dB)')
+    gain_axis.grid(True, which='both')
+    phase_axis.semilogx(data['freq'], data['phase_deg'], 'o-')
+    phase_axis.set_ylabel('Phase (deg)')
+    phase_axis.set_xlabel('Frequency (Hz)')
+    phase_axis.grid(True, which='both')
+    if title:
+        gain_axis.set_title(title)
+    figure.savefig(filepath)
+    plt.close(figure)
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(description='Bode analysis of sine wave captures.')
+    parser.add_argument('files', nargs='+', help='experiment plan manifest csv, or capture csv files with --freqs')
+    parser.add_argument('--freqs', nargs='+', type=float, default=None, help='wave frequency of each capture file (Hz)')
+    parser.add_argument('--input', default='d1', choices=capture_columns[1:], help='column wave was applied to')
+    parser.add_argument('--output', default='d2', choices=capture_columns[1:], help='column with response')
+    parser.add_argument('--skip-periods', type=float, default=1, help='periods to ignore at start of each capture')
+    parser.add_argument('--processes', type=int, default=None, help='number of processes (default number of cores)')
+    parser.add_argument('--table', default=None, help='bode table csv to write (default next to first file)')
+    parser.add_argument('--plot', default=None, help='save plot image here (needs matplotlib)')
+    args = parser.parse_args(argv)
+
+    if args.freqs is None:
+        if len(args.files) != 1:
+            print 'Give one manifest file or use --freqs.'
+            return 1
+        captures = captures_from_manifest(args.files[0])
+    else:
+        if len(args.freqs) != len(args.files):
+            print 'Need one frequency for every file.'
+            return 1
+        captures = zip(args.files, args.freqs)
+
+    rows, errors = analyze_captures(captures, args.input, args.output, args.skip_periods, args.processes)
+
+    for error in errors:
+        print 'Skipped {}: {}'.format(error['file'], error['error'])
+
+    table_path = args.table
+    if table_path is None:
+        table_path = os.path.join(os.path.dirname(args.files[0]), 'bode_{}_{}.csv'.format(args.input, args.output))
+    write_bode_table(table_path, rows)
+    print 'Created {}'.format(table_path)
+
+    for row in rows:
+        print '{:10.4g} Hz  {:8.2f} dB  {:8.1f} deg  (r2 {:.3f})'.format(row['freq'], row['gain_db'],
+                                                                      row['phase_deg'], row['fit_r2'])
+
+    if args.plot and rows:
+        try:
+            plot_bode(args.plot, rows, '{} to {}'.format(args.input, args.output))
+            print 'Created {}'.format(args.plot)
+        except ImportError:
+            print 'Install matplotlib to create plots.'
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
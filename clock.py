@@ -0,0 +1,41 @@
+'''
+Monotonic clock for timing intervals.  time.time() jumps when the system clock is adjusted and Python 2
+doesn't have time.monotonic(), so use whatever the platform provides.
+'''
+import sys
+import time
+
+def find_monotonic_clock():
+    '''Return function that returns seconds from a clock that never goes backwards.'''
+
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+
+    if sys.platform == 'win32':
+        # Uses QueryPerformanceCounter.
+        return time.clock
+
+    try:
+        import ctypes
+        import ctypes.util
+        library_name = ctypes.util.find_library('rt') or ctypes.util.find_library('c')
+        clock_gettime = ctypes.CDLL(library_name, use_errno=True).clock_gettime
+    except (OSError, AttributeError, TypeError):
+        return time.time # best there is
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    clock_id = 6 if sys.platform == 'darwin' else 1 # CLOCK_MONOTONIC
+    spec = timespec()
+
+    if clock_gettime(clock_id, ctypes.byref(spec)) != 0:
+        return time.time
+
+    def monotonic():
+        clock_gettime(clock_id, ctypes.byref(spec))
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+
+    return monotonic
+
+monotonic = find_monotonic_clock()
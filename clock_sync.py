@@ -0,0 +1,275 @@
+'''
+Round trip time to the robot, and robot clock offset and drift, measured with Ping globs.
+
+A ping is sent every couple of seconds (about 40 bytes each way, well under 1% of the link) and the robot
+echoes it with the times (on the same clock as CaptureData.time) it received it and sent it back.  Along with
+the times the ping left and the reply arrived on this computer that gives, like NTP:
+
+    round trip = (t4 - t1) - (t3 - t2)
+    offset     = ((t2 - t1) + (t3 - t4)) / 2       (robot clock - host clock)
+
+The host times are taken when the ping is written to the port and when the reply's bytes arrive (noted by the
+link), so time spent waiting to be sent or for the GUI to get to the reply isn't counted.  A reply that was
+still held up on the way (waiting behind capture data, operating system buffers...) has a long round trip and an
+offset that's wrong by up to half of it.  So like NTP only the sample with the shortest round trip out of the
+last few is kept, and drift is the slope of a least squares fit of the kept offsets against host time.
+
+Host times are from clock.monotonic().  Use robot_to_wall_time() to compare with time.time() timestamps.
+'''
+import time
+import bisect
+from collections import deque
+from eeva_glob import Ping
+from clock import monotonic
+
+# Seconds between pings.
+PING_INTERVAL = 2.0
+
+# Seconds to wait for a reply before counting ping as lost.
+PING_TIMEOUT = 1.0
+
+# Robot firmware that doesn't know about pings never replies. Stop after this many with no reply at all.
+MAX_PINGS_WITHOUT_REPLY = 5
+
+# Number of round trip times kept for percentiles.
+ROUND_TRIP_HISTORY = 300
+
+# Shortest round trip of this many samples in a row is used for offset (NTP clock filter uses 8).
+FILTER_SAMPLES = 8
+
+# Number of filtered offsets used to fit drift.
+DRIFT_FIT_SAMPLES = 32
+
+# Robot clock is assumed to have been reset (e.g. robot restarted) if offset jumps more than this (seconds).
+CLOCK_RESET_THRESHOLD = 0.5
+
+def percentile(sorted_values, percent):
+    '''Nearest rank percentile of already sorted list.'''
+    if not sorted_values:
+        return 0.0
+    rank = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+class ClockSync(object):
+    '''Estimates robot clock from ping timestamps.  Doesn't send anything itself (see LatencyProbe).'''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''Forget everything, e.g. when connecting to a robot (which could have restarted).'''
+
+        # Last round trip times (seconds) in order received, plus the same values kept sorted for percentiles.
+        self.round_trips = deque()
+        self.sorted_round_trips = []
+
+        # Most recent (host time, offset, round trip) samples, to pick the shortest round trip from.
+        self.recent_samples = deque(maxlen=FILTER_SAMPLES)
+
+        # (host time, offset) of samples that passed the filter, oldest first.
+        self.filtered = deque(maxlen=DRIFT_FIT_SAMPLES)
+
+        # Robot clock = host clock + offset + drift * (host clock - reference time)
+        self.offset = None
+        self.drift = 0.0
+        self.reference_time = 0.0
+
+        self.num_samples = 0
+        self.num_clock_resets = 0
+
+    @property
+    def synchronized(self):
+        return self.offset is not None
+
+    def add_sample(self, host_send_time, robot_receive_time, robot_send_time, host_receive_time):
+        '''Add times (t1, t2, t3, t4) of one ping and its reply.'''
+
+        round_trip = max(0.0, (host_receive_time - host_send_time) - (robot_send_time - robot_receive_time))
+        offset = ((robot_receive_time - host_send_time) + (robot_send_time - host_receive_time)) / 2.0
+        host_time = (host_send_time + host_receive_time) / 2.0
+
+        self.num_samples += 1
+        self.add_round_trip(round_trip)
+
+        if self.synchronized and abs(offset - self.predicted_offset(host_time)) > CLOCK_RESET_THRESHOLD + round_trip:
+            # Robot clock started over, old samples say nothing about new clock.
+            self.recent_samples.clear()
+            self.filtered.clear()
+            self.num_clock_resets += 1
+
+        self.recent_samples.append((host_time, offset, round_trip))
+        best = min(self.recent_samples, key=lambda sample: sample[2])
+        if not self.filtered or best[0] > self.filtered[-1][0]:
+            self.filtered.append(best[:2])
+            self.fit()
+
+    def add_round_trip(self, round_trip):
+
+        self.round_trips.append(round_trip)
+        bisect.insort(self.sorted_round_trips, round_trip)
+        if len(self.round_trips) > ROUND_TRIP_HISTORY:
+            oldest = self.round_trips.popleft()
+            del self.sorted_round_trips[bisect.bisect_left(self.sorted_round_trips, oldest)]
+
+    def fit(self):
+        '''Least squares fit of filtered offsets against host time.'''
+
+        times = [sample[0] for sample in self.filtered]
+        offsets = [sample[1] for sample in self.filtered]
+        n = len(times)
+        mean_time = sum(times) / n
+        mean_offset = sum(offsets) / n
+
+        denominator = sum((t - mean_time) ** 2 for t in times)
+        if n >= 3 and denominator > 0:
+            self.drift = sum((t - mean_time) * (o - mean_offset) for t, o in zip(times, offsets)) / denominator
+        else:
+            self.drift = 0.0 # not enough to tell yet
+
+        self.reference_time = mean_time
+        self.offset = mean_offset
+
+    def predicted_offset(self, host_time):
+        return self.offset + self.drift * (host_time - self.reference_time)
+
+    def host_to_robot_time(self, host_time):
+        '''Robot clock time at host (monotonic) time.'''
+        return host_time + self.predicted_offset(host_time)
+
+    def robot_to_host_time(self, robot_time):
+        '''Host (monotonic) time at robot clock time, e.g. CaptureData.time. Raises ValueError if not synchronized.'''
+        if not self.synchronized:
+            raise ValueError('Robot clock not synchronized yet.')
+        # Solve robot = host + offset + drift * (host - reference) for host.
+        return (robot_time - self.offset + self.drift * self.reference_time) / (1.0 + self.drift)
+
+    def robot_to_wall_time(self, robot_time):
+        '''Same as robot_to_host_time() but comparable with time.time().'''
+        return self.robot_to_host_time(robot_time) + (time.time() - monotonic())
+
+    def one_way_delay(self):
+        '''Estimate of time (seconds) a message takes to get to robot, half the shortest recent round trip.'''
+        return self.sorted_round_trips[0] / 2.0 if self.sorted_round_trips else 0.0
+
+    def round_trip_percentiles(self, percents=(50, 90, 99)):
+        '''Return dictionary of percent -> round trip time in seconds.'''
+        return dict((percent, percentile(self.sorted_round_trips, percent)) for percent in percents)
+
+    def stats(self):
+        '''Return dictionary of round trip times (milliseconds) and clock estimate for showing to user.'''
+        percentiles = self.round_trip_percentiles()
+        return {'samples': len(self.round_trips),
+                'rtt_min': self.sorted_round_trips[0] * 1000 if self.sorted_round_trips else 0.0,
+                'rtt_p50': percentiles[50] * 1000,
+                'rtt_p90': percentiles[90] * 1000,
+                'rtt_p99': percentiles[99] * 1000,
+                'rtt_max': self.sorted_round_trips[-1] * 1000 if self.sorted_round_trips else 0.0,
+                'synchronized': self.synchronized,
+                'offset': self.offset,
+                'drift_ppm': self.drift * 1e6,
+                'clock_resets': self.num_clock_resets}
+
+class LatencyProbe(object):
+    '''Sends a Ping every so often and passes replies to a ClockSync.'''
+
+    def __init__(self, link, scheduler, clock_sync=None, interval=PING_INTERVAL):
+
+        self.link = link
+        self.scheduler = scheduler
+        self.clock_sync = clock_sync if clock_sync else ClockSync()
+        self.interval = interval
+
+        self.running = False
+
+        # Incremented whenever probe is started or stopped so old timers do nothing.
+        self.generation = 0
+
+        # Sequence number -> (host time ping was queued, Ping).
+        self.outstanding = {}
+        self.next_sequence = 0
+
+        self.num_pings_sent = 0
+        self.num_replies = 0
+        self.num_lost = 0
+
+        # False once robot has ignored enough pings that it probably doesn't support them.
+        self.supported = True
+
+    def start(self):
+        '''Start pinging, e.g. after connecting. Forgets previous clock estimate.'''
+
+        self.stop()
+        self.running = True
+        self.supported = True
+        self.num_pings_sent = self.num_replies = self.num_lost = 0
+        self.clock_sync.reset()
+        self.send_ping()
+
+    def stop(self):
+
+        self.generation += 1
+        self.running = False
+        self.outstanding = {}
+
+    def call_later(self, delay, callback):
+
+        generation = self.generation
+
+        def call_if_current():
+            if generation == self.generation:
+                callback()
+
+        self.scheduler.call_later(delay, call_if_current)
+
+    def send_ping(self):
+
+        self.call_later(self.interval, self.send_ping)
+
+        if not self.link.connection_open():
+            return
+
+        sequence = self.next_sequence
+        self.next_sequence = (self.next_sequence + 1) & 0xFFFFFFFF
+
+        ping = Ping(sequence)
+        self.outstanding[sequence] = (monotonic(), ping)
+        self.link.send(ping)
+        self.num_pings_sent += 1
+
+        self.call_later(PING_TIMEOUT, lambda: self.check_reply(sequence))
+
+    def check_reply(self, sequence):
+
+        if self.outstanding.pop(sequence, None) is None:
+            return # answered
+
+        self.num_lost += 1
+        if self.num_replies == 0 and self.num_lost >= MAX_PINGS_WITHOUT_REPLY:
+            # Robot firmware doesn't answer pings.
+            self.stop()
+            self.supported = False
+
+    def reply_received(self, ping, receive_time=None):
+        '''
+        Should be called with every Ping received. Receive time is when its bytes arrived (see link.arrival_time()),
+        defaults to now.
+        '''
+        receive_time = receive_time if receive_time is not None else monotonic()
+
+        sent = self.outstanding.pop(ping.sequence, None)
+        if sent is None:
+            return # too late, or from before probe was restarted
+
+        # Time it was written to port if link noted it, otherwise time spent waiting to be sent counts as delay.
+        queued_time, sent_ping = sent
+        send_time = sent_ping.write_time if sent_ping.write_time is not None else queued_time
+
+        self.num_replies += 1
+        self.clock_sync.add_sample(send_time, ping.robot_receive_time, ping.robot_send_time, receive_time)
+
+    def stats(self):
+        '''ClockSync.stats() plus ping counts.'''
+        stats = self.clock_sync.stats()
+        stats.update({'pings_sent': self.num_pings_sent, 'replies': self.num_replies, 'lost': self.num_lost,
+                      'supported': self.supported})
+        return stats
@@ -1,32 +1,41 @@
+import os
 import serial
 from eeva_glob import *
 from version import current_gui_version, compatible_versions
 from validate_params import validate_capture_parameters
-
-from PyQt4.QtCore import QTimer 
+from scheduler import QtScheduler
+from reconnect import AutoReconnector
 
 # Connection settings
 LINK_STATS_TIMER_INTERVAL = 0.25 # seconds
 
+# Seconds without receiving anything before robot is considered lost.
+LOST_CONNECTION_TIMEOUT = 5
+
 class ConnectionController(object):
     
-    def __init__(self, main_controller, link):
+    def __init__(self, main_controller, link, scheduler=None):
         
         self.controller = main_controller
         self.link = link
         
+        # Used to run timer callbacks. Defaults to Qt event loop.
+        self.scheduler = scheduler if scheduler else QtScheduler()
+        
         self.connect_text = "Connect to Eeva"
         self.disconnect_text = "Disconnect"
         
-        # fields for tracking link stats
-        self.last_bytes_tx = 0
-        self.last_bytes_rx = 0
-        
-        # How many consecutive times we haven't received any bytes in timer callback when connected to robot.
-        self.num_times_no_bytes_received = 0
+        # How long robot had been silent when that was last reported (0 if robot is responding).
+        self.silence_reported_duration = 0
         
         self.link_connected = False
         
+        # Port user connected to (or robot was found on again after reconnecting).
+        self.port_name = None
+        
+        # Reopens port and restores robot settings when robot stops responding.
+        self.reconnector = AutoReconnector(self, self.scheduler, main_controller.port_watcher)
+        
     def set_view(self, view):
         self.view = view
         self.view.set_connect_button_text(self.connect_text)
@@ -36,9 +45,18 @@ class ConnectionController(object):
         self.view.clear_all_messages()
         self.controller.display_message("Connecting...")
         self.view.process_events() # immediately show message in case GUI locks up for a little bit
+        
+        # Replies to anything asked for on an old connection are never coming, and robot may have restarted.
+        self.controller.requests.cancel_all()
+        self.controller.pid_cache.clear()
+        self.controller.stop_listening()
+        self.link.receive_only = False
+        
         try:
-            self.link.connect(port_name)
+            # Locked so another EevaUI looking for its robot doesn't try this port while it's in use.
+            self.link.connect(port_name, exclusive=True)
             self.link_connected = True
+            self.port_name = port_name
             self.view.save_default_port(port_name)
             
             # In case we got left in a bad state.
@@ -56,15 +74,64 @@ class ConnectionController(object):
             self.controller.display_message("Success")
             self.view.set_connect_button_text(self.disconnect_text)
             self.controller.reset_controller()
-            # Reset fields of connection controller.
-            self.last_bytes_tx = 0
-            self.last_bytes_rx = 0
-            self.num_times_no_bytes_received = 0
+            self.reset_link_stats()
+            self.reconnector.connection_made(port_name)
+            self.controller.latency_probe.start()
+            
+    def reset_link_stats(self):
+        self.link.meter.reset()
+        self.silence_reported_duration = 0
+            
+    def reopen_port(self, port_name):
+        '''
+        Open port again after connection was lost, without clearing messages. Returns true if port opened.
+        Nothing is sent until port_reconnected() since the port could be in use by another robot.  It's opened
+        locked (if pyserial can) so ports another EevaUI has open are skipped.
+        '''
+        
+        self.controller.requests.cancel_all()
+        self.controller.pid_cache.clear()
+        self.controller.listen_for_robot()
+        self.link.receive_only = True
+        
+        try:
+            self.link.connect(port_name, exclusive=True)
+        except serial.SerialException:
+            self.link.disconnect()
+            return False
+        
+        self.link_connected = True
+        self.reset_link_stats()
+        return True
+        
+    def port_reconnected(self, port_name):
+        '''Called once the robot that was lost is found on port.'''
+        self.link.receive_only = False
+        self.controller.stop_listening()
+        self.controller.stop_data_capture()
+        self.controller.reset_controller()
+        self.port_name = port_name
+        self.view.save_default_port(port_name)
+        self.view.set_port(port_name)
+        self.controller.latency_probe.start()
+        
+    def close_port(self):
+        '''Close port without stopping reconnect.'''
+        self.link.disconnect()
+        self.link_connected = False
+        self.controller.requests.cancel_all()
+        self.controller.latency_probe.stop()
             
     def disconnect_from_port(self):
         
+        self.reconnector.stop()
+        self.controller.stop_listening()
+        self.link.receive_only = False
         self.link.disconnect()
         self.link_connected = False
+        self.controller.requests.cancel_all()
+        self.controller.latency_probe.stop()
+        self.controller.close_telemetry()
         self.view.set_connect_button_text(self.connect_text)
         self.controller.display_message('Disconnected')
 
@@ -74,46 +141,46 @@ class ConnectionController(object):
     def link_timer_elapsed(self):
 
         try:
-            bytes_tx = self.link.num_bytes_sent
-            bytes_rx = self.link.num_bytes_received
-
-            # Estimate bytes per second.  Assume timer actually elapses close to desired rate.
-            bps_tx = max(0, int((bytes_tx - self.last_bytes_tx) / LINK_STATS_TIMER_INTERVAL))
-            bps_rx = max(0, int((bytes_rx - self.last_bytes_rx) / LINK_STATS_TIMER_INTERVAL))
+            # Rates use time that actually passed, timer can run late when GUI is busy.
+            meter = self.link.meter
+            meter.update()
             
             self.view.set_num_msgs_sent(self.link.num_messages_sent)
             self.view.set_num_msgs_received(self.link.num_messages_received)
-            self.view.set_bps_sent(bps_tx)
-            self.view.set_bps_received(bps_rx)
+            self.view.set_bps_sent(int(meter.rates['bytes_sent'].average))
+            self.view.set_bps_received(int(meter.rates['bytes_received'].average))
+            self.view.set_link_meter(meter.stats())
             self.view.set_bad_crc(self.link.num_bad_crc_messages)
             self.view.set_dropped_msgs(self.link.num_dropped_messages)
+            self.view.set_round_trip_times(self.controller.latency_probe.stats())
+            if hasattr(self.link, 'transmitter'):
+                self.view.set_transmit_stats(self.link.transmitter.stats())
             
-            # Save so can calculate bytes per second next time
-            self.last_bytes_tx = bytes_tx
-            self.last_bytes_rx = bytes_rx
-            
-            self.check_for_lost_connection(self.link.num_messages_received, bps_rx)
+            self.check_for_lost_connection(self.link.num_messages_received, meter.seconds_since_received())
             
         finally:
             # Constantly reschedule timer to avoid overlapping calls
-            QTimer.singleShot(LINK_STATS_TIMER_INTERVAL * 1000, self.link_timer_elapsed)
+            self.scheduler.call_later(LINK_STATS_TIMER_INTERVAL, self.link_timer_elapsed)
+        
+    def port_missing(self):
+        # Only detectable where ports are files.
+        return os.name == 'posix' and self.port_name is not None and not os.path.exists(self.port_name)
+        
+    def check_for_lost_connection(self, num_messages_received, silent_duration):
         
-    def check_for_lost_connection(self, num_messages_received, bps_rx):
+        if self.link_connected and (self.port_missing() or not self.link.connection_open()):
+            self.reconnector.connection_lost('port removed')
+            return
         
         if self.link.connection_open() and num_messages_received > 0:
             
-            if bps_rx == 0:
-                self.num_times_no_bytes_received += 1
-            else:
-                self.num_times_no_bytes_received = 0
-                
-            no_bytes_received_duration = self.num_times_no_bytes_received * LINK_STATS_TIMER_INTERVAL
+            if silent_duration < self.silence_reported_duration:
+                self.silence_reported_duration = 0 # received something since
             
-            if no_bytes_received_duration >= 5:
+            if silent_duration - self.silence_reported_duration >= LOST_CONNECTION_TIMEOUT:
                 self.controller.display_message("Eeva not responding...")
-                # Reset flag to avoid constantly printing messages.
-                self.num_times_no_bytes_received = 0
-
-                #self.disconnect_from_port()
-                #self.controller.display_message("If robot is still on and was always in range then make sure your operating system isn't using a power-save mode for bluetooth.")
+                # Only report again if still silent after another timeout.
+                self.silence_reported_duration = silent_duration
+                
+                self.reconnector.connection_lost('not responding')
                 
\ No newline at end of file
@@ -1,3 +1,5 @@
+import binascii
+
 
 # CCITT polynomial 0x1021
 crc_table = (
@@ -36,7 +38,15 @@ crc_table = (
 )
 
 def calculate_crc(data_buffer, buffer_stop, init=0xFFFF):
-    ''' Return 16-bit CRC with CCITT polynomial 0x1021 '''
+    '''
+    Return 16-bit CRC with CCITT polynomial 0x1021 of the first buffer_stop bytes.  Data buffer can be
+    anything that supports the buffer interface (bytearray, str, memoryview) and isn't copied.
+    '''
+    # Same CRC as table_crc() but computed in C.
+    return binascii.crc_hqx(memoryview(data_buffer)[:buffer_stop], init)
+
+def table_crc(data_buffer, buffer_stop, init=0xFFFF):
+    ''' Same as calculate_crc() one byte at a time, like the robot does it. '''
     crc = init
     
     for idx in range(buffer_stop):
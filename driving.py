@@ -0,0 +1,141 @@
+import time
+from eeva_glob import DrivingCommand
+
+# How often a command is repeated while keys are held (or a velocity is set) so robot knows GUI is still alive.
+DRIVING_KEEPALIVE_INTERVAL = 0.2 # seconds
+
+# Number of key-to-send latencies to keep for stats.
+LATENCY_HISTORY_LENGTH = 100
+
+class DrivingCommander(object):
+    '''
+    Sends driving commands as soon as the driving input changes instead of on a fixed timer.
+    While something is being commanded the same command is re-sent every keepalive interval,
+    otherwise identical commands are never sent twice in a row.
+    '''
+
+    def __init__(self, link, scheduler, keepalive_interval=DRIVING_KEEPALIVE_INTERVAL):
+
+        self.link = link
+        self.scheduler = scheduler
+        self.keepalive_interval = keepalive_interval
+
+        self.enabled = False
+
+        # Bits of DrivingCommand.possible_movements currently pressed.
+        self.movement_commands = 0
+        self.linear_velocity = 0.0
+        self.angular_velocity = 0.0
+
+        # Last (movement commands, linear, angular) sent and when. None if nothing sent yet.
+        self.last_sent = None
+        self.last_send_time = 0
+
+        # Scheduler can't cancel timers so each keepalive remembers which one it is and old ones do nothing.
+        self.keepalive_generation = 0
+
+        self.num_commands_sent = 0
+        self.num_keepalives_sent = 0
+        self.num_duplicates_suppressed = 0
+
+        # Seconds from input change until command was handed to link.
+        self.latencies = []
+
+    def enable(self):
+
+        self.enabled = True
+        self.last_sent = None
+        self.update()
+
+    def disable(self):
+        '''Stop driving. If robot was being told to move then it's told to stop first.'''
+
+        if self.enabled and self.is_active():
+            self.movement_commands = 0
+            self.linear_velocity = 0.0
+            self.angular_velocity = 0.0
+            self.update()
+
+        self.enabled = False
+        self.keepalive_generation += 1
+
+    def set_movement_states(self, states, event_time=None):
+        '''
+        States is a dictionary of movement type -> true if pressed. Event time is when the input changed
+        (defaults to now) and is used to measure latency.
+        '''
+        movement_commands = 0
+        for movement_type in DrivingCommand.possible_movements:
+            movement_commands |= (movement_type if states.get(movement_type) else 0)
+
+        self.movement_commands = movement_commands
+        self.update(event_time)
+
+    def set_velocity(self, linear_velocity, angular_velocity, event_time=None):
+        '''Continuous driving input, e.g. from a joystick, in the robot's velocity units.'''
+
+        self.linear_velocity = float(linear_velocity)
+        self.angular_velocity = float(angular_velocity)
+        self.update(event_time)
+
+    def is_active(self):
+        '''True if robot is being told to do something.'''
+        return bool(self.movement_commands or self.linear_velocity or self.angular_velocity)
+
+    def current_command(self):
+        return (self.movement_commands, self.linear_velocity, self.angular_velocity)
+
+    def update(self, event_time=None):
+        '''Send current command right away if it's different from the last one sent.'''
+
+        if not self.enabled:
+            return
+
+        command = self.current_command()
+        if command == self.last_sent:
+            self.num_duplicates_suppressed += 1
+            return
+
+        self.send(command)
+
+        if event_time is not None:
+            self.latencies.append(self.last_send_time - event_time)
+            del self.latencies[:-LATENCY_HISTORY_LENGTH]
+
+        # Restart keepalive from this send.
+        self.keepalive_generation += 1
+        if self.is_active():
+            self.schedule_keepalive()
+
+    def send(self, command):
+
+        movement_commands, linear_velocity, angular_velocity = command
+        self.link.send(DrivingCommand(movement_commands=movement_commands, linear_velocity=linear_velocity,
+                                      angular_velocity=angular_velocity))
+        self.last_sent = command
+        self.last_send_time = time.time()
+        self.num_commands_sent += 1
+
+    def schedule_keepalive(self):
+
+        generation = self.keepalive_generation
+        self.scheduler.call_later(self.keepalive_interval, lambda: self.keepalive_elapsed(generation))
+
+    def keepalive_elapsed(self, generation):
+
+        if generation != self.keepalive_generation or not self.enabled or not self.is_active():
+            return # command changed, driving stopped or nothing to keep alive
+
+        self.send(self.current_command())
+        self.num_keepalives_sent += 1
+        self.schedule_keepalive()
+
+    def latency_stats(self):
+        '''Return dictionary of last/average/max key-to-send latency in milliseconds (empty if none measured).'''
+
+        if not self.latencies:
+            return {}
+
+        return {'last_ms': self.latencies[-1] * 1000.0,
+                'avg_ms': sum(self.latencies) / len(self.latencies) * 1000.0,
+                'max_ms': max(self.latencies) * 1000.0}
@@ -0,0 +1,199 @@
+'''
+Run a single experiment on Eeva from the command line without starting the GUI.
+
+Examples:
+    python eeva_cli.py --port /dev/ttyUSB0 --plan freq_sweep.json
+    python eeva_cli.py --port /dev/ttyUSB0 --mode experiment --experiment 1 --pid 0 1.5 0.2 0 12 5 \
+                       --wave sine --mag 0.2 --freq 2 --duration 5 --rate 100 --samples 500 --output speed_step
+'''
+import sys
+import socket
+import argparse
+from eeva_headless import HeadlessSession
+from eeva_glob import Modes, PidParams
+from fleet import FleetManager
+from event_link import EventGlobLink, SelectLoop
+from experiment_plan import mode_names, wave_names, load_plan, SweepRunner
+from telemetry_fanout import DEFAULT_FANOUT_ADDRESS
+from validate_params import *
+
+def parse_args(argv):
+
+    parser = argparse.ArgumentParser(description='Run an Eeva experiment without the GUI.')
+    parser.add_argument('--list-ports', action='store_true', help='print available serial ports and exit')
+    parser.add_argument('--port', help='serial port robot is connected to')
+    parser.add_argument('--fleet', nargs='+', default=None, metavar='PORT',
+                        help='connect to several robots at once, runs --plan on all of them or shows link health')
+    parser.add_argument('--base-dir', default=None, help='directory to create eeva_output in (default home directory)')
+    parser.add_argument('--mode', choices=sorted(mode_names.keys()), default=None)
+    parser.add_argument('--experiment', type=int, default=None, help='index into experiment list {}'.format(
+                        ', '.join('{}={}'.format(i, e[1]) for i, e in enumerate(Modes.experiments))))
+    parser.add_argument('--pid', nargs=6, action='append', default=[],
+                        metavar=('INDEX', 'KP', 'KI', 'KD', 'SAT', 'INT_SAT'),
+                        help='controller gains, may be given more than once')
+    parser.add_argument('--load-gains', default=None, metavar='NAME', help='send gains saved under name before --pid')
+    parser.add_argument('--save-gains', default=None, metavar='NAME', help='save gains under name after --pid')
+    parser.add_argument('--wave', choices=sorted(wave_names.keys()), default=None)
+    parser.add_argument('--mag', type=float, default=DEFAULT_WAVE_MAGNITUDE)
+    parser.add_argument('--offset', type=float, default=DEFAULT_WAVE_OFFSET)
+    parser.add_argument('--freq', type=float, default=DEFAULT_WAVE_FREQ)
+    parser.add_argument('--duration', type=float, default=DEFAULT_WAVE_DURATION)
+    parser.add_argument('--vmax', type=float, default=None, help='trapezoid max velocity')
+    parser.add_argument('--amax', type=float, default=None, help='trapezoid max acceleration')
+    parser.add_argument('--dx', type=float, default=None, help='trapezoid distance')
+    parser.add_argument('--stream', default=None, metavar='SIGNAL',
+                        help='stream chirp, prbs, multisine or samples from a csv/npy file instead of --wave (needs numpy)')
+    parser.add_argument('--stream-rate', type=float, default=200.0, help='sample rate of streamed wave (Hz)')
+    parser.add_argument('--rate', type=float, default=DEFAULT_CAPTURE_RATE, help='capture rate (Hz)')
+    parser.add_argument('--samples', type=int, default=0, help='number of samples to capture (0 = no capture)')
+    parser.add_argument('--output', default='data', help='output file name without extension')
+    parser.add_argument('--task-timing-interval', type=float, default=0, metavar='SEC',
+                        help='ask robot for task timing every SEC seconds while running')
+    parser.add_argument('--event-link', action='store_true', help='read port from a select() loop instead of reader threads')
+    parser.add_argument('--isolate', action='store_true', help='with --fleet run each robot link in its own process')
+    parser.add_argument('--plan', default=None, help='JSON/YAML experiment plan to run instead of a single experiment')
+    parser.add_argument('--no-reconnect', action='store_true', help="don't reconnect if robot stops responding")
+    parser.add_argument('--fanout', nargs='?', const=DEFAULT_FANOUT_ADDRESS, default=None, metavar='ADDRESS',
+                        help='publish messages to other programs on HOST:PORT or unix:PATH (default {})'.format(
+                        DEFAULT_FANOUT_ADDRESS))
+    parser.add_argument('--quiet', action='store_true', help="don't print status messages")
+
+    return parser.parse_args(argv)
+
+def main(argv):
+
+    args = parse_args(argv)
+
+    link = EventGlobLink(SelectLoop()) if args.event_link else None
+    session = HeadlessSession(base_directory=args.base_dir, verbose=not args.quiet, link=link)
+
+    if args.list_ports:
+        for port_name in session.list_ports():
+            print port_name
+        return 0
+
+    if not args.port and not args.fleet:
+        print 'No port specified.'
+        return 1
+
+    plan = None
+    if args.plan:
+        try:
+            plan = load_plan(args.plan)
+        except (IOError, ValueError) as e:
+            print 'Invalid plan: {}'.format(e)
+            return 1
+
+    if args.fleet:
+        return run_fleet(args.fleet, plan, args)
+
+    session.set_auto_reconnect(not args.no_reconnect)
+
+    if not session.connect(args.port):
+        return 1
+
+    try:
+        if args.fanout:
+            try:
+                address = session.link.start_fanout(args.fanout)
+            except (ValueError, socket.error) as e:
+                print 'Could not start fan-out server: {}'.format(e)
+                return 1
+            session.controller.display_message('Publishing messages on {}'.format(address))
+
+        if args.task_timing_interval > 0:
+            session.schedule_task_timing(args.task_timing_interval)
+
+        if plan is not None:
+            manifest_path = SweepRunner(session, plan).run()
+            session.controller.display_message('Created {}'.format(manifest_path))
+            return 0
+
+        if args.mode is not None:
+            session.select_mode(mode_names[args.mode], args.experiment)
+
+        if args.load_gains:
+            session.load_gain_profile(args.load_gains)
+
+        for index, kp, ki, kd, sat_limit, int_sat_limit in args.pid:
+            session.set_pid_gains(int(index), kp, ki, kd, sat_limit, int_sat_limit)
+
+        if args.save_gains:
+            # Make sure gains have been confirmed by robot before saving them. Each controller is requested
+            # separately (instance is index + 1) unless many changed at once (instance 0).
+            requests = session.controller.requests
+            instances = range(PidParams.num_controllers + 1)
+            session.wait_until(lambda: not any(requests.is_pending(PidParams.id, i) for i in instances), 2.0)
+            session.save_gain_profile(args.save_gains)
+
+        if args.stream is not None:
+            try:
+                session.stream_wave(make_stream_signal(args), args.stream_rate)
+            except (IOError, ValueError, ImportError) as e:
+                print 'Invalid stream signal: {}'.format(e)
+                return 1
+        elif args.wave is not None:
+            session.set_wave(wave_names[args.wave], args.mag, args.offset, args.freq, args.duration,
+                             vmax=args.vmax, amax=args.amax, dx=args.dx)
+        else:
+            session.view.wave_on_startup = False
+
+        if args.samples > 0:
+            data = session.capture(args.samples, args.rate)
+            if not data:
+                return 1
+            session.export(data, args.output)
+        elif args.stream is not None:
+            stream = session.controller.wave_stream
+            session.start()
+            session.wait_until(lambda: not stream.streaming, stream.duration + 2.0)
+        else:
+            session.start()
+            session.wait(args.duration)
+
+    finally:
+        session.link.stop_fanout()
+        session.close()
+
+    return 0
+
+def make_stream_signal(args):
+    '''Return samples for --stream. Generated signals use --mag, --offset, --duration and --freq as highest frequency.'''
+
+    import wave_signals
+
+    if args.stream == 'chirp':
+        return wave_signals.chirp(0.1, args.freq, args.duration, args.stream_rate, args.mag, args.offset)
+    elif args.stream == 'prbs':
+        return wave_signals.prbs(7, args.freq, args.stream_rate, args.mag, args.offset)
+    elif args.stream == 'multisine':
+        freqs = [args.freq * (0.5 ** k) for k in range(5)]
+        return wave_signals.multisine(freqs, args.duration, args.stream_rate, args.mag, args.offset)
+    else:
+        return wave_signals.load_signal(args.stream)
+
+def run_fleet(port_names, plan, args):
+
+    fleet = FleetManager(base_directory=args.base_dir, verbose=not args.quiet, isolate=args.isolate)
+    try:
+        for port_name in port_names:
+            fleet.add_robot(port_name)
+
+        if plan is not None:
+            fleet.run_plan(plan)
+            print fleet.format_health_table()
+        else:
+            # Show link health until user hits Ctrl+C
+            while True:
+                fleet.wait(2.0)
+                print fleet.format_health_table()
+                print
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fleet.close()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -2,35 +2,71 @@ import os
 import sys
 import time
 import csv
-import datetime
 import numbers
+import sqlite3
+import threading
 from eeva_glob import *
 from eeva_io import *
 from validate_params import *
 from version import *
-
-from PyQt4.QtCore import QTimer 
-
-DRIVING_TIMER_INTERVAL = 0.2 # seconds
+from scheduler import QtScheduler
+from request_manager import RequestManager
+from pid_cache import PidParamCache, PidProfileStore, PID_PROFILE_FILENAME, params_to_profile_entry
+from driving import DrivingCommander
+from wave_stream import WaveStreamer
+from trapezoid import plan_trapezoid, TrapezoidError
+from session_catalog import SessionCatalog
+from robot_registry import RobotRegistry
+from task_timing_store import TaskTimingStore, format_regression
+from telemetry_store import TelemetryStore
+from port_watcher import PortWatcher
+from clock_sync import LatencyProbe
+from clock import monotonic
+from transmit_lanes import SAFETY
 
 class EevaController:
 
-    def __init__(self, link):
+    def __init__(self, link, scheduler=None):
         
         self.link = link
         self.view = None
         
+        # Used to run timer callbacks. Defaults to Qt event loop.
+        self.scheduler = scheduler if scheduler else QtScheduler()
+        
         # Hookup to our slot so can run new message callback from main thread.
         self.link.new_message.connect(self.new_message_callback)
         
+        # Tracks outstanding requests so the robot is never asked for the same glob twice at once.
+        self.requests = RequestManager(link, self.scheduler)
+        
+        # Links that decode capture data somewhere else (e.g. another process) pass it on in batches.
+        if hasattr(self.link, 'new_capture_samples'):
+            self.link.new_capture_samples.connect(self.new_capture_samples)
+        
         self.driving_mode_enabled = False
         
+        # Sends driving commands whenever pressed keys (or velocity) change.
+        self.driving = DrivingCommander(link, self.scheduler)
+        
         # List of actively received capture data (cleared after writing to file)
         self.capture_data = []
         
+        # Settings capture was started with, saved in catalog with the data.
+        self.capture_info = None
+        
+        # Last wave settings sent to robot.
+        self.last_wave = None
+        
+        # Directory -> names of files in it, so directory doesn't need to be listed for every file written.
+        self.session_filenames = {}
+        
         # List of messages that store information about robot task timing.
         self.task_timing_results = []
         
+        # Incremented whenever scheduled task timing requests are started or stopped so old timers do nothing.
+        self.task_timing_schedule_generation = 0
+        
         self.capturing_data = False
         
         # Last main mode sent to the robot. 
@@ -40,6 +76,35 @@ class EevaController:
         # List of PID parameters for controllers.
         self.pid_params = [PidParams()] * PidParams.num_controllers
         
+        # Last gains robot confirmed, so only gains that change get sent.
+        self.pid_cache = PidParamCache(link, self.requests, self.display_message)
+        
+        # Sends waves computed on this computer to robot.
+        self.wave_stream = WaveStreamer(link, self.scheduler, self.requests)
+        
+        # Keeps list of serial ports up to date in the background. Started once there's a view to show them in.
+        self.port_watcher = PortWatcher(self.scheduler, self.serial_ports_changed)
+        self.shown_first_port_list = False
+        
+        # Pings robot to measure round trip time and how its clock relates to this computer's.
+        # Started by connection controller once connected.
+        self.latency_probe = LatencyProbe(link, self.scheduler)
+        self.clock_sync = self.latency_probe.clock_sync
+        
+        # Monotonic time last RobotCommand.stop was sent, until robot reports it stopped.
+        self.stop_sent_time = None
+        self.last_stop_latency = None
+        
+        # State robot reported in last status message.
+        self.last_robot_state = None
+        
+        # Estimated monotonic time robot sent last status message (status doesn't have robot time in it).
+        self.last_status_time = None
+        
+        # Every status message of connected robot is stored here once its ID is known (see telemetry_store.py).
+        self.store_telemetry = True
+        self.telemetry = None
+        
         # Set to true once robot's firmware version has been checked for compatibility issues with GUI.
         # Should be reset after each connection to the robot.
         self.verified_firmware_version = False
@@ -47,6 +112,13 @@ class EevaController:
         # Set to true once robot ID has been checked. Should be reset after each connection to robot.
         self.verified_robot_id = False
         
+        # What connected robot reported, None until known.
+        self.robot_id = None
+        self.firmware_version = None
+        
+        # True while finding out which robot is on a port (see listen_for_robot()).
+        self.listen_only = False
+        
         # Last time the user changed the mode from the GUI.
         self.last_mode_change_time = 0
         
@@ -68,19 +140,38 @@ class EevaController:
         self.show_current_pid_params()
         self.verified_firmware_version = False
         self.verified_robot_id = False
+        self.robot_id = None
+        self.firmware_version = None
+        self.capture_info = None
         self.last_mode_change_time = 0
+        self.stop_sent_time = None
+        self.last_robot_state = None
+        self.wave_stream.stop()
         
     def initialize_view(self, view):
         
         self.display_message('GUI version: {}'.format(current_gui_version))
         
-        # Create timestamped directory for current run.
+        # Timestamped directory for current run. Created when the first file is written to it.
         self.output_directory = os.path.join(view.saved_base_directory, 'eeva_output')
         self.session_directory = os.path.join(self.output_directory, time.strftime("output_%Y-%m-%d_%H-%M-%S/"))
-        if not os.path.exists(self.session_directory):
-            os.makedirs(self.session_directory)
+            
+        self.pid_profiles = PidProfileStore(os.path.join(self.output_directory, PID_PROFILE_FILENAME))
+        
+        # Task timing results of every run, for trends across runs and firmware versions.
+        self.task_timing_history = TaskTimingStore(self.output_directory)
         
-        self.request_new_port_list()
+        # Every robot that's connected to this computer. Shared with other instances through a locked file.
+        self.robots = RobotRegistry(self.output_directory)
+        
+        # Add anything written before catalog existed. Done in background since there could be a lot of old runs.
+        self.catalog = SessionCatalog(self.output_directory)
+        index_thread = threading.Thread(target=self.index_catalog)
+        index_thread.setDaemon(True)
+        index_thread.start()
+        
+        # Listing ports can be slow so it's done in the background and doesn't hold up showing the window.
+        self.port_watcher.start()
         
         self.view.select_robot_mode(Modes.balance, 0)
         
@@ -99,33 +190,23 @@ class EevaController:
         
         self.view.set_controller_list([controller[1] for controller in PidParams.controllers])
         
-        self.view.restore_default_port()
+    def driving_keys_changed(self, event_time=None):
+        '''Send driving command based on which keys are currently pressed down. Event time is when key changed.'''
+        self.driving.set_movement_states(self.view.get_driving_command_states(), event_time)
         
-        self.driving_timer_elapsed()
-        
-    def driving_timer_elapsed(self):
-        '''Send driving commands based on which keys are currently pressed down.'''
-        try:
-            if self.driving_mode_enabled:
-                
-                states = self.view.get_driving_command_states()
-                
-                # Set the correct bits based on what driving keys are being pressed.
-                movement_commands = 0x00000000
-                for movement_type in DrivingCommand.possible_movements:
-                    movement_commands |= (movement_type if states[movement_type] else 0)
-
-                msg = DrivingCommand(movement_commands = movement_commands)
-                self.link.send(msg)
-            
-        finally:
-            # Constantly reschedule timer to avoid overlapping calls
-            QTimer.singleShot(DRIVING_TIMER_INTERVAL * 1000, self.driving_timer_elapsed)
+    def set_driving_velocity(self, linear_velocity, angular_velocity):
+        '''Drive with continuous velocity instead of (or on top of) driving keys.'''
+        self.driving.set_velocity(linear_velocity, angular_velocity, time.time())
         
     def verify_firmware_version(self, firmware_version):
 
         self.display_message("Eeva version: {}".format(firmware_version))
         
+        self.firmware_version = firmware_version
+        
+        # Use message layouts of this firmware from now on.
+        self.link.set_firmware_version(firmware_version)
+        
         compatible_firmware_versions = compatible_versions.get(current_gui_version, [])
         
         if firmware_version not in compatible_firmware_versions:
@@ -141,27 +222,57 @@ class EevaController:
         
         self.verified_firmware_version = True
         
+    def listen_for_robot(self):
+        '''
+        Forget which robot is connected and only record the ID of the next one that reports its status, ignoring
+        everything else it sends, until stop_listening().  Used when reconnecting, since a port could have a
+        different robot on it.
+        '''
+        self.listen_only = True
+        self.verified_firmware_version = False
+        self.verified_robot_id = False
+        self.robot_id = None
+        self.firmware_version = None
+        
+    def stop_listening(self):
+        self.listen_only = False
+        
     def verify_robot_id(self, robot_id):
 
         self.display_message("ID: {}".format(robot_id))
         
+        self.robot_id = robot_id
+        
         try:
-            id_filepath = os.path.join(self.output_directory, 'eeva_ids.csv')
-            with open(id_filepath, 'ab+') as id_file:
-                csv_reader = csv.reader(id_file, delimiter=",")
-                stored_ids = [row[0].strip() for row in csv_reader]
-                if robot_id not in stored_ids:
-                    csv_writer = csv.writer(id_file)
-                    now = datetime.datetime.now()
-                    csv_writer.writerow([robot_id, now.strftime("%Y-%m-%d %H:%M:%S")])
-        except:
+            if self.robots.robot_seen(robot_id, self.firmware_version):
+                self.display_message("First time connecting to this robot.")
+        except (IOError, OSError):
             self.display_message("Error when storing ID.")
         
         self.verified_robot_id = True
         
+        if self.store_telemetry:
+            self.open_telemetry(robot_id)
+        
         # Now that robot ID is verified request recent messages, this makes output consistent.
         self.request_recent_text_messages_from_robot()
         
+    def open_telemetry(self, robot_id):
+        '''Start storing status messages of robot, unless they already are (e.g. reconnected to same robot).'''
+        
+        if self.telemetry and self.telemetry.robot_id == robot_id:
+            return
+        self.close_telemetry()
+        self.telemetry = TelemetryStore(self.output_directory, robot_id)
+        self.telemetry.start()
+        
+    def close_telemetry(self):
+        '''Write status messages that are still waiting and stop storing them.'''
+        
+        if self.telemetry:
+            self.telemetry.close()
+            self.telemetry = None
+        
     def verify_robot_mode(self, msg):
 
         # Don't sync to robot mode if we've tried to change mode recently or it will
@@ -179,14 +290,23 @@ class EevaController:
         
         # Send experiment input in case we're in experiment mode.
         if cmd_type == RobotCommand.start:
-            if self.view.run_wave_on_startup():
+            if self.wave_stream.streaming:
+                pass # robot already has streamed wave settings and is filling its buffer
+            elif self.view.run_wave_on_startup():
                 self.send_wave()
             else:
                 self.send_manual_experiment_input()
+            
+            if self.capturing_data and self.capture_info and self.last_wave:
+                # Capture was started paused before the wave was sent.
+                self.capture_info['wave'] = dict(self.last_wave)
         
         cmd = RobotCommand(command = cmd_type)
         self.link.send(cmd)
         
+        if cmd_type == RobotCommand.stop and self.last_robot_state != Modes.stopped:
+            self.stop_sent_time = monotonic()
+        
     def change_robot_mode(self, mode):
         
         cmd = Modes(main_mode = mode, sub_mode=self.last_sub_mode)
@@ -219,8 +339,56 @@ class EevaController:
         wave = Wave(wave_type=wave_type, mag=mag, offset=offset, freq=freq, 
                     duration=duration, run_continuous=run_continuous, wave_time=0)
         
+        if wave_type == Wave.trapezoidal:
+            profile = self.plan_trapezoid_wave()
+            if profile is None:
+                return # don't send a profile robot can't follow
+            wave.vmax = profile.vmax
+            wave.amax = profile.amax
+            wave.dx = profile.dx
+            wave.ts_and_cs = profile.ts_and_cs()
+        
         self.link.send(wave)
         
+        self.last_wave = {'type': wave_type, 'mag': mag, 'offset': offset, 'freq': freq, 'duration': duration,
+                          'run_continuous': run_continuous}
+        if wave_type == Wave.trapezoidal:
+            self.last_wave.update({'vmax': wave.vmax, 'amax': wave.amax, 'dx': wave.dx})
+        
+    def plan_trapezoid_wave(self):
+        '''Return trapezoid profile for current settings, or None (and tell user why) if it isn't feasible.'''
+        
+        vmax, amax, dx = validate_trapezoid_parameters(self.view)
+        duration = float(self.view.get_wave_duration())
+        
+        try:
+            return plan_trapezoid(vmax, amax, dx, max_duration=duration if duration > 0 else None)
+        except TrapezoidError as e:
+            self.display_message(str(e))
+            return None
+        
+    def trapezoid_parameters_changed(self):
+        
+        profile = self.plan_trapezoid_wave()
+        if profile:
+            self.display_message('Trapezoid: {}'.format(profile.describe()))
+        
+    def stream_wave(self, values, sample_rate):
+        '''Send wave of values (list or numpy array) to robot to play at sample rate (Hz) when it's next started.'''
+        
+        if len(values) == 0:
+            self.display_message('Streamed wave has no samples.')
+            return
+        
+        self.wave_stream.start(values, sample_rate, self.wave_stream_finished)
+        self.last_wave = {'type': Wave.streamed, 'freq': float(sample_rate), 'num_samples': len(values)}
+        self.display_message('Streaming {} samples ({:.1f} seconds).'.format(len(values), self.wave_stream.duration))
+        
+    def wave_stream_finished(self, stream):
+        
+        self.display_message('Finished streamed wave. {} chunks sent, {} resent, {} buffer underruns.'.format(
+                             stream.num_chunks_sent, stream.num_chunks_resent, stream.num_underruns))
+        
     def change_capture_status(self):
         
         if self.capturing_data:
@@ -240,6 +408,16 @@ class EevaController:
         msg = CaptureCommand(is_start=1, paused=paused, freq=rate, desired_samples=samples)
         self.link.send(msg)
         
+        self.capture_info = {'robot_id': self.robot_id,
+                             'firmware_version': self.firmware_version,
+                             'main_mode': self.last_main_mode,
+                             'sub_mode': self.last_sub_mode,
+                             'wave': dict(self.last_wave) if self.last_wave else None,
+                             'pid': [params_to_profile_entry(params) for params in self.pid_params],
+                             'sample_rate': rate,
+                             'expected_samples': samples,
+                             'dropped_at_start': self.link.num_dropped_messages}
+        
         self.capturing_data = True
         self.view.set_capture_button_text("Stop Collecting")
         
@@ -266,11 +444,26 @@ class EevaController:
         msg = Wave(wave_type=Wave.constant, offset=command, run_continuous=True)
         
         self.link.send(msg)
+        
+        self.last_wave = {'type': Wave.constant, 'offset': command, 'run_continuous': True}
     
     def new_message_callback(self, id, instance, body):
         
+        self.requests.message_received(id, instance, body)
+        
+        # Decoded with layouts of robot's firmware version once it's known.
+        msg = self.link.codecs.decode(id, instance, body)
+        if msg is None and id in received_glob_types:
+            self.display_message("Received glob with ID {} that doesn't match any known layout ({} bytes)".format(id, len(body)))
+            return
+        
+        if self.listen_only:
+            if id == GlobID.StatusData and not self.verified_robot_id:
+                self.robot_id = msg.data['robot_id']
+                self.verified_robot_id = True
+            return
+        
         if id == GlobID.AssertMessage:
-            msg = AssertMessage.from_bytes(body)
             if msg.valid:
                 self.display_message(msg.message, 'assert')
                 if msg.action == AssertMessage.stop_action:
@@ -279,13 +472,13 @@ class EevaController:
                     self.display_message('Robot will restart...', 'assert')
         
         elif id == GlobID.DebugMessage:
-            msg = DebugMessage.from_bytes(body)
             if msg.valid:
                 self.display_message(msg.message, 'robot')
         
         elif id == GlobID.StatusData:
-            msg = StatusData.from_bytes(body)
+            self.last_status_time = monotonic() - self.clock_sync.one_way_delay()
             self.view.update_robot_status(msg.data)
+            self.check_robot_stopped(msg.data['state'])
             
             if not self.verified_firmware_version:
                 self.verify_firmware_version(msg.data['firmware_version'])
@@ -295,17 +488,20 @@ class EevaController:
                 
             self.verify_robot_mode(msg.data)
             
-        elif id == GlobID.CaptureData:
+            if self.telemetry:
+                self.telemetry.append(time.time(), msg.data)
             
-            msg = CaptureData.from_bytes(body)
+        elif id == GlobID.WaveBufferStatus:
+            self.wave_stream.buffer_status_received(msg)
             
-            if len(self.capture_data) == 0:
-                self.display_message('Receiving data...')
-                
-            self.capture_data.append(msg.as_tuple())
+        elif id == GlobID.Ping:
+            self.latency_probe.reply_received(msg, self.link.arrival_time(id, body))
+            
+        elif id == GlobID.CaptureData:
+            
+            self.new_capture_samples([msg.as_tuple()])
             
         elif id == GlobID.CaptureCommand:
-            msg = CaptureCommand.from_bytes(body)
             expected_samples = msg.total_samples
             
             if (not self.capturing_data and len(self.capture_data) == 0) or (expected_samples == 0):
@@ -324,6 +520,10 @@ class EevaController:
                 self.display_message("Only received {} of {} samples.".format(len(self.capture_data), expected_samples))
             else: # Received more data than expected.
                 self.display_message("Received too many samples ({}). Only expecting {}.".format(len(self.capture_data), expected_samples))
+                
+            if self.capture_info:
+                self.capture_info['expected_samples'] = expected_samples
+                self.capture_info['dropped_messages'] = self.link.num_dropped_messages - self.capture_info.pop('dropped_at_start', 0)
 
             self.write_data_to_file()
             
@@ -338,29 +538,18 @@ class EevaController:
             if instance > len(self.pid_params):
                 self.display_message("Received params for unknown controller with ID {}".format(controller_id))
                 return
-            
-            msg = PidParams.from_bytes(body, instance)
 
             self.pid_params[controller_id] = msg
+            self.pid_cache.confirm(msg)
             
             # Update view for whichever controller is showing.
             self.show_current_pid_params()
-            
-            # If all parameters were being sent back make sure they all got here.
-            if instance == PidParams.num_controllers:
-                for k, pid_params in enumerate(self.pid_params):
-                    if not pid_params.received:
-                        #self.display_message("Failed to receive parameters for {}".format(PidParams.controllers[k]))
-                        #self.display_message("Requesting PID parameters again.")
-                        self.request_controller_gains_from_robot()
-                        break
                     
         elif id == GlobID.TaskTimingResult:
-            
-            msg = TaskTimingResult.from_bytes(body, instance)
 
             if msg.task_name[:4].lower() == "done":
                 self.write_task_timing_results_to_file()
+                self.add_task_timing_results_to_history()
                 self.task_timing_results = []
             else:
                 self.task_timing_results.append(msg)
@@ -368,6 +557,38 @@ class EevaController:
         else:
             self.display_message("Received unhandled glob with ID {}".format(id))
             
+    def check_robot_stopped(self, state):
+        
+        if self.stop_sent_time is not None and state == Modes.stopped:
+            # Status is only sent every so often so this is the most it could have taken.
+            self.last_stop_latency = self.last_status_time - self.stop_sent_time
+            self.stop_sent_time = None
+            message = 'Robot stopped within {:.0f} ms of stop command'.format(self.last_stop_latency * 1000)
+            transmitter = getattr(self.link, 'transmitter', None)
+            if transmitter and transmitter.last_wait(SAFETY) is not None:
+                message += ' ({:.1f} ms of that waiting to be sent)'.format(transmitter.last_wait(SAFETY) * 1000)
+            self.display_message(message + '.')
+            
+        self.last_robot_state = state
+            
+    def capture_host_times(self, samples=None):
+        '''
+        Return time.time() equivalent of each capture sample's robot time (defaults to current capture data).
+        Raises ValueError if robot clock isn't known yet (e.g. firmware doesn't answer pings).
+        '''
+        samples = samples if samples is not None else self.capture_data
+        return [self.clock_sync.robot_to_wall_time(sample[0]) for sample in samples]
+        
+    def new_capture_samples(self, samples):
+        
+        if self.listen_only:
+            return # could be from another robot
+        
+        if len(self.capture_data) == 0:
+            self.display_message('Receiving data...')
+            
+        self.capture_data.extend(samples)
+            
     def show_current_pid_params(self):
         
         pid_idx = self.view.get_controller_index()
@@ -381,8 +602,75 @@ class EevaController:
     
     def request_controller_gains_from_robot(self):
         
-        # Request all instances of PID parameters.
-        self.link.send(Request(PidParams.id, instance=0))
+        # Request all instances of PID parameters. Any that get lost are re-requested by the request manager.
+        all_instances = range(1, PidParams.num_controllers + 1)
+        self.requests.request(PidParams.id, instance=0, expected_instances=all_instances,
+                              callback=self.controller_gains_request_finished)
+        
+    def controller_gains_request_finished(self, request):
+        
+        if not request.succeeded and self.link.connection_open():
+            for instance in sorted(request.missing_instances):
+                self.display_message("Failed to receive parameters for {}".format(PidParams.controllers[instance - 1][1]))
+        
+    def save_pid_profile(self, name):
+        
+        try:
+            self.pid_profiles.save(name, self.pid_cache)
+            self.display_message('Saved gains as "{}"'.format(name))
+        except (IOError, ValueError):
+            self.display_message('Error when saving gains.')
+        
+    def load_pid_profile(self, name):
+        
+        try:
+            profile_params = self.pid_profiles.get(name)
+        except KeyError:
+            self.display_message('No gains saved as "{}"'.format(name))
+            return
+        except (IOError, ValueError):
+            self.display_message('Error when loading gains.')
+            return
+        
+        changed = self.pid_cache.update_many(profile_params)
+        for index in changed:
+            self.pid_params[index] = profile_params[index]
+        self.show_current_pid_params()
+        
+        self.display_message('Loaded gains "{}" ({} controllers changed)'.format(name, len(changed)))
+        
+    def robot_state(self):
+        '''Return settings the robot needs to be given again if it restarts (see restore_robot_state).'''
+        
+        pid_params = {}
+        for index in range(PidParams.num_controllers):
+            params = self.pid_cache.current_params(index)
+            if params is not None:
+                pid_params[index] = params
+        
+        return {'main_mode': self.last_main_mode, 'sub_mode': self.last_sub_mode, 'pid_params': pid_params}
+        
+    def restore_robot_state(self, state, callback=None):
+        '''
+        Send mode, gains and capture settings all at once without waiting for replies in between.
+        Callback is called with the gains request once robot has confirmed them (or the request fails).
+        '''
+        self.link.send(Modes(main_mode=state['main_mode'], sub_mode=state['sub_mode']))
+        self.last_main_mode = state['main_mode']
+        self.last_sub_mode = state['sub_mode']
+        self.last_mode_change_time = time.time()
+        self.view.select_robot_mode(self.last_main_mode, self.last_sub_mode)
+        
+        self.pid_cache.update_many(state['pid_params'])
+        for index, params in state['pid_params'].items():
+            self.pid_params[index] = params
+        self.show_current_pid_params()
+        
+        validate_capture_parameters(self, self.view)
+        
+        # Covers every controller, including any that weren't changed, so all gains shown are what robot has.
+        all_instances = range(1, PidParams.num_controllers + 1)
+        self.requests.request(PidParams.id, instance=0, expected_instances=all_instances, callback=callback)
         
     def request_recent_text_messages_from_robot(self):
         
@@ -405,6 +693,15 @@ class EevaController:
         # Toggle driving mode
         self.driving_mode_enabled = not self.driving_mode_enabled
         
+        if self.driving_mode_enabled:
+            self.driving.set_movement_states(self.view.get_driving_command_states())
+            self.driving.enable()
+        else:
+            self.driving.disable()
+            latency = self.driving.latency_stats()
+            if latency:
+                self.display_message('Driving key latency: avg {:.1f} ms, max {:.1f} ms'.format(latency['avg_ms'], latency['max_ms']))
+        
     def write_data_to_file(self):
         
         if len(self.capture_data) == 0:
@@ -424,13 +721,40 @@ class EevaController:
     
             filename = "data_" + time.strftime("%Y-%m-%d-%H-%M-%S")
             
-        filename = make_filename_unique(self.session_directory, filename)
+        filename = self.unique_session_filename(filename)
             
         # update text box so user can see actually used name
         self.view.set_data_capture_filename(filename)
-            
+        
+        self.export_capture_data(filename, self.capture_data)
+        
+    def make_session_directory(self):
+        '''Create session directory if it doesn't exist yet and return it.'''
+        if not os.path.exists(self.session_directory):
+            os.makedirs(self.session_directory)
+        return self.session_directory
+        
+    def unique_session_filename(self, filename):
+        '''Return filename (without extension) that isn't used yet in session directory.'''
+        
+        self.make_session_directory()
+        
+        names = self.session_filenames.get(self.session_directory)
+        if names is None:
+            names = self.session_filenames[self.session_directory] = DirectoryNames(self.session_directory)
+        
+        filename = make_filename_unique(self.session_directory, filename, names)
+        names.add(filename)
+        return filename
+        
+    def export_capture_data(self, filename, data, capture_info=None):
+        '''
+        Write data to csv and matlab files in session directory and add it to catalog. Capture info defaults
+        to settings of the last capture started. Return csv file path or None on error.
+        '''
+        
         csv_filename = filename + ".csv"
-        csv_filepath = os.path.join(self.session_directory, csv_filename)
+        csv_filepath = os.path.join(self.make_session_directory(), csv_filename)
 
         matlab_filename = filename + ".m"
         matlab_filepath = os.path.join(self.session_directory, matlab_filename)
@@ -438,19 +762,44 @@ class EevaController:
         column_names = ('time', 'd1', 'd2', 'd3', 'd4', 'd5', 'd6', 'd7', 'd8')
         
         try:
-            write_to_csv(csv_filepath, column_names, self.capture_data)
+            write_to_csv(csv_filepath, column_names, data)
             self.display_message('Created {}'.format(csv_filename))
-            write_to_matlab_script_file(matlab_filepath, column_names, self.capture_data)
+            write_to_matlab_script_file(matlab_filepath, column_names, data)
             self.display_message('Created {}'.format(matlab_filename))
         except IOError:
             self.display_message('IO Error. Filename {} is most likely invalid.'.format(csv_filename))
+            return None
+        
+        capture_info = capture_info if capture_info else self.capture_info
+        
+        try:
+            self.catalog.add_capture(csv_filepath, len(data), capture_info)
+        except sqlite3.Error as e:
+            self.display_message('Error adding {} to catalog: {}'.format(csv_filename, e))
+        
+        try:
+            self.robots.capture_added(capture_info.get('robot_id') if capture_info else self.robot_id)
+        except (IOError, OSError):
+            pass # only used for stats
+        
+        return csv_filepath
+        
+    def index_catalog(self):
+        
+        if not os.path.exists(self.output_directory):
+            return # nothing written yet
+        
+        try:
+            self.catalog.index_directory()
+        except (sqlite3.Error, OSError, IOError):
+            pass # catalog still works for new captures
             
     def write_task_timing_results_to_file(self):
         
         if len(self.task_timing_results) == 0:
             return
             
-        filename = make_filename_unique(self.session_directory, "task_timing")
+        filename = self.unique_session_filename("task_timing")
         filepath = os.path.join(self.session_directory, filename + ".csv")
         
         column_names = ('Task', 'Duration', 'Counts', 'Skip', 'Delay Max', 'Delay Min', 'Delay Avg', 'Run Max',
@@ -478,20 +827,56 @@ class EevaController:
         except IOError:
             self.display_message('IO Error. Filename {} is most likely invalid.'.format(filename))
 
+    def add_task_timing_results_to_history(self):
+        
+        if len(self.task_timing_results) == 0:
+            return
+        
+        try:
+            self.task_timing_history.add_run(self.task_timing_results, self.robot_id, self.firmware_version)
+        except (IOError, ValueError):
+            self.display_message('Error when adding task timing to history.')
+            return
+        
+        for regression in self.task_timing_history.find_regressions(robot_id=self.robot_id):
+            self.display_message('Task timing regression: {}'.format(format_regression(regression)), 'assert')
+            
+    def start_task_timing_schedule(self, interval):
+        '''Ask robot for task timing every interval seconds, e.g. to track timing jitter during long runs.'''
+        
+        self.task_timing_schedule_generation += 1
+        generation = self.task_timing_schedule_generation
+        
+        def request_task_timing():
+            if generation != self.task_timing_schedule_generation:
+                return # schedule was stopped or restarted
+            self.send_robot_command(RobotCommand.task_timing)
+            self.scheduler.call_later(interval, request_task_timing)
+            
+        self.scheduler.call_later(interval, request_task_timing)
+        
+    def stop_task_timing_schedule(self):
+        self.task_timing_schedule_generation += 1
+        
     def open_output_directory(self):
         
         if self.capturing_data:
             self.display_message("Please finish collecting data first.")
             return
         
-        open_output_directory_in_viewer(self.session_directory, self)
+        open_output_directory_in_viewer(self.make_session_directory(), self)
         
     def request_new_port_list(self):
+        '''Have port watcher list every port again. View is updated if anything changed.'''
         
         self.display_message('Refreshing ports')
+        self.port_watcher.request_scan()
         
-        from serial.tools import list_ports
-        port_list = [l[0] for l in list_ports.comports()]
-    
-        self.view.show_serial_ports(port_list)
+    def serial_ports_changed(self, ports):
+        
+        self.view.show_serial_ports([port['device'] for port in ports], [port['description'] for port in ports])
+        
+        if not self.shown_first_port_list:
+            self.shown_first_port_list = True
+            self.view.restore_default_port()
         
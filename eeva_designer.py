@@ -31,9 +31,6 @@ class Ui_MainWindow(object):
         sizePolicy.setVerticalStretch(0)
         sizePolicy.setHeightForWidth(MainWindow.sizePolicy().hasHeightForWidth())
         MainWindow.setSizePolicy(sizePolicy)
-        icon = QtGui.QIcon()
-        icon.addPixmap(QtGui.QPixmap(_fromUtf8(":/Images/NERLogoTransparent.png")), QtGui.QIcon.Normal, QtGui.QIcon.Off)
-        MainWindow.setWindowIcon(icon)
         self.centralwidget = QtGui.QWidget(MainWindow)
         self.centralwidget.setObjectName(_fromUtf8("centralwidget"))
         self.gridLayout_2 = QtGui.QGridLayout(self.centralwidget)
@@ -190,6 +187,14 @@ class Ui_MainWindow(object):
         self.droppedLineEdit.setReadOnly(True)
         self.droppedLineEdit.setObjectName(_fromUtf8("droppedLineEdit"))
         self.gridLayout_7.addWidget(self.droppedLineEdit, 2, 3, 1, 1)
+        self.label_97 = QtGui.QLabel(self.connectionGroupBox)
+        self.label_97.setObjectName(_fromUtf8("label_97"))
+        self.gridLayout_7.addWidget(self.label_97, 3, 0, 1, 1)
+        self.rttLineEdit = QtGui.QLineEdit(self.connectionGroupBox)
+        self.rttLineEdit.setAlignment(QtCore.Qt.AlignCenter)
+        self.rttLineEdit.setReadOnly(True)
+        self.rttLineEdit.setObjectName(_fromUtf8("rttLineEdit"))
+        self.gridLayout_7.addWidget(self.rttLineEdit, 3, 1, 1, 3)
         self.verticalLayout_17.addWidget(self.connectionGroupBox)
         self.mainHorizontalLayout.addWidget(self.verticalFrame_3)
         self.verticalLayout2 = QtGui.QVBoxLayout()
@@ -950,6 +955,7 @@ class Ui_MainWindow(object):
         self.label_94.setText(_translate("MainWindow", "Tx Packets", None))
         self.label_95.setText(_translate("MainWindow", "Bad CRC", None))
         self.label_96.setText(_translate("MainWindow", "Dropped", None))
+        self.label_97.setText(_translate("MainWindow", "RTT (ms)", None))
         self.modeGroupBox.setTitle(_translate("MainWindow", "Mode", None))
         self.balanceRadioButton.setText(_translate("MainWindow", "Balance", None))
         self.horizontalRadioButton.setText(_translate("MainWindow", "Horizontal", None))
@@ -1019,4 +1025,3 @@ class Ui_MainWindow(object):
         self.label_49.setText(_translate("MainWindow", "---", None))
         self.actionChange_Output_Directory.setText(_translate("MainWindow", "Change Output Directory", None))
 
-import images_rc
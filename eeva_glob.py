@@ -1,6 +1,9 @@
 
 import struct
-import math
+from glob_schema import Field, Derived, padding, GlobCodecRegistry, RADIANS_TO_DEGREES, RAD_PER_SEC_TO_RPM, hex_string
+
+# Layouts in 'schemas' are keyed by first firmware version that uses them. These go back to the first firmware.
+FIRST_FIRMWARE = 0
 
 class GlobID:
     
@@ -16,8 +19,18 @@ class GlobID:
     PidParams = 18
     Request = 19
     TaskTimingResult = 20
+    WaveChunk = 21
+    WaveBufferStatus = 22
+    Ping = 23
 
 class EevaGlob(object):
+    '''
+    Body layouts are declared in 'schemas' (see glob_schema.py) and 'codec' is set to the newest one.
+    Use codecs_for_firmware() to pack and unpack for a specific robot.
+    '''
+    
+    # Name of dictionary attribute that decoded fields go in. None sets them as attributes.
+    fields_target = None
     
     @property
     def id(self):
@@ -29,6 +42,20 @@ class EevaGlob(object):
         obj.unpack(data_bytes)
         return obj
     
+    def pack(self):
+        return self.codec.pack(self)
+    
+    def body_size(self):
+        return self.codec.size
+    
+    def pack_into(self, buffer, offset):
+        '''Pack body into buffer starting at offset. Returns body size.'''
+        self.codec.pack_into(self, buffer, offset)
+        return self.codec.size
+    
+    def unpack(self, data_bytes):
+        self.codec.unpack_into(self, data_bytes)
+    
 class DrivingCommand(EevaGlob):
     
     # Unique class ID
@@ -42,8 +69,9 @@ class DrivingCommand(EevaGlob):
     
     possible_movements = [forward, reverse, turn_left, turn_right, stop]
     
-    # Struct format for packing/unpacking. Little-endian no padding.
-    data_format = '<Iff'
+    schemas = {FIRST_FIRMWARE: [Field('movement_commands', 'I'),
+                                Field('linear_velocity', 'f'),
+                                Field('angular_velocity', 'f')]}
     
     def __init__(self, movement_commands=0, linear_velocity=0, angular_velocity=0, instance=1):
         '''Constructor'''
@@ -51,58 +79,53 @@ class DrivingCommand(EevaGlob):
         self.movement_commands = movement_commands
         self.linear_velocity = linear_velocity
         self.angular_velocity = angular_velocity
-
-    def pack(self):
-
-        return struct.pack(DrivingCommand.data_format, self.movement_commands, self.linear_velocity, self.angular_velocity)
     
 class StatusData(EevaGlob):
     
     # Unique class ID
     id = GlobID.StatusData
     
-    # Struct format for packing/unpacking. Little-endian no padding.
-    data_format = '<' + ('f' * 4) + ('B' * 4) + ('f' * 10) + 'i' + ('B' * 12)
+    # Decoded fields go in data dictionary.
+    fields_target = 'data'
+    
+    schemas = {FIRST_FIRMWARE: [Field('battery', 'f', unit='V'),
+                                Field('roll', 'f', scale=RADIANS_TO_DEGREES, unit='deg'),
+                                Field('pitch', 'f', scale=RADIANS_TO_DEGREES, unit='deg'),
+                                Field('yaw', 'f', scale=RADIANS_TO_DEGREES, unit='deg'),
+                                Field('main_mode', 'B'),
+                                Field('sub_mode', 'B'),
+                                Field('state', 'B'),
+                                Field('pad0', 'B'),
+                                Field('left_linear_position', 'f', unit='m'),
+                                Field('right_linear_position', 'f', unit='m'),
+                                Field('left_angular_position', 'f', scale=RADIANS_TO_DEGREES, unit='deg'),
+                                Field('right_angular_position', 'f', scale=RADIANS_TO_DEGREES, unit='deg'),
+                                Field('left_linear_velocity', 'f', unit='m/s'),
+                                Field('right_linear_velocity', 'f', unit='m/s'),
+                                Field('left_angular_velocity', 'f', scale=RAD_PER_SEC_TO_RPM, unit='RPM'),
+                                Field('right_angular_velocity', 'f', scale=RAD_PER_SEC_TO_RPM, unit='RPM'),
+                                Field('left_pwm', 'f', scale=100, unit='%'),
+                                Field('right_pwm', 'f', scale=100, unit='%'),
+                                Field('firmware_version', 'i'),
+                                Field('robot_id', 'B', count=12, convert=hex_string),
+                                Derived('left_voltage', 'battery * left_pwm / 100.0', unit='V'),
+                                Derived('right_voltage', 'battery * right_pwm / 100.0', unit='V')]}
     
     def __init__(self, instance=1):
         '''Constructor'''
         self.instance = instance
         self.data = {}
-
-    def unpack(self, data_bytes):
-        
-        values = struct.unpack(StatusData.data_format, data_bytes)
-        self.data["battery"] = values[0]
-        self.data["roll"] = math.degrees(values[1])
-        self.data["pitch"] = math.degrees(values[2])
-        self.data["yaw"] = math.degrees(values[3])
-        self.data["main_mode"] = values[4]
-        self.data["sub_mode"] = values[5]
-        self.data["state"] = values[6]
-        self.data["pad0"] = values[7]
-        self.data["left_linear_position"] = values[8]
-        self.data["right_linear_position"] = values[9]
-        self.data["left_angular_position"] = math.degrees(values[10])
-        self.data["right_angular_position"] = math.degrees(values[11])
-        self.data["left_linear_velocity"] = values[12]
-        self.data["right_linear_velocity"] = values[13]
-        self.data["left_angular_velocity"] = math.degrees(values[14]) * 60.0 / 360.0  # rad/s to RPM
-        self.data["right_angular_velocity"] = math.degrees(values[15]) * 60.0 / 360.0  # rad/s to RPM
-        self.data["left_pwm"] = values[16] * 100  # to percentage
-        self.data["right_pwm"] = values[17] * 100  # to percentage
-        self.data["left_voltage"] = self.data["battery"] * self.data["left_pwm"] / 100.0
-        self.data["right_voltage"] = self.data["battery"] * self.data["right_pwm"] / 100.0
-        self.data["firmware_version"] = values[18]
-        robot_id_bytes = values[19:31]
-        self.data["robot_id"] = ''.join('{:02X}'.format(b) for b in robot_id_bytes)
             
 class CaptureCommand(EevaGlob):
     
     # Unique class ID
     id = GlobID.CaptureCommand
     
-    # Struct format for packing/unpacking. Little-endian no padding.
-    data_format = '<BBHII'
+    schemas = {FIRST_FIRMWARE: [Field('is_start', 'B'),
+                                Field('paused', 'B'),
+                                Field('freq', 'H', unit='Hz'),
+                                Field('desired_samples', 'I'),
+                                Field('total_samples', 'I')]}
     
     def __init__(self, is_start=0, paused=0, freq=1, desired_samples=1, total_samples=1, instance=1):
         '''Constructor'''
@@ -112,38 +135,20 @@ class CaptureCommand(EevaGlob):
         self.freq = freq
         self.desired_samples = desired_samples
         self.total_samples = total_samples
-
-    def pack(self):
-        
-        return struct.pack(CaptureCommand.data_format, self.is_start, self.paused, self.freq,
-                            self.desired_samples, self.total_samples)
-
-    def unpack(self, data_bytes):
-        
-        values = struct.unpack(CaptureCommand.data_format, data_bytes)
-        self.is_start = values[0]
-        self.paused = values[1]
-        self.freq = values[2]
-        self.desired_samples = values[3]
-        self.total_samples = values[4]
         
 class CaptureData(EevaGlob):
     
     # Unique class ID
     id = GlobID.CaptureData
     
-    # Struct format for packing/unpacking. Little-endian no padding.
-    data_format = '<' + ('f' * 9)
+    # Time (robot clock seconds) followed by 8 data values.
+    schemas = {FIRST_FIRMWARE: [Field('values', 'f', count=9),
+                                Derived('time', 'values[0]', unit='s'),
+                                Derived('data', 'values[1:]')]}
     
     def __init__(self, instance=1):
         '''Constructor'''
         self.instance = instance
-
-    def unpack(self, data_bytes):
-        
-        self.values = struct.unpack(CaptureData.data_format, data_bytes)
-        self.time = self.values[0]
-        self.data = self.values[1:]
         
     def as_tuple(self):
         return self.values
@@ -157,35 +162,26 @@ class AssertMessage(EevaGlob):
     restart_action = 1
     stop_action = 2
     
-    # Struct format for packing/unpacking. Little-endian no padding.
-    data_format = '<I200sI'
+    schemas = {FIRST_FIRMWARE: [Field('action', 'I'),
+                                Field('message', '200s'),
+                                Field('valid', 'I', convert=bool, unconvert=int)]}
     
     def __init__(self, instance=1):
         '''Constructor'''
         self.instance = instance
 
-    def unpack(self, data_bytes):
-        
-        self.action, self.message, valid = struct.unpack(AssertMessage.data_format, data_bytes)
-        self.valid = bool(valid)
-
 class DebugMessage(EevaGlob):
     
     # Unique class ID
     id = GlobID.DebugMessage
     
-    # Struct format for packing/unpacking. Little-endian no padding.
-    data_format = '<200sI'
+    schemas = {FIRST_FIRMWARE: [Field('message', '200s'),
+                                Field('valid', 'I', convert=bool, unconvert=int)]}
     
     def __init__(self, instance=1):
         '''Constructor'''
         self.instance = instance
 
-    def unpack(self, data_bytes):
-        
-        self.message, valid = struct.unpack(DebugMessage.data_format, data_bytes)
-        self.valid = bool(valid)
-
 class Modes(EevaGlob):
     
     # Unique class ID
@@ -209,8 +205,9 @@ class Modes(EevaGlob):
                    (2, "Wheel Angular Position"),
                    (3, "Motor Voltage")]
     
-    # Struct format for packing/unpacking. Little-endian no padding.
-    data_format = '<BBB'
+    schemas = {FIRST_FIRMWARE: [Field('main_mode', 'B'),
+                                Field('sub_mode', 'B'),
+                                Field('state', 'B')]}
     
     def __init__(self, main_mode=balance, sub_mode=0, state=normal, instance=1):
         '''Constructor'''
@@ -218,10 +215,6 @@ class Modes(EevaGlob):
         self.main_mode = main_mode
         self.sub_mode = sub_mode
         self.state = state
-        
-    def pack(self):
-
-        return struct.pack(Modes.data_format, self.main_mode, self.sub_mode, self.state)
 
 class RobotCommand(EevaGlob):
     
@@ -233,17 +226,12 @@ class RobotCommand(EevaGlob):
     reset = 2
     task_timing = 3
     
-    # Struct format for packing/unpacking. Little-endian no padding.
-    data_format = '<B'
+    schemas = {FIRST_FIRMWARE: [Field('command', 'B')]}
     
     def __init__(self, command=stop, instance=1):
         '''Constructor'''
         self.instance = instance
         self.command = command
-        
-    def pack(self):
-
-        return struct.pack(RobotCommand.data_format, self.command)
     
 class Wave(EevaGlob):
     
@@ -256,6 +244,7 @@ class Wave(EevaGlob):
     triangle = 2
     trapezoidal = 3
     constant = 4
+    streamed = 5 # samples come from WaveChunk globs, freq is sample rate
     
     # wave states
     stopped = 0
@@ -263,8 +252,22 @@ class Wave(EevaGlob):
     starting_up = 2
     started = 3
     
-    # Struct format for packing/unpacking. Little-endian no padding.
-    data_format = '<BBBBfffffffBBBB' + (15 * 'f')
+    schemas = {FIRST_FIRMWARE: [Field('type', 'B'),
+                                Field('state', 'B'),
+                                padding('B', 2),
+                                Field('value', 'f'),
+                                Field('mag', 'f'),
+                                Field('freq', 'f', unit='Hz'),
+                                Field('duration', 'f', unit='s'),
+                                Field('offset', 'f'),
+                                Field('time', 'f', unit='s'),
+                                Field('total_time', 'f', unit='s'),
+                                Field('run_continuous', 'B'),
+                                padding('B', 3),
+                                Field('vmax', 'f'),
+                                Field('amax', 'f'),
+                                Field('dx', 'f'),
+                                Field('ts_and_cs', 'f', count=12)]}
     
     def __init__(self, **kargs):
         '''Constructor'''
@@ -287,12 +290,83 @@ class Wave(EevaGlob):
         self.vmax = kargs.get('vmax', 0)
         self.amax = kargs.get('amax', 0)
         self.dx = kargs.get('dx', 0)
-        self.ts_and_cs = [0] * 12  # calculated on robot
+        # Segment times and coefficients from trapezoid.plan_trapezoid(). All zeros lets robot calculate them.
+        self.ts_and_cs = kargs.get('ts_and_cs', [0] * 12)
+
+class WaveChunk(EevaGlob):
+    
+    # Unique class ID
+    id = GlobID.WaveChunk
+    
+    # Most samples that fit in one message.
+    max_samples = 60
+    
+    # Flags
+    last_chunk = 1
+    
+    # Struct format of header, followed by one float per value. Little-endian no padding.
+    # Length varies so there's no schema for it.
+    header_format = '<IBB'
+    header_size = struct.calcsize(header_format)
+    
+    def __init__(self, start_index=0, values=(), flags=0, instance=1):
+        '''Constructor'''
+        self.instance = instance
+        self.start_index = start_index # index of first value in the whole streamed wave
+        self.values = list(values)
+        self.flags = flags
         
     def pack(self):
+        
+        # Only as many values as there are so short chunks don't waste bandwidth.
+        return struct.pack(WaveChunk.header_format + 'f' * len(self.values), self.start_index,
+                           len(self.values), self.flags, *self.values)
+    
+    def body_size(self):
+        return WaveChunk.header_size + 4 * len(self.values)
+    
+    def pack_into(self, buffer, offset):
+        struct.pack_into(WaveChunk.header_format + 'f' * len(self.values), buffer, offset, self.start_index,
+                         len(self.values), self.flags, *self.values)
+        return self.body_size()
+    
+class WaveBufferStatus(EevaGlob):
+    
+    # Unique class ID
+    id = GlobID.WaveBufferStatus
+    
+    schemas = {FIRST_FIRMWARE: [Field('next_index', 'I'),
+                                Field('samples_played', 'I'),
+                                Field('free_space', 'H'),
+                                Field('num_underruns', 'H')]}
+    
+    def __init__(self, instance=1):
+        '''Constructor'''
+        self.instance = instance
+        self.next_index = 0 # index of next sample robot is expecting
+        self.samples_played = 0
+        self.free_space = 0 # samples
+        self.num_underruns = 0
 
-        return struct.pack(Wave.data_format, self.type, self.state, 0, 0, self.value, self.mag, self.freq, self.duration,
-                           self.offset, self.time, self.total_time, self.run_continuous, 0, 0, 0, self.vmax, self.amax, self.dx, *self.ts_and_cs)
+class Ping(EevaGlob):
+    
+    # Unique class ID
+    id = GlobID.Ping
+    
+    schemas = {FIRST_FIRMWARE: [Field('sequence', 'I'),
+                                Field('robot_receive_time', 'd', unit='s'),
+                                Field('robot_send_time', 'd', unit='s')]}
+    
+    # Host monotonic time a sent ping was written to the port, set by link's transmitter.
+    write_time = None
+    
+    def __init__(self, sequence=0, instance=1):
+        '''Constructor'''
+        self.instance = instance
+        self.sequence = sequence # echoed back so reply can be matched to the ping
+        # Filled in by robot when it echoes ping. Seconds on same clock as CaptureData.time.
+        self.robot_receive_time = 0
+        self.robot_send_time = 0
 
 class PidParams(EevaGlob):
     
@@ -311,8 +385,15 @@ class PidParams(EevaGlob):
     
     num_controllers = len(controllers)
     
-    # Struct format for packing/unpacking. Little-endian no padding.
-    data_format = '<' + ('f' * 7)
+    schemas = {FIRST_FIRMWARE: [Field('kp', 'f'),
+                                Field('ki', 'f'),
+                                Field('kd', 'f'),
+                                Field('integral_lolimit', 'f'),
+                                Field('integral_hilimit', 'f'),
+                                Field('lolimit', 'f'),
+                                Field('hilimit', 'f'),
+                                # Mark that glob is now valid.
+                                Derived('received', 'True')]}
     
     def __init__(self, **kargs):
         '''Constructor'''
@@ -328,78 +409,74 @@ class PidParams(EevaGlob):
         
         # Not part of actual glob.  Used so GUI can keep track which ones have been received.
         self.received = False
-
-    def pack(self):
-        
-        return struct.pack(PidParams.data_format, self.kp, self.ki, self.kd,
-                           self.integral_lolimit, self.integral_hilimit,
-                           self.lolimit, self.hilimit)
-
-    def unpack(self, data_bytes):
-        
-        values = struct.unpack(PidParams.data_format, data_bytes)
-        self.kp = values[0]
-        self.ki = values[1]
-        self.kd = values[2]
-        self.integral_lolimit = values[3]
-        self.integral_hilimit = values[4]
-        self.lolimit = values[5]
-        self.hilimit = values[6]
-        
-        # Mark that glob is now valid.
-        self.received = True
         
 class Request(EevaGlob):
     
     # Special ID for requesting globs
     id = GlobID.Request
 
-    # Struct format for packing/unpacking. Little-endian no padding.
-    data_format = '<B'
+    schemas = {FIRST_FIRMWARE: [Field('requested_id', 'B')]}
     
-    def __init__(self, requested_id, instance=1):
+    def __init__(self, requested_id=0, instance=1):
         '''Constructor'''
         self.instance = instance
         self.requested_id = requested_id
 
-    def pack(self):
-
-        return struct.pack(Request.data_format, self.requested_id)
-
 class TaskTimingResult(EevaGlob):
     
     # Unique class ID
     id = GlobID.TaskTimingResult
     
-    # Struct format for packing/unpacking. Little-endian no padding.
-    data_format = '<32sIfII' + (9 * 'I')
+    # Delays and run times are sent in timer ticks.
+    schemas = {FIRST_FIRMWARE: [Field('task_name', '32s'),
+                                Field('timer_frequency', 'I', unit='Hz'),
+                                Field('recording_duration', 'f', unit='s'),
+                                Field('execute_counts', 'I'),
+                                Field('times_skipped', 'I')] +
+                               [Field(name, 'I', scale=1.0e6, per='timer_frequency', unit='us')
+                                for name in ('delay_usec_max', 'delay_usec_min', 'delay_usec_avg',
+                                             'run_usec_max', 'run_usec_min', 'run_usec_avg',
+                                             'interval_usec_max', 'interval_usec_min', 'interval_usec_avg')]}
     
     def __init__(self, instance=1):
         '''Constructor'''
         self.instance = instance
 
-    def unpack(self, data_bytes):
-        
-        values = struct.unpack(TaskTimingResult.data_format, data_bytes)
-        
-        self.task_name = values[0]
-        
-        self.timer_frequency = values[1]
-        
-        ticks2usec = 1.0e6 / self.timer_frequency
-        
-        self.recording_duration = values[2]
-        self.execute_counts = values[3] 
-        self.times_skipped = values[4]
+# Globs the robot sends to the GUI, by ID.
+received_glob_types = {GlobID.AssertMessage: AssertMessage,
+                       GlobID.DebugMessage: DebugMessage,
+                       GlobID.CaptureData: CaptureData,
+                       GlobID.CaptureCommand: CaptureCommand,
+                       GlobID.StatusData: StatusData,
+                       GlobID.PidParams: PidParams,
+                       GlobID.TaskTimingResult: TaskTimingResult,
+                       GlobID.WaveBufferStatus: WaveBufferStatus,
+                       GlobID.Ping: Ping}
 
-        self.delay_usec_max = values[5] * ticks2usec
-        self.delay_usec_min = values[6] * ticks2usec
-        self.delay_usec_avg = values[7] * ticks2usec
-        
-        self.run_usec_max = values[8] * ticks2usec
-        self.run_usec_min = values[9] * ticks2usec
-        self.run_usec_avg = values[10] * ticks2usec
-        
-        self.interval_usec_max = values[11] * ticks2usec
-        self.interval_usec_min = values[12] * ticks2usec
-        self.interval_usec_avg = values[13] * ticks2usec
+# Globs the link notes the host time of when they're written to the port and when their bytes arrive, since
+# time spent waiting to be sent or handled would otherwise count as link delay (see clock_sync.py).
+timestamped_ids = (GlobID.Ping,)
+
+# Every glob with a fixed layout.
+schema_glob_types = [DrivingCommand, StatusData, CaptureCommand, CaptureData, AssertMessage, DebugMessage, Modes,
+                     RobotCommand, Wave, WaveBufferStatus, Ping, PidParams, Request, TaskTimingResult]
+
+# Codecs for every layout are built once here.
+glob_codecs = GlobCodecRegistry(schema_glob_types)
+
+for glob_type in schema_glob_types:
+    glob_type.codec = glob_codecs.latest(glob_type.id)
+    # Newest layout, for code that packs or unpacks bodies itself.
+    glob_type.data_format = glob_type.codec.format
+
+def codecs_for_firmware(firmware_version):
+    '''Return GlobCodecs for robot firmware version (None if not known yet, uses newest layouts).'''
+    return glob_codecs.codecs_for_firmware(firmware_version)
+
+def decode_glob(id, instance, body, codecs=None):
+    '''Return glob object for received message, or None if ID isn't one the robot sends.'''
+    if id not in received_glob_types:
+        return None
+    if codecs is None:
+        codecs = codecs_for_firmware(None)
+    return codecs.decode(id, instance, body)
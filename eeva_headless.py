@@ -0,0 +1,514 @@
+import os
+import sys
+import time
+import Queue
+from glob_link_base import BaseGlobLink
+from robot_process import BaseProcessGlobLink
+from eeva_controller import EevaController
+from connection_controller import ConnectionController
+from scheduler import HeadlessScheduler
+from eeva_glob import *
+from validate_params import *
+
+class QueuedSignal(object):
+    '''Signal that queues emitted values until process_events() is called, like a queued Qt connection.'''
+
+    def __init__(self, wakeup=None, pending=None):
+        self.slots = []
+        # Signals that share a pending queue are handled in the order they were emitted.
+        self.pending = pending if pending is not None else Queue.Queue()
+        # Optional threading.Event shared by several signals so one thread can wait on all of them.
+        self.wakeup = wakeup
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self, *args):
+        self.pending.put((self, args))
+        if self.wakeup:
+            self.wakeup.set()
+
+    def process_events(self, timeout=0):
+        return process_queued_events(self.pending, timeout)
+
+def process_queued_events(pending, timeout=0):
+    '''Call slots for every queued emit. Waits up to timeout seconds for the first one. Returns number handled.'''
+    num_handled = 0
+    try:
+        signal, args = pending.get(block=timeout > 0, timeout=timeout if timeout > 0 else None)
+        while True:
+            for slot in signal.slots:
+                slot(*args)
+            num_handled += 1
+            signal, args = pending.get_nowait()
+    except Queue.Empty:
+        pass
+
+    return num_handled
+
+class HeadlessGlobLink(BaseGlobLink):
+    '''Glob link that doesn't need a Qt event loop.  Messages are handled when process_events() is called.'''
+
+    def __init__(self, wakeup=None):
+
+        BaseGlobLink.__init__(self)
+
+        self.new_message = QueuedSignal(wakeup)
+
+    def process_events(self, timeout=0):
+        return self.new_message.process_events(timeout)
+
+class HeadlessProcessGlobLink(BaseProcessGlobLink):
+    '''Process isolated link that doesn't need a Qt event loop.'''
+
+    def __init__(self, wakeup=None, ring_capacity=50000):
+
+        BaseProcessGlobLink.__init__(self, ring_capacity)
+
+        # Share one queue so samples and messages are handled in the order they arrived.
+        pending = Queue.Queue()
+        self.new_message = QueuedSignal(wakeup, pending)
+        self.new_capture_samples = QueuedSignal(wakeup, pending)
+
+    def process_events(self, timeout=0):
+        return self.new_message.process_events(timeout)
+
+class NullView(object):
+    '''
+    Implements the same interface as EevaMainWindow but just stores values so the controllers
+    can run without a GUI. Text fields are stored as strings just like the line edits return them.
+    '''
+
+    def __init__(self, base_directory=None, verbose=True, out_stream=None):
+
+        self.saved_base_directory = base_directory if base_directory else os.path.expanduser('~')
+        self.verbose = verbose
+        self.out_stream = out_stream if out_stream else sys.stdout
+
+        self.messages = []
+        self.default_port = ''
+        self.port = ''
+        self.port_names = []
+        self.port_descriptions = None
+        self.connect_button_text = ''
+        self.capture_button_text = ''
+
+        self.main_mode = Modes.balance
+        self.sub_mode = 0
+        self.experiment_names = []
+        self.experiment_list_visible = False
+
+        self.controller_names = []
+        self.controller_index = 0
+        self.pid_fields = {'kp': '0', 'ki': '0', 'kd': '0', 'sat_limit': '0', 'int_sat_limit': '0'}
+
+        self.capture_rate = str(DEFAULT_CAPTURE_RATE)
+        self.capture_samples = str(DEFAULT_NUM_SAMPLES)
+        self.capture_duration = ''
+        self.data_capture_filename = 'data'
+        self.generate_filename = False
+
+        self.wave_type = Wave.sine
+        self.wave_mag = str(DEFAULT_WAVE_MAGNITUDE)
+        self.wave_offset = str(DEFAULT_WAVE_OFFSET)
+        self.wave_freq = str(DEFAULT_WAVE_FREQ)
+        self.wave_duration = str(DEFAULT_WAVE_DURATION)
+        self.wave_continuous = False
+        self.wave_on_startup = True
+        self.trapezoid_params = {'vmax': str(DEFAULT_TRAPEZOID_VMAX), 'amax': str(DEFAULT_TRAPEZOID_AMAX),
+                                 'dx': str(DEFAULT_TRAPEZOID_DX)}
+
+        self.manual_command = str(DEFAULT_MANUAL_COMMAND)
+        self.manual_command_increment = str(DEFAULT_MANUAL_INCREMENT)
+
+        self.driving_command_states = dict((m, False) for m in DrivingCommand.possible_movements)
+
+        self.robot_status = {}
+        self.link_stats = {}
+
+    # Messages
+    def display_message(self, message, color):
+        self.messages.append(message)
+        if self.verbose:
+            self.out_stream.write(str(message) + '\n')
+    def clear_all_messages(self):
+        self.messages = []
+    def process_events(self):
+        pass
+
+    # Connection
+    def set_connect_button_text(self, new_text):
+        self.connect_button_text = new_text
+    def save_default_port(self, port_name):
+        self.default_port = port_name
+    def restore_default_port(self):
+        self.set_port(self.default_port)
+    def show_serial_ports(self, port_names, descriptions=None):
+        self.port_names = port_names
+        self.port_descriptions = descriptions
+    def set_port(self, port_name):
+        if port_name in self.port_names:
+            self.port = port_name
+
+    # Modes
+    def select_robot_mode(self, mode, submode):
+        self.main_mode = mode
+        if mode == Modes.experiment:
+            self.sub_mode = submode
+    def set_experiment_list(self, experiment_names):
+        self.experiment_names = experiment_names
+    def set_experiment_list_visibility(self, make_visible):
+        self.experiment_list_visible = make_visible
+
+    # PID Parameters
+    def set_controller_list(self, controller_names):
+        self.controller_names = controller_names
+    def get_controller_index(self):
+        return self.controller_index
+    def get_pid_parameters(self):
+        return dict(self.pid_fields)
+    def set_pid_parameters(self, params):
+        self.pid_fields['kp'] = '{:.5g}'.format(params.kp)
+        self.pid_fields['ki'] = '{:.5g}'.format(params.ki)
+        self.pid_fields['kd'] = '{:.5g}'.format(params.kd)
+        self.pid_fields['sat_limit'] = '{:.5g}'.format(params.hilimit)
+        self.pid_fields['int_sat_limit'] = '{:.5g}'.format(params.integral_hilimit)
+
+    # Robot Status
+    def update_robot_status(self, status):
+        self.robot_status = status
+
+    # Data Capture
+    def set_capture_rate(self, new):
+        self.capture_rate = str(round(new, 3))
+    def set_capture_duration(self, new):
+        self.capture_duration = '{:.5g}'.format(new)
+    def set_capture_samples(self, new):
+        self.capture_samples = str(int(new))
+    def get_capture_rate(self):
+        return self.capture_rate
+    def get_capture_duration(self):
+        return self.capture_duration
+    def get_capture_samples(self):
+        return self.capture_samples
+    def get_data_capture_filename(self):
+        return self.data_capture_filename
+    def set_data_capture_filename(self, fname):
+        self.data_capture_filename = fname
+    def need_to_generate_filename(self):
+        return self.generate_filename
+    def set_generate_filename(self, state):
+        self.generate_filename = state
+    def set_capture_button_text(self, text):
+        self.capture_button_text = text
+
+    # Connection Status
+    def set_num_msgs_sent(self, new):
+        self.link_stats['msgs_sent'] = new
+    def set_num_msgs_received(self, new):
+        self.link_stats['msgs_received'] = new
+    def set_bps_sent(self, new):
+        self.link_stats['bps_sent'] = new
+    def set_bps_received(self, new):
+        self.link_stats['bps_received'] = new
+    def set_link_meter(self, stats):
+        self.link_stats['meter'] = stats
+    def set_bad_crc(self, new):
+        self.link_stats['bad_crc'] = new
+    def set_dropped_msgs(self, new):
+        self.link_stats['dropped'] = new
+    def set_round_trip_times(self, stats):
+        self.link_stats['round_trip'] = stats
+    def set_transmit_stats(self, stats):
+        self.link_stats['transmit'] = stats
+
+    # Wave
+    def get_selected_wave_type(self):
+        return self.wave_type
+    def set_wave_mag(self, new_value):
+        self.wave_mag = str(new_value)
+    def set_wave_offset(self, new_value):
+        self.wave_offset = str(new_value)
+    def set_wave_freq(self, new_value):
+        self.wave_freq = str(new_value)
+    def set_wave_duration(self, new_value):
+        self.wave_duration = str(new_value)
+    def get_wave_mag(self):
+        return self.wave_mag
+    def get_wave_offset(self):
+        return self.wave_offset
+    def get_wave_freq(self):
+        return self.wave_freq
+    def get_wave_duration(self):
+        return self.wave_duration
+    def run_wave_continuous(self):
+        return self.wave_continuous
+    def run_wave_on_startup(self):
+        return self.wave_on_startup
+    def get_trapezoid_parameters(self):
+        return self.trapezoid_params
+    def set_trapezoid_parameters(self, params):
+        self.trapezoid_params = dict((key, str(value)) for key, value in params.items())
+
+    # Manual experiment input
+    def set_manual_command(self, new_value):
+        self.manual_command = str(new_value)
+    def set_manual_command_increment(self, new_value):
+        self.manual_command_increment = str(new_value)
+    def get_manual_command(self):
+        return self.manual_command
+    def get_manual_command_increment(self):
+        return self.manual_command_increment
+
+    # Driving
+    def get_driving_command_states(self):
+        return self.driving_command_states
+    def update_driving_mode_button(self, text, color):
+        pass
+
+class HeadlessController(EevaController):
+    '''Controller that keeps finished captures in memory so the caller decides when and where to export them.'''
+
+    def __init__(self, link, scheduler=None):
+
+        EevaController.__init__(self, link, scheduler)
+
+        # List of sample lists, one per completed capture, and settings each was captured with.
+        self.completed_captures = []
+        self.completed_capture_infos = []
+
+    def reset_controller(self):
+        EevaController.reset_controller(self)
+        self.completed_captures = []
+        self.completed_capture_infos = []
+
+    def write_data_to_file(self):
+
+        if len(self.capture_data) == 0:
+            return
+
+        self.completed_captures.append(list(self.capture_data))
+        self.completed_capture_infos.append(dict(self.capture_info) if self.capture_info else None)
+
+class HeadlessSession(object):
+    '''Script API for running experiments on a robot without starting the GUI.'''
+
+    def __init__(self, base_directory=None, verbose=True, link=None, controller_class=HeadlessController):
+
+        self.scheduler = HeadlessScheduler()
+        self.link = link if link else HeadlessGlobLink()
+        self.controller = controller_class(self.link, self.scheduler)
+        self.connection_controller = ConnectionController(self.controller, self.link, self.scheduler)
+        self.view = NullView(base_directory, verbose)
+        self.controller.set_view(self.view)
+        self.connection_controller.set_view(self.view)
+        self.connection_controller.start_link_timer()
+
+    @property
+    def session_directory(self):
+        '''Directory files from this session are written to (created if it doesn't exist yet).'''
+        return self.controller.make_session_directory()
+
+    def list_ports(self):
+        '''Return list of serial port names (scans now instead of waiting for port watcher).'''
+        return [port['device'] for port in self.controller.port_watcher.scan()]
+
+    def connect(self, port_name, settle_time=1.0):
+        '''Open port and wait settle_time seconds for robot status. Returns true if connected.'''
+        self.connection_controller.connect_to_port(port_name)
+        if not self.connection_controller.link_connected:
+            return False
+        self.wait_until(lambda: self.controller.verified_robot_id, settle_time)
+        return True
+
+    def disconnect(self):
+        self.connection_controller.disconnect_from_port()
+
+    def set_auto_reconnect(self, enabled):
+        '''Reconnect and restore settings if robot stops responding (on by default).'''
+        self.connection_controller.reconnector.enabled = enabled
+
+    def recovery_stats(self):
+        '''Number of times connection was recovered and mean/max seconds it took.'''
+        return self.connection_controller.reconnector.recovery_stats()
+
+    def status_history(self, columns=None, start_time=None, end_time=None, resolution=None):
+        '''
+        StatusData stored for connected robot (see TelemetryStore.query), e.g. status_history(['battery'],
+        time.time() - 86400) for the last day.  Messages from the last minute may not be written yet.
+        '''
+        telemetry = self.controller.telemetry
+        return telemetry.query(columns, start_time, end_time, resolution) if telemetry else None
+
+    def round_trip_stats(self):
+        '''Round trip time percentiles (ms), clock drift (ppm) and ping counts (see clock_sync.py).'''
+        return self.controller.latency_probe.stats()
+
+    def transmit_stats(self):
+        '''
+        Messages sent, collapsed and waiting, and how long they waited (ms), for each transmit lane.
+        Empty if link sends from another process.
+        '''
+        transmitter = getattr(self.link, 'transmitter', None)
+        return transmitter.stats() if transmitter else {}
+
+    def robot_to_wall_time(self, robot_time):
+        '''Convert robot time (e.g. CaptureData time) to time.time() equivalent. Raises ValueError until synchronized.'''
+        return self.controller.clock_sync.robot_to_wall_time(robot_time)
+
+    def process_events(self, timeout=0):
+        '''Handle received messages and due timers. Waits up to timeout seconds for new messages.'''
+        timeout = min(timeout, self.scheduler.time_until_next(default=timeout))
+        self.link.process_events(timeout)
+        self.scheduler.run_pending()
+
+    def wait(self, duration):
+        '''Keep processing events for duration seconds.'''
+        self.wait_until(lambda: False, duration)
+
+    def wait_until(self, condition, timeout):
+        '''Process events until condition() returns true or timeout (seconds) elapses. Return last condition value.'''
+        end_time = time.time() + timeout
+        while not condition():
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return False
+            self.process_events(min(remaining, 0.05))
+        return True
+
+    def set_pid_gains(self, controller_index, kp=0, ki=0, kd=0, sat_limit=0, int_sat_limit=0):
+        '''Send gains for controller index into PidParams.controllers.'''
+        self.view.controller_index = controller_index
+        self.view.pid_fields = {'kp': str(kp), 'ki': str(ki), 'kd': str(kd),
+                                'sat_limit': str(sat_limit), 'int_sat_limit': str(int_sat_limit)}
+        validate_pid_parameters(self.controller, send=True)
+        self.process_events()
+
+    def save_gain_profile(self, name):
+        '''Save current gains of every controller under name.'''
+        self.controller.save_pid_profile(name)
+
+    def load_gain_profile(self, name):
+        '''Send saved gains, only for controllers that differ from what robot has.'''
+        self.controller.load_pid_profile(name)
+        self.process_events()
+
+    def drive(self, movements=(), linear_velocity=0, angular_velocity=0):
+        '''
+        Drive robot with movements (list of DrivingCommand movement types) and/or continuous velocity.
+        Command is kept alive until drive() is called with something else or stop_driving() is called.
+        '''
+        if not self.controller.driving_mode_enabled:
+            self.controller.change_driving_mode()
+
+        for movement_type in DrivingCommand.possible_movements:
+            self.view.driving_command_states[movement_type] = movement_type in movements
+        self.controller.driving_keys_changed(time.time())
+        self.controller.set_driving_velocity(linear_velocity, angular_velocity)
+        self.process_events()
+
+    def stop_driving(self):
+        for movement_type in DrivingCommand.possible_movements:
+            self.view.driving_command_states[movement_type] = False
+        if self.controller.driving_mode_enabled:
+            self.controller.change_driving_mode()
+        self.process_events()
+
+    def select_mode(self, main_mode, experiment_number=None):
+        '''Change main mode. Experiment number is an index into Modes.experiments.'''
+        self.controller.change_robot_mode(main_mode)
+        if experiment_number is not None:
+            self.controller.change_experiment(experiment_number)
+        self.view.select_robot_mode(main_mode, self.controller.last_sub_mode)
+        self.process_events()
+
+    def set_wave(self, wave_type=Wave.sine, mag=DEFAULT_WAVE_MAGNITUDE, offset=DEFAULT_WAVE_OFFSET,
+                 freq=DEFAULT_WAVE_FREQ, duration=DEFAULT_WAVE_DURATION, run_continuous=False,
+                 vmax=None, amax=None, dx=None):
+        '''Store wave settings that get sent when the robot is started. vmax, amax and dx are for trapezoid waves.'''
+        for key, value in (('vmax', vmax), ('amax', amax), ('dx', dx)):
+            if value is not None:
+                self.view.trapezoid_params[key] = str(value)
+        validate_trapezoid_parameters(self.view)
+        self.view.wave_type = wave_type
+        self.view.wave_mag = str(mag)
+        self.view.wave_offset = str(offset)
+        self.view.wave_freq = str(freq)
+        self.view.wave_duration = str(duration)
+        self.view.wave_continuous = run_continuous
+        self.view.wave_on_startup = True
+        validate_wave_parameters(self.view)
+
+    def send_wave(self, **kargs):
+        '''Store wave settings and send them right away.'''
+        self.set_wave(**kargs)
+        self.controller.send_wave()
+
+    def schedule_task_timing(self, interval):
+        '''Ask robot for task timing every interval seconds (None or 0 to stop). Results go in task timing history.'''
+        if interval:
+            self.controller.start_task_timing_schedule(interval)
+        else:
+            self.controller.stop_task_timing_schedule()
+
+    def stream_wave(self, values, sample_rate):
+        '''Stream precomputed wave (e.g. from wave_signals.py) to robot. It's played once robot is started.'''
+        self.controller.stream_wave(values, sample_rate)
+        self.process_events()
+
+    def set_capture(self, samples=DEFAULT_NUM_SAMPLES, rate=DEFAULT_CAPTURE_RATE):
+        self.view.set_capture_samples(samples)
+        self.view.set_capture_rate(rate)
+        return validate_capture_parameters(self.controller, self.view)
+
+    def start(self):
+        self.controller.send_robot_command(RobotCommand.start)
+
+    def stop(self):
+        self.controller.send_robot_command(RobotCommand.stop)
+
+    def capture(self, samples=DEFAULT_NUM_SAMPLES, rate=DEFAULT_CAPTURE_RATE, start_robot=True, timeout_margin=3.0):
+        '''
+        Collect samples at rate (Hz), optionally starting the robot at the same time like 'Start and Collect'.
+        Returns list of sample tuples (possibly partial or empty if robot didn't respond in time).
+        '''
+        duration = self.set_capture(samples, rate)
+        self.process_events(0.1) # let robot validate settings
+
+        num_completed = len(self.controller.completed_captures)
+
+        if start_robot:
+            self.controller.start_data_capture(paused=True)
+            self.start()
+        else:
+            self.controller.start_data_capture()
+
+        finished = self.wait_until(lambda: len(self.controller.completed_captures) > num_completed,
+                                   duration + timeout_margin)
+        if finished:
+            return self.controller.completed_captures[-1]
+
+        # Robot never reported that capture finished so keep whatever made it through.
+        self.controller.display_message("Capture timed out.")
+        partial_data = list(self.controller.capture_data)
+        self.controller.stop_data_capture()
+        self.controller.capture_data = []
+        return partial_data
+
+    def export(self, data, filename='data', capture_info=None):
+        '''
+        Write data to a uniquely named csv and matlab file in session directory and add it to catalog.
+        Capture info (see capture_info()) defaults to the last capture started. Returns csv file path.
+        '''
+        filename = self.controller.unique_session_filename(filename)
+        return self.controller.export_capture_data(filename, data, capture_info)
+
+    def capture_info(self):
+        '''Settings the last capture was started with, to pass to export() if exporting later.'''
+        return dict(self.controller.capture_info) if self.controller.capture_info else None
+
+    def close(self):
+        if self.connection_controller.link_connected:
+            self.stop()
+            self.disconnect()
+        self.controller.port_watcher.stop()
@@ -3,6 +3,12 @@ import sys
 import os
 import csv
 import subprocess
+import contextlib
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
         
 def write_to_csv(filepath, column_names, data):
     
@@ -44,6 +50,30 @@ def open_output_directory_in_viewer(out_directory, controller=None):
             if controller:
                 controller.display_message("OS not supported.")
 
+@contextlib.contextmanager
+def locked_file(filepath, mode):
+    '''Open file and hold an exclusive lock on it so other programs using this don't write at the same time.'''
+    
+    with open(filepath, mode) as locked:
+        if sys.platform == 'win32':
+            # Locks a byte far past the end of the file since whole file can't be locked.
+            locked.seek(0x7FFFFFFF)
+            msvcrt.locking(locked.fileno(), msvcrt.LK_LOCK, 1)
+            locked.seek(0, os.SEEK_END if 'a' in mode else os.SEEK_SET)
+            try:
+                yield locked
+            finally:
+                locked.flush()
+                locked.seek(0x7FFFFFFF)
+                msvcrt.locking(locked.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(locked.fileno(), fcntl.LOCK_EX)
+            try:
+                yield locked
+            finally:
+                locked.flush()
+                fcntl.flock(locked.fileno(), fcntl.LOCK_UN)
+
 def make_filepath_unique(path):
     
     _, fname = os.path.split(path)
@@ -58,11 +88,34 @@ def make_filepath_unique(path):
         
     return path
 
-def make_filename_unique(directory, fname_no_ext):
+class DirectoryNames(object):
+    '''
+    File names (without extension) in a directory. Directory is only listed the first time it's needed,
+    after that whoever writes files there should add() the names so nothing has to be listed again.
+    '''
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.names = None
+        
+    def load(self):
+        if self.names is None:
+            contents = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+            self.names = set(os.path.splitext(c)[0] for c in contents)
+        return self.names
+        
+    def __contains__(self, name):
+        return name in self.load()
+    
+    def add(self, name):
+        self.load().add(name)
+
+def make_filename_unique(directory, fname_no_ext, dir_fnames=None):
     
     original_fname = fname_no_ext
-    dir_contents = os.listdir(directory)
-    dir_fnames = [os.path.splitext(c)[0] for c in dir_contents]
+    if dir_fnames is None:
+        dir_contents = os.listdir(directory)
+        dir_fnames = [os.path.splitext(c)[0] for c in dir_contents]
     
     while fname_no_ext in dir_fnames:
         
@@ -74,4 +127,4 @@ def make_filename_unique(directory, fname_no_ext):
         except ValueError:
             fname_no_ext = '{}_{}'.format(original_fname, 1)
 
-    return fname_no_ext
\ No newline at end of file
+    return fname_no_ext
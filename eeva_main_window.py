@@ -1,4 +1,5 @@
 
+import time
 import threading
 import os
 
@@ -12,6 +13,8 @@ from PyQt4.QtGui import QMainWindow, QColor, QFileDialog
 from eeva_designer import Ui_MainWindow
 from eeva_glob import DrivingCommand, RobotCommand, Modes, Wave, PidParams
 from validate_params import *
+from trapezoid import plan_trapezoid
+from transmit_lanes import lane_names
 
 class EevaMainWindow(QMainWindow, Ui_MainWindow):
     
@@ -26,6 +29,10 @@ class EevaMainWindow(QMainWindow, Ui_MainWindow):
         self.controller = controller
         self.connection_controller = connection_controller
         
+        # Trapezoid settings don't have fields on main form, they're edited in a dialog.
+        self.trapezoid_params = {'vmax': str(DEFAULT_TRAPEZOID_VMAX), 'amax': str(DEFAULT_TRAPEZOID_AMAX),
+                                 'dx': str(DEFAULT_TRAPEZOID_DX)}
+        
         # Main Command Buttons
         self.startButton.clicked.connect(self.start_button_clicked)
         self.stopButton.clicked.connect(self.stop_button_clicked)
@@ -236,17 +243,25 @@ class EevaMainWindow(QMainWindow, Ui_MainWindow):
     def refresh_ports_button_clicked(self):
         
         self.controller.request_new_port_list()
-        self.restore_default_port()
         
     def save_default_port(self, port_name):
         '''Save port as default for next time application opens.'''
         self.settings.setValue("default_port", port_name)
 
-    def show_serial_ports(self, port_names):
+    def show_serial_ports(self, port_names, descriptions=None):
 
+        # List can change while window is open so keep whatever port was selected.
+        selected_port = str(self.portsComboBox.currentText())
+        
         self.portsComboBox.clear()
         self.portsComboBox.addItems(port_names)
         
+        if descriptions:
+            for index, description in enumerate(descriptions):
+                self.portsComboBox.setItemData(index, description, Qt.ToolTipRole)
+        
+        self.set_port(selected_port)
+        
     def set_port(self, port_name):
         
         index = self.portsComboBox.findText(port_name)
@@ -340,16 +355,44 @@ class EevaMainWindow(QMainWindow, Ui_MainWindow):
     # Connection Status
     def set_num_msgs_sent(self, new):
         self.txPacketsLineEdit.setText(str(new))
+    def set_transmit_stats(self, stats):
+        # Details shown when hovering over sent messages.
+        lines = ['{:<8} waiting {}, collapsed {}, waited avg {:.1f} ms max {:.1f} ms'.format(
+                 name, stats[name]['queued'], stats[name]['collapsed'], stats[name]['wait_avg_ms'],
+                 stats[name]['wait_max_ms']) for name in lane_names]
+        self.txPacketsLineEdit.setToolTip('\n'.join(lines))
     def set_num_msgs_received(self, new):
         self.rxPacketsLineEdit.setText(str(new))
     def set_bps_sent(self, new):
         self.txBPSLineEdit.setText(str(new))
     def set_bps_received(self, new):
         self.rxBPSLineEdit.setText(str(new))
+    def set_link_meter(self, stats):
+        # Details shown when hovering over rates.
+        for line_edit, direction, utilization in ((self.txBPSLineEdit, 'sent', stats['tx_utilization']),
+                                                   (self.rxBPSLineEdit, 'received', stats['rx_utilization'])):
+            byte_rate = stats['bytes_' + direction]
+            message_rate = stats['messages_' + direction]
+            line_edit.setToolTip('Now: {:.0f} B/s\nAverage: {:.0f} B/s\nPeak: {:.0f} B/s\n'
+                                 'Messages: {:.1f}/s\nUses {:.1f}% of {} baud'.format(
+                                 byte_rate['instant'], byte_rate['average'], byte_rate['peak'],
+                                 message_rate['average'], utilization, stats['baud_rate']))
     def set_bad_crc(self, new):
         self.badCRCLineEdit.setText(str(new))
     def set_dropped_msgs(self, new):
         self.droppedLineEdit.setText(str(new))
+    def set_round_trip_times(self, stats):
+        if not stats['supported']:
+            self.rttLineEdit.setText('robot not answering pings')
+            return
+        if stats['samples'] == 0:
+            self.rttLineEdit.setText('')
+            return
+        self.rttLineEdit.setText('{rtt_p50:.1f} / {rtt_p90:.1f} / {rtt_p99:.1f}'.format(**stats))
+        clock = 'Clock drift: {:+.1f} ppm'.format(stats['drift_ppm']) if stats['synchronized'] else 'Clock not synchronized'
+        self.rttLineEdit.setToolTip('Round trip median / 90th / 99th percentile\n'
+                                    'Min: {rtt_min:.1f} ms  Max: {rtt_max:.1f} ms\n'
+                                    'Pings: {pings_sent} sent, {lost} lost\n'.format(**stats) + clock)
         
     # Experiment input types
     def autowave_input_clicked(self):
@@ -366,7 +409,10 @@ class EevaMainWindow(QMainWindow, Ui_MainWindow):
 
     # Wave types
     def trapezoid_wave_selected(self):
-        self.display_message('TODO - show trapezoid settings dialog', 'black')
+        dialog = TrapezoidDialog(self.trapezoid_params, float(self.get_wave_duration()), self)
+        if dialog.exec_() == QtGui.QDialog.Accepted:
+            self.trapezoid_params = dialog.get_parameters()
+            self.controller.trapezoid_parameters_changed()
     
     def get_selected_wave_type(self):
         if self.sineRadioButton.isChecked():
@@ -402,6 +448,11 @@ class EevaMainWindow(QMainWindow, Ui_MainWindow):
     def wave_parameters_changed(self):
         validate_wave_parameters(self)
         
+    def get_trapezoid_parameters(self):
+        return self.trapezoid_params
+    def set_trapezoid_parameters(self, params):
+        self.trapezoid_params = dict((key, str(value)) for key, value in params.items())
+        
     # Manual experiment input
     def set_manual_command(self, new_value):
         self.manualCommandLineEdit.setText(str(new_value))
@@ -451,16 +502,18 @@ class DrivingKeyFilter(QObject):
                     
                 cmd = self.convert_key_to_driving_command(event.key())
                 if cmd is not None:
-                    if not event.isAutoRepeat():
+                    if not event.isAutoRepeat() and not self.command_state[cmd]:
                         self.command_state[cmd] = True
+                        self.controller.driving_keys_changed(time.time())
                     return True # don't pass on key press
 
             elif (event.type() == QEvent.KeyRelease):
                     
                 cmd = self.convert_key_to_driving_command(event.key())
                 if cmd is not None:
-                    if not event.isAutoRepeat():
+                    if not event.isAutoRepeat() and self.command_state[cmd]:
                         self.command_state[cmd] = False
+                        self.controller.driving_keys_changed(time.time())
                     return True # don't pass on key release 
                     
         return False  # event wasn't handled      
@@ -479,3 +532,51 @@ class DrivingKeyFilter(QObject):
             return DrivingCommand.stop
         
         return None 
+
+class TrapezoidDialog(QtGui.QDialog):
+    '''Edit trapezoid wave settings and show what the resulting profile looks like.'''
+    
+    def __init__(self, params, duration, parent=None):
+        QtGui.QDialog.__init__(self, parent)
+        self.setWindowTitle('Trapezoid Settings')
+        
+        self.duration = duration
+        
+        self.line_edits = {}
+        layout = QtGui.QFormLayout(self)
+        for key, label in (('vmax', 'Max Velocity'), ('amax', 'Max Acceleration'), ('dx', 'Distance')):
+            line_edit = QtGui.QLineEdit(params[key])
+            line_edit.textChanged.connect(self.update_summary)
+            layout.addRow(label, line_edit)
+            self.line_edits[key] = line_edit
+        
+        self.summary_label = QtGui.QLabel()
+        self.summary_label.setWordWrap(True)
+        layout.addRow(self.summary_label)
+        
+        self.buttons = QtGui.QDialogButtonBox(QtGui.QDialogButtonBox.Ok | QtGui.QDialogButtonBox.Cancel)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        layout.addRow(self.buttons)
+        
+        self.update_summary()
+        
+    def get_parameters(self):
+        return dict((key, str(line_edit.text())) for key, line_edit in self.line_edits.items())
+        
+    def update_summary(self, *args):
+        
+        params = self.get_parameters()
+        try:
+            profile = plan_trapezoid(float(params['vmax']), float(params['amax']), float(params['dx']),
+                                     max_duration=self.duration if self.duration > 0 else None)
+            summary = profile.describe()
+            if not profile.reaches_vmax:
+                summary += '\nDistance too short to reach max velocity.'
+            feasible = True
+        except ValueError as e: # includes TrapezoidError
+            summary = str(e)
+            feasible = False
+            
+        self.summary_label.setText(summary)
+        self.buttons.button(QtGui.QDialogButtonBox.Ok).setEnabled(feasible)
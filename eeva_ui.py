@@ -1,43 +1,101 @@
 
 import os
 import sys
-from eeva_main_window import EevaMainWindow
-from eeva_controller import EevaController
-from connection_controller import ConnectionController
-from glob_link import GlobLink
-from version import current_gui_version
-from PyQt4 import QtGui
-from exception_hook import excepthook
-import images_rc
+import multiprocessing
+from startup_profile import StartupProfile
 
 if __name__ == '__main__':
 
+    # Needed for robot worker processes when running as a frozen executable on Windows.
+    # Everything else is imported below so worker processes don't have to load the GUI.
+    multiprocessing.freeze_support()
+
+    # Prints how long each part of start up took once the window is shown.
+    profile = StartupProfile(enabled='--profile-startup' in sys.argv)
+    profile.start_import_timing()
+
+    # Main window first since it sets the sip API before anything else imports PyQt4.
+    from eeva_main_window import EevaMainWindow
+    from PyQt4 import QtGui, QtCore
+    from eeva_controller import EevaController
+    from connection_controller import ConnectionController
+    from glob_link import GlobLink, ProcessGlobLink
+    from event_link import EventGlobLink, QtLoop
+    from version import current_gui_version
+    from exception_hook import excepthook
+
+    profile.stop_import_timing()
+    profile.step('imports')
+
     app = QtGui.QApplication(sys.argv)
     app.setStyle('plastique')
-    app.setWindowIcon(QtGui.QIcon(':/resources/NERLogoTransparent.png'))
-    
+
     if os.name == 'nt':
         # If running on windows then need to unassociate process from python so that
         # the OS will show the correct icon in the taskbar.
         import ctypes
         myappid = u'ner.eeva.ui.1'
         ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
-    
+
     # Tell system to call our custom function when an unhandled exception occurs
     sys.excepthook = excepthook
-    
+
+    profile.step('create application')
+
     # Configure system
-    link = GlobLink()
+    if '--isolate-link' in sys.argv:
+        # Keep serial port and parsing out of the GUI process.
+        link = ProcessGlobLink()
+    elif '--event-link' in sys.argv and os.name == 'posix':
+        # Read port from the Qt event loop instead of reader threads.
+        link = EventGlobLink(QtLoop())
+    else:
+        link = GlobLink()
+    fanout_message = None # shown once window is up
+    if '--fanout' in sys.argv:
+        # Let other programs watch messages from the robot (see telemetry_fanout.py).
+        import socket
+        from telemetry_fanout import DEFAULT_FANOUT_ADDRESS
+        index = sys.argv.index('--fanout') + 1
+        has_address = index < len(sys.argv) and not sys.argv[index].startswith('--')
+        try:
+            address = link.start_fanout(sys.argv[index] if has_address else DEFAULT_FANOUT_ADDRESS)
+            fanout_message = 'Publishing messages on {}'.format(address)
+        except (ValueError, socket.error) as e:
+            fanout_message = 'Could not start fan-out server: {}'.format(e)
     controller = EevaController(link)
     connection_controller = ConnectionController(controller, link)
+
+    profile.step('create link and controllers')
+
     window = EevaMainWindow(app, controller, connection_controller)
+
+    profile.step('create window')
+
     controller.set_view(window)
     connection_controller.set_view(window)
     connection_controller.start_link_timer()
-    
+    if fanout_message:
+        controller.display_message(fanout_message)
+
+    profile.step('initialize view')
+
     window.setWindowTitle('EevaUI - v{}'.format(current_gui_version))
     window.setFixedHeight(window.sizeHint().height())
     window.show()
 
+    profile.step('show window')
+
+    def finish_startup():
+
+        # Embedded images are only loaded once the window is up.
+        import images_rc
+        app.setWindowIcon(QtGui.QIcon(':/Images/NERLogoTransparent.png'))
+
+        profile.step('load images')
+        profile.print_report()
+
+    # Runs once event loop has started.
+    QtCore.QTimer.singleShot(0, finish_startup)
+
     sys.exit(app.exec_())
-    
\ No newline at end of file
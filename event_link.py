@@ -0,0 +1,222 @@
+'''
+Event driven glob link.  Instead of two reader threads per connection that poll queues, the port is
+watched by an event loop (select() for scripts, QSocketNotifier inside the GUI) and bytes are parsed
+on the loop's thread as soon as they arrive.  Only works where select() supports serial ports (not Windows).
+'''
+import time
+import select
+from glob_link_base import BaseGlobLink, GlobParser, MessageSignal
+from scheduler import HeadlessScheduler
+from eeva_glob import Request, decode_glob
+
+class GlobProtocol(object):
+    '''
+    Message framing for one connection, in the style of an asyncio protocol.  Bytes go in through
+    data_received() and each complete message is passed to message_received(id, instance, body).
+    '''
+
+    def __init__(self, message_start_byte, message_received):
+
+        self.message_received = message_received
+        self.parser = GlobParser(message_start_byte, self)
+
+    def data_received(self, data):
+        self.parser.parse_data(data)
+
+    def emit(self, id, instance, body):
+        # Parser reports new messages like a signal.
+        self.message_received(id, instance, body)
+
+class SelectLoop(object):
+    '''Minimal single threaded event loop for scripts.'''
+
+    def __init__(self, scheduler=None):
+
+        self.scheduler = scheduler if scheduler else HeadlessScheduler()
+        self.readers = {} # file descriptor -> callback
+
+    def add_reader(self, fd, callback):
+        self.readers[fd] = callback
+
+    def remove_reader(self, fd):
+        self.readers.pop(fd, None)
+
+    def call_later(self, delay, callback):
+        self.scheduler.call_later(delay, callback)
+
+    def run_once(self, timeout=0):
+        '''Wait up to timeout seconds for data or a timer then handle everything that's ready.'''
+
+        timeout = self.scheduler.time_until_next(default=timeout)
+        fds = self.readers.keys()
+        if fds:
+            try:
+                readable, _, _ = select.select(fds, [], [], timeout)
+            except (select.error, ValueError):
+                readable = [] # port closed while waiting
+            for fd in readable:
+                callback = self.readers.get(fd)
+                if callback:
+                    callback()
+        elif timeout > 0:
+            time.sleep(timeout)
+
+        self.scheduler.run_pending()
+
+    def run_until(self, condition, timeout):
+        '''Run loop until condition() is true or timeout (seconds) elapses. Return last condition value.'''
+        end_time = time.time() + timeout
+        while not condition():
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return False
+            self.run_once(remaining)
+        return True
+
+class QtLoop(object):
+    '''Connects event link to the Qt event loop so port reads happen on the GUI thread without polling.'''
+
+    def __init__(self):
+        self.notifiers = {} # file descriptor -> QSocketNotifier
+
+    def add_reader(self, fd, callback):
+        from PyQt4.QtCore import QSocketNotifier
+        notifier = QSocketNotifier(fd, QSocketNotifier.Read)
+        notifier.activated.connect(lambda fd: callback())
+        self.notifiers[fd] = notifier
+
+    def remove_reader(self, fd):
+        notifier = self.notifiers.pop(fd, None)
+        if notifier:
+            notifier.setEnabled(False)
+
+    def call_later(self, delay, callback):
+        from PyQt4.QtCore import QTimer
+        QTimer.singleShot(int(delay * 1000), callback)
+
+    def run_once(self, timeout=0):
+        from PyQt4.QtCore import QCoreApplication, QEventLoop
+        QCoreApplication.processEvents(QEventLoop.AllEvents, int(timeout * 1000))
+
+    def run_until(self, condition, timeout):
+        end_time = time.time() + timeout
+        while not condition():
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return False
+            self.run_once(min(remaining, 0.05))
+        return True
+
+class EventGlobLink(BaseGlobLink):
+    '''
+    GlobLink driven by an event loop. 'new_message' is emitted with the raw message and 'new_glob' with the
+    decoded glob, both from the loop's thread.
+    '''
+
+    def __init__(self, loop):
+
+        BaseGlobLink.__init__(self)
+
+        self.loop = loop
+        self.use_reader_threads = False
+        self.new_message = MessageSignal()
+        self.new_glob = MessageSignal()
+        self.protocol = None
+
+        # List of (glob id, instance or None for any, callback) waiting for a matching glob.
+        self.waiters = []
+
+    def connect(self, port_name, exclusive=False):
+
+        BaseGlobLink.connect(self, port_name, exclusive)
+
+        # Replace the threadless parser with a protocol that decodes as well.
+        self.protocol = GlobProtocol(self.message_start_byte, self.message_received)
+        self.parser = self.protocol.parser
+        self.loop.add_reader(self.fileno(), self.data_ready)
+
+    def disconnect(self):
+
+        if self.connection_open():
+            self.loop.remove_reader(self.fileno())
+
+        return BaseGlobLink.disconnect(self)
+
+    def data_ready(self):
+
+        try:
+            self.read_available()
+        except Exception:
+            # Port went away. Stop watching it so loop doesn't spin.
+            self.loop.remove_reader(self.fileno())
+
+    def message_received(self, id, instance, body):
+
+        if self.fanout:
+            self.fanout.publish(id, instance, body)
+        self.new_message.emit(id, instance, body)
+
+        glob = decode_glob(id, instance, body, self.codecs)
+        if glob is None:
+            return
+
+        self.new_glob.emit(glob)
+
+        for waiter in list(self.waiters):
+            glob_id, wanted_instance, callback = waiter
+            if glob_id == id and wanted_instance in (None, instance):
+                self.waiters.remove(waiter)
+                callback(glob)
+
+    def process_events(self, timeout=0):
+        self.loop.run_once(timeout)
+
+    def when_received(self, glob_id, callback, instance=None, timeout=None):
+        '''
+        Call callback(glob) the next time a glob with matching ID (and instance, if given) arrives.
+        If timeout (seconds) elapses first then callback(None) is called instead.
+        '''
+        waiter = (glob_id, instance, callback)
+        self.waiters.append(waiter)
+
+        if timeout is not None:
+            def expired():
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                    callback(None)
+            self.loop.call_later(timeout, expired)
+
+    def request(self, glob_id, callback, instance=1, timeout=1.0):
+        '''Ask robot for glob and call callback(glob) with reply, or callback(None) on timeout.'''
+        self.when_received(glob_id, callback, None if instance == 0 else instance, timeout)
+        self.send(Request(glob_id, instance=instance))
+
+    def wait_for(self, glob_id, instance=None, timeout=1.0):
+        '''Run loop until matching glob arrives and return it, or None on timeout. For scripts only.'''
+        result = []
+        self.when_received(glob_id, result.append, instance, timeout)
+        self.loop.run_until(lambda: len(result) > 0, timeout + 1.0)
+        return result[0] if result else None
+
+    def request_and_wait(self, glob_id, instance=1, timeout=1.0):
+        '''Blocking version of request() for scripts.'''
+        result = []
+        self.request(glob_id, result.append, instance, timeout)
+        self.loop.run_until(lambda: len(result) > 0, timeout + 1.0)
+        return result[0] if result else None
+
+    def globs(self, timeout=None):
+        '''Generator of received globs. Stops after timeout seconds with nothing received (never if None).'''
+        received = []
+        self.new_glob.connect(received.append)
+        try:
+            while True:
+                if not received:
+                    got_one = self.loop.run_until(lambda: len(received) > 0,
+                                                  timeout if timeout is not None else 3600)
+                    if not got_one and timeout is not None:
+                        return
+                while received:
+                    yield received.pop(0)
+        finally:
+            self.new_glob.slots.remove(received.append)
@@ -0,0 +1,278 @@
+'''
+Experiment plans describe a grid of experiments to run on one robot without the GUI.
+
+A plan is a JSON (or YAML if PyYAML is installed) file like:
+
+    {
+        "name": "speed_sweep",
+        "mode": "experiment",
+        "experiment": 1,
+        "capture": {"rate": 100, "samples": 500},
+        "wave": {"type": "sine", "mag": 0.2, "offset": 0, "freq": 1, "duration": 5},
+        "pid": {"0": {"kp": 1.5, "ki": 0.2, "kd": 0, "sat_limit": 12, "int_sat_limit": 5}},
+        "sweep": {
+            "wave.freq": [0.5, 1, 2, 4],
+            "pid.0.kp": [1.0, 1.5],
+            "experiment": [1, 3]
+        },
+        "settle_time": 1.0
+    }
+
+Every combination of the 'sweep' values is one point.  Keys are dotted paths into the rest of the plan.
+Trapezoid waves also take "vmax", "amax" and "dx" in "wave", and every trapezoid is checked before anything runs.
+'''
+import os
+import csv
+import json
+import time
+import copy
+import Queue
+import itertools
+import threading
+from eeva_glob import Modes, Wave, PidParams
+from validate_params import *
+from trapezoid import plan_trapezoid, plan_trapezoids, TrapezoidError
+
+mode_names = {'balance': Modes.balance,
+              'horizontal': Modes.horizontal,
+              'line_follow': Modes.line_follow,
+              'experiment': Modes.experiment,
+              'custom': Modes.custom}
+
+wave_names = {'sine': Wave.sine,
+              'square': Wave.square,
+              'triangle': Wave.triangle,
+              'trapezoidal': Wave.trapezoidal,
+              'constant': Wave.constant}
+
+pid_fields = ('kp', 'ki', 'kd', 'sat_limit', 'int_sat_limit')
+
+default_plan = {'name': 'sweep',
+                'mode': 'experiment',
+                'experiment': 0,
+                'capture': {'rate': DEFAULT_CAPTURE_RATE, 'samples': DEFAULT_NUM_SAMPLES},
+                'wave': {'type': 'sine', 'mag': DEFAULT_WAVE_MAGNITUDE, 'offset': DEFAULT_WAVE_OFFSET,
+                         'freq': DEFAULT_WAVE_FREQ, 'duration': DEFAULT_WAVE_DURATION},
+                'pid': {},
+                'sweep': {},
+                'settle_time': 1.0}
+
+class PlanError(ValueError):
+    pass
+
+def load_plan(filepath):
+    '''Read plan from a .json or .yaml/.yml file and fill in defaults.'''
+
+    with open(filepath, 'r') as plan_file:
+        if os.path.splitext(filepath)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise PlanError('PyYAML needs to be installed to read {}'.format(filepath))
+            plan = yaml.safe_load(plan_file)
+        else:
+            plan = json.load(plan_file)
+
+    return make_plan(plan)
+
+def make_plan(plan):
+    '''Return copy of plan with defaults filled in and names validated.'''
+
+    full_plan = copy.deepcopy(default_plan)
+    for key, value in plan.items():
+        if isinstance(value, dict) and isinstance(full_plan.get(key), dict):
+            full_plan[key].update(value)
+        else:
+            full_plan[key] = value
+
+    # Store PID controller indices as strings so they look the same whether they came from JSON or YAML.
+    full_plan['pid'] = dict((str(k), v) for k, v in full_plan['pid'].items())
+
+    for path, values in full_plan['sweep'].items():
+        if not isinstance(values, list) or len(values) == 0:
+            raise PlanError('Sweep values for {} must be a non-empty list.'.format(path))
+
+    points = expand_plan(full_plan)
+    for point in points:
+        validate_point(point)
+    validate_trapezoids(points)
+
+    return full_plan
+
+def set_path(params, path, value):
+    '''Set value in nested dictionary using dotted path like "pid.0.kp".'''
+    keys = path.split('.')
+    for key in keys[:-1]:
+        params = params.setdefault(key, {})
+    params[keys[-1]] = value
+
+def expand_plan(plan):
+    '''Return list of (point_values, params) where params is the full set of settings for that point.'''
+
+    sweep_paths = sorted(plan['sweep'].keys())
+    value_lists = [plan['sweep'][path] for path in sweep_paths]
+
+    base = dict((k, v) for k, v in plan.items() if k != 'sweep')
+
+    points = []
+    for values in itertools.product(*value_lists):
+        params = copy.deepcopy(base)
+        for path, value in zip(sweep_paths, values):
+            set_path(params, path, value)
+        points.append((dict(zip(sweep_paths, values)), params))
+
+    return points
+
+def validate_point(point):
+
+    _, params = point
+
+    if params['mode'] not in mode_names:
+        raise PlanError('Unknown mode {}'.format(params['mode']))
+    if not 0 <= int(params['experiment']) < len(Modes.experiments):
+        raise PlanError('Unknown experiment {}'.format(params['experiment']))
+    if params['wave']['type'] not in wave_names:
+        raise PlanError('Unknown wave type {}'.format(params['wave']['type']))
+    for index, gains in params['pid'].items():
+        if not 0 <= int(index) < len(PidParams.controllers):
+            raise PlanError('Unknown PID controller {}'.format(index))
+        for field in gains:
+            if field not in pid_fields:
+                raise PlanError('Unknown PID field {}'.format(field))
+
+def validate_trapezoids(points):
+    '''Make sure every trapezoid wave in plan can be followed. All points are planned at once if numpy is installed.'''
+
+    waves = [params['wave'] for _, params in points if params['wave']['type'] == 'trapezoidal']
+    if not waves:
+        return
+
+    limits = [[float(wave.get(key, default)) for wave in waves] for key, default in
+              (('vmax', DEFAULT_TRAPEZOID_VMAX), ('amax', DEFAULT_TRAPEZOID_AMAX), ('dx', DEFAULT_TRAPEZOID_DX))]
+    # Same as GUI, a duration of 0 (or less) means the profile can take as long as it needs.
+    durations = [float(wave['duration']) if float(wave['duration']) > 0 else float('inf') for wave in waves]
+
+    try:
+        import numpy as np
+    except ImportError:
+        for vmax, amax, dx, duration in zip(*(limits + [durations])):
+            try:
+                plan_trapezoid(vmax, amax, dx, duration if duration != float('inf') else None)
+            except TrapezoidError as e:
+                raise PlanError(str(e))
+        return
+
+    segment_times, _, feasible = plan_trapezoids(*limits)
+    feasible &= segment_times[:, 2] <= np.array(durations)
+    if not feasible.all():
+        bad = [i for i in range(len(waves)) if not feasible[i]]
+        raise PlanError('{} of {} trapezoid waves are infeasible (vmax/amax must be positive and profile must fit '
+                        'in wave duration), first is {}'.format(len(bad), len(waves), waves[bad[0]]))
+
+class ExportWorker(threading.Thread):
+    '''Writes captured data and manifest rows in the background so the next point can be set up right away.'''
+
+    def __init__(self, session, manifest_path, param_columns):
+
+        super(ExportWorker, self).__init__()
+        self.setDaemon(True)
+
+        self.session = session
+        self.manifest_path = manifest_path
+        self.param_columns = param_columns
+        self.export_queue = Queue.Queue()
+
+        with open(self.manifest_path, 'wb') as manifest_file:
+            writer = csv.writer(manifest_file)
+            writer.writerow(['point', 'file', 'samples', 'start_time'] + param_columns + ['params'])
+
+    def run(self):
+
+        while True:
+            item = self.export_queue.get()
+            if item is None:
+                break # exit thread
+            self.export(*item)
+
+    def export(self, point_index, filename, data, start_time, point_values, params, capture_info):
+
+        filepath = self.session.export(data, filename, capture_info) if data else None
+        filepath = os.path.basename(filepath) if filepath else ''
+
+        with open(self.manifest_path, 'ab') as manifest_file:
+            writer = csv.writer(manifest_file)
+            writer.writerow([point_index, filepath, len(data), start_time] +
+                            [point_values.get(c, '') for c in self.param_columns] +
+                            [json.dumps(params, sort_keys=True)])
+
+    def finish(self):
+        '''Block until everything queued so far is written.'''
+        self.export_queue.put(None)
+        self.join()
+
+class SweepRunner(object):
+    '''Runs every point of a plan on a connected HeadlessSession.'''
+
+    def __init__(self, session, plan):
+
+        self.session = session
+        self.plan = plan
+        self.points = expand_plan(plan)
+
+        # Settings of last point. Only settings that change are sent for the next point.
+        self.last_params = None
+
+    def run(self):
+        '''Run all points and return path to manifest file.'''
+
+        name = self.plan['name']
+        session_directory = self.session.session_directory
+
+        with open(os.path.join(session_directory, '{}_plan.json'.format(name)), 'w') as plan_file:
+            json.dump(self.plan, plan_file, indent=4, sort_keys=True)
+
+        manifest_path = os.path.join(session_directory, '{}_manifest.csv'.format(name))
+        param_columns = sorted(self.plan['sweep'].keys())
+        exporter = ExportWorker(self.session, manifest_path, param_columns)
+        exporter.start()
+
+        try:
+            for point_index, (point_values, params) in enumerate(self.points):
+
+                self.session.controller.display_message('Point {} of {}: {}'.format(
+                                                        point_index + 1, len(self.points), point_values))
+                self.apply_params(params)
+
+                start_time = time.strftime("%Y-%m-%d %H:%M:%S")
+                capture = params['capture']
+                data = self.session.capture(int(capture['samples']), float(capture['rate']))
+                capture_info = self.session.capture_info()
+                self.session.stop()
+
+                # Export in background while the robot settles and next point is set up.
+                filename = '{}_{:03d}'.format(name, point_index)
+                exporter.export_queue.put((point_index, filename, data, start_time, point_values, params, capture_info))
+
+                self.session.wait(float(params['settle_time']))
+        finally:
+            exporter.finish()
+
+        return manifest_path
+
+    def apply_params(self, params):
+
+        last = self.last_params if self.last_params else {}
+
+        if params['mode'] != last.get('mode') or params['experiment'] != last.get('experiment'):
+            self.session.select_mode(mode_names[params['mode']], int(params['experiment']))
+
+        for index, gains in sorted(params['pid'].items()):
+            if gains != last.get('pid', {}).get(index):
+                gains = dict((field, gains.get(field, 0)) for field in pid_fields)
+                self.session.set_pid_gains(int(index), **gains)
+
+        wave = params['wave']
+        self.session.set_wave(wave_names[wave['type']], wave['mag'], wave['offset'], wave['freq'], wave['duration'],
+                              vmax=wave.get('vmax'), amax=wave.get('amax'), dx=wave.get('dx'))
+
+        self.last_params = params
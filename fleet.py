@@ -0,0 +1,239 @@
+import os
+import time
+import select
+import serial
+import threading
+from eeva_headless import HeadlessSession, HeadlessController, HeadlessGlobLink, HeadlessProcessGlobLink
+from experiment_plan import SweepRunner
+
+class FleetController(HeadlessController):
+    '''Stores output in a directory named after the robot ID so runs from different robots don't mix.'''
+
+    def verify_robot_id(self, robot_id):
+
+        HeadlessController.verify_robot_id(self, robot_id)
+
+        session_name = os.path.basename(os.path.normpath(self.session_directory))
+        self.session_directory = os.path.join(self.output_directory, 'robot_{}'.format(robot_id), session_name)
+
+class FleetReader(threading.Thread):
+    '''
+    Single thread that waits on every robot's port with select() and parses whatever arrives.
+    Replaces the two reader threads that each link normally starts.
+    '''
+
+    def __init__(self):
+
+        super(FleetReader, self).__init__()
+        self.setDaemon(True)
+
+        self.links = {} # file descriptor -> link
+        self.lock = threading.Lock()
+        self.stop_request = threading.Event()
+
+        # Writing to this pipe wakes up select() so added/removed ports take effect right away.
+        self.wake_read_fd, self.wake_write_fd = os.pipe()
+
+    def add_link(self, link):
+        with self.lock:
+            self.links[link.fileno()] = link
+        os.write(self.wake_write_fd, b'x')
+
+    def remove_link(self, link):
+        with self.lock:
+            for fd, other_link in self.links.items():
+                if other_link is link:
+                    del self.links[fd]
+        os.write(self.wake_write_fd, b'x')
+
+    def stop(self):
+        self.stop_request.set()
+        os.write(self.wake_write_fd, b'x')
+
+    def run(self):
+
+        while not self.stop_request.is_set():
+
+            with self.lock:
+                fds = self.links.keys()
+
+            try:
+                readable, _, errored = select.select(fds + [self.wake_read_fd], [], fds, 1.0)
+            except (select.error, ValueError):
+                # A port was closed without being removed first.
+                with self.lock:
+                    for fd, link in self.links.items():
+                        if not link.connection_open():
+                            del self.links[fd]
+                continue
+
+            if self.wake_read_fd in readable:
+                os.read(self.wake_read_fd, 512)
+
+            for fd in set(readable + errored):
+                with self.lock:
+                    link = self.links.get(fd)
+                if link is None:
+                    continue
+                try:
+                    link.read_available()
+                except (serial.SerialException, OSError, ValueError):
+                    # Port went away (e.g. unplugged). Stop watching it, link health will show it as closed.
+                    self.remove_link(link)
+
+class FleetManager(object):
+    '''Manages headless sessions for several robots at once.'''
+
+    def __init__(self, base_directory=None, verbose=False, shared_reader=None, isolate=False):
+
+        self.base_directory = base_directory
+        self.verbose = verbose
+
+        # If true each robot's link runs in its own process so one busy link doesn't slow down the rest.
+        self.isolate = isolate
+
+        # Shared reader loop needs select() to work on serial ports which isn't true on Windows.
+        self.shared_reader = (os.name == 'posix') if shared_reader is None else shared_reader
+        self.shared_reader = self.shared_reader and not isolate
+        self.reader = None
+        if self.shared_reader:
+            self.reader = FleetReader()
+            self.reader.start()
+
+        # Set by any link when it has new messages so one thread can wait on all robots.
+        self.wakeup = threading.Event()
+
+        self.sessions = []
+
+        # Session -> time last message was handled
+        self.last_message_times = {}
+
+    def add_robot(self, port_name):
+        '''Create a session for robot on port and connect to it. Returns session (even if connection failed).'''
+
+        if self.isolate:
+            link = HeadlessProcessGlobLink(self.wakeup)
+        else:
+            link = HeadlessGlobLink(self.wakeup)
+            link.use_reader_threads = not self.shared_reader
+
+        session = HeadlessSession(self.base_directory, self.verbose, link=link, controller_class=FleetController)
+        session.port_name = port_name
+        self.sessions.append(session)
+        self.last_message_times[session] = None
+
+        def message_received(*args):
+            self.last_message_times[session] = time.time()
+        link.new_message.connect(message_received)
+
+        # Register with reader before waiting for robot status, otherwise nothing would read the port.
+        session.connection_controller.connect_to_port(port_name)
+        if session.connection_controller.link_connected:
+            if self.reader:
+                self.reader.add_link(link)
+            session.wait_until(lambda: session.controller.verified_robot_id, 1.0)
+
+        return session
+
+    def remove_robot(self, session):
+
+        if self.reader and session.link.connection_open():
+            self.reader.remove_link(session.link)
+        session.close()
+        self.sessions.remove(session)
+        del self.last_message_times[session]
+
+    def close(self):
+
+        for session in list(self.sessions):
+            self.remove_robot(session)
+
+        if self.reader:
+            self.reader.stop()
+
+    def process_events(self, timeout=0):
+        '''Handle messages and timers for every robot. Waits up to timeout seconds for something to happen.'''
+
+        next_timer = min([s.scheduler.time_until_next(default=timeout) for s in self.sessions] + [timeout])
+        self.wakeup.wait(next_timer)
+        self.wakeup.clear()
+
+        for session in self.sessions:
+            session.process_events()
+
+    def wait(self, duration):
+        end_time = time.time() + duration
+        while time.time() < end_time:
+            self.process_events(min(end_time - time.time(), 0.25))
+
+    def for_each(self, function):
+        '''Call function(session) for every robot and return list of results.'''
+        return [function(session) for session in self.sessions]
+
+    def run_plan(self, plan):
+        '''
+        Run experiment plan on every robot at the same time.  Each robot gets its own thread since
+        sessions are independent, so don't call process_events() until this returns.
+        Returns list of manifest paths (None for robots that failed).
+        '''
+        manifest_paths = [None] * len(self.sessions)
+
+        def run_session_plan(index, session):
+            manifest_paths[index] = SweepRunner(session, plan).run()
+
+        threads = []
+        for index, session in enumerate(self.sessions):
+            if not session.connection_controller.link_connected:
+                continue
+            thread = threading.Thread(target=run_session_plan, args=(index, session))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        return manifest_paths
+
+    def link_health(self):
+        '''Return list of dictionaries describing the link to each robot.'''
+
+        now = time.time()
+        rows = []
+        for session in self.sessions:
+
+            link = session.link
+            status = session.view.robot_status
+            last_message_time = self.last_message_times[session]
+
+            rows.append({'port': session.port_name,
+                         'robot_id': status.get('robot_id', ''),
+                         'firmware': status.get('firmware_version', ''),
+                         'connected': bool(link.connection_open()),
+                         'msgs_rx': link.num_messages_received,
+                         'msgs_tx': link.num_messages_sent,
+                         'bps_rx': session.view.link_stats.get('bps_received', 0),
+                         'rx_util': round(link.meter.utilization('received'), 1),
+                         'bad_crc': link.num_bad_crc_messages,
+                         'dropped': link.num_dropped_messages,
+                         'silent_sec': round(now - last_message_time, 1) if last_message_time else None})
+
+        return rows
+
+    def format_health_table(self):
+        '''Return link health of every robot as a fixed width text table.'''
+
+        columns = [('port', 'Port'), ('robot_id', 'Robot ID'), ('firmware', 'FW'), ('connected', 'Open'),
+                   ('msgs_rx', 'Msgs Rx'), ('msgs_tx', 'Msgs Tx'), ('bps_rx', 'Rx B/s'), ('rx_util', 'Rx %'),
+                   ('bad_crc', 'Bad CRC'), ('dropped', 'Dropped'), ('silent_sec', 'Silent (s)')]
+
+        rows = [[str(row[key]) if row[key] is not None else '-' for key, _ in columns] for row in self.link_health()]
+        headers = [title for _, title in columns]
+        widths = [max([len(h)] + [len(r[i]) for r in rows]) for i, h in enumerate(headers)]
+
+        lines = ['  '.join(h.ljust(w) for h, w in zip(headers, widths))]
+        lines.append('  '.join('-' * w for w in widths))
+        for row in rows:
+            lines.append('  '.join(v.ljust(w) for v, w in zip(row, widths)))
+
+        return '\n'.join(lines)
@@ -0,0 +1,473 @@
+import sys
+import struct
+import serial
+import threading
+import Queue
+from collections import deque
+from crc import calculate_crc
+from serial_extension import SerialConnection, supports_exclusive
+from link_meter import LinkMeter
+from transmit_lanes import TransmitLanes
+from eeva_glob import codecs_for_firmware, timestamped_ids
+from clock import monotonic
+
+DEFAULT_BAUD_RATE = 115200
+
+# Start byte, CRC valid flag, glob ID, instance, packet number, body size.
+message_header = struct.Struct('<BBBHBB')
+packet_num_index = 5
+body_size_index = 6
+
+# CRC of header and body.
+message_footer = struct.Struct('<H')
+
+# Biggest message, body size is one byte.
+MAX_MESSAGE_SIZE = message_header.size + 255 + message_footer.size
+
+class GlobParser(object):
+    '''Turns received bytes into messages. Calls new_message_callback.emit(id, instance, body) for each one.'''
+
+    def __init__(self, message_start_byte, new_message_callback):
+        
+        self.message_start_byte = message_start_byte
+        self.new_message_callback = new_message_callback
+
+        # Receive fields
+        self.parse_state = -1 # Index representing sequential state when parsing incoming bytes. 
+        self.num_body_bytes = 0 # How many bytes are going to follow in message.
+        self.body_start_idx = 0 # Message data index of first body byte.
+        self.body_end_idx = 0 # Message data index of last body byte.
+        self.message_data = bytearray(300) # Entire message excluding checksum.
+        self.data_idx = 0 # Index of where to store next received byte in message data array.
+        self.expected_crc1 = 0 # lower byte of checksum at end of message
+        self.expected_crc2 = 0 # upper byte " "
+        self.last_rx_packet_num = 0 # from 0-255. Counted up each time to detect dropped packets.
+        
+        self.num_messages_received = 0
+        self.num_bytes_received = 0
+        self.num_bad_crc_messages = 0
+        self.num_dropped_messages = 0
+        
+        # Time bytes being parsed arrived, and body -> arrival time of timestamped globs not picked up yet.
+        self.receive_time = 0
+        self.arrival_times = {}
+        
+        # Counters are changed by parser thread, held while changing them so counters() is consistent.
+        self.counter_lock = threading.Lock()
+        
+        self.reset_parse()
+        
+    def counters(self):
+        '''Return (bytes received, messages received, bad CRC, dropped) all from the same moment.'''
+        with self.counter_lock:
+            return (self.num_bytes_received, self.num_messages_received,
+                    self.num_bad_crc_messages, self.num_dropped_messages)
+        
+    def parse_data(self, data, receive_time=None):
+        '''Parse received bytes. Receive time is monotonic time they arrived, defaults to now.'''
+        
+        message_pending = False
+        self.receive_time = receive_time if receive_time is not None else monotonic()
+        
+        with self.counter_lock:
+            self.num_bytes_received += len(data)
+        
+        for byte in data:
+
+            if self.parse_state == -1:
+                if byte == self.message_start_byte:
+                    self.message_data[self.data_idx] = byte
+                    self.data_idx += 1
+                    self.advance_parse()
+                    
+            elif self.parse_state == 0:
+                # Pull out CRC valid flag.  Verify as kind of a 2nd verification that's its actually
+                # the start of a new message.
+                if byte == 0 or byte == 1:
+                    self.message_data[self.data_idx] = byte
+                    self.data_idx += 1
+                    self.advance_parse()
+                else:
+                    self.reset_parse() # bad flag
+                
+            elif self.parse_state >= 1 and self.parse_state <= 4:
+                # Pull out glob id and both bytes of instance and packet number.
+                self.message_data[self.data_idx] = byte
+                self.data_idx += 1
+                self.advance_parse()
+                
+            elif self.parse_state == 5:
+                self.message_data[self.data_idx] = byte
+                self.data_idx += 1
+                self.num_body_bytes = byte
+                self.body_start_idx = self.data_idx
+                self.advance_parse()
+                if self.num_body_bytes == 0:
+                    self.advance_parse() # go straight to checksum
+                
+            elif self.parse_state == 6:
+                self.message_data[self.data_idx] = byte
+                self.data_idx += 1
+                if self.data_idx - self.body_start_idx >= self.num_body_bytes:
+                    self.body_end_idx = self.data_idx
+                    self.advance_parse()
+                    
+            elif self.parse_state == 7:
+                self.expected_crc1 = byte
+                self.advance_parse()
+                
+            elif self.parse_state == 8:
+                self.expected_crc2 = byte
+                message_pending = True
+                
+            else:
+                self.reset_parse() # safety reset
+                
+            if message_pending:
+                message_pending = False
+                
+                crc_should_be_valid = (self.message_data[1] != 0)
+                
+                if not crc_should_be_valid or self.verify_crc():
+                    self.handle_new_message()
+                
+                self.reset_parse()
+                
+    def advance_parse(self):
+        self.parse_state += 1
+        
+    def reset_parse(self):
+        self.data_idx = 0
+        self.body_start_idx = 0
+        self.parse_state = -1
+
+    def verify_crc(self):
+        
+        expected_crc = self.expected_crc1 + (self.expected_crc2 << 8)
+        actual_crc = calculate_crc(self.message_data, self.body_end_idx, 0xFFFF)
+        
+        if expected_crc != actual_crc:
+            with self.counter_lock:
+                self.num_bad_crc_messages += 1
+            return False # don't match
+        
+        return True # CRC matches
+    
+    def handle_new_message(self):
+
+        with self.counter_lock:
+            self.num_messages_received += 1
+        
+        packet_num_should_be_valid = (self.message_data[1] != 0)
+        id = self.message_data[2]
+        instance1 = self.message_data[3]
+        instance2 = self.message_data[4]
+        instance = instance1 + (instance2 << 8)
+        packet_num = self.message_data[5]
+        body = self.message_data[self.body_start_idx : self.body_end_idx]
+        
+        if not packet_num_should_be_valid:
+            packet_num = self.last_rx_packet_num + 1
+        
+        if id in timestamped_ids:
+            if len(self.arrival_times) > 100:
+                self.arrival_times.clear() # nobody is picking them up
+            self.arrival_times[bytes(body)] = self.receive_time
+        
+        #self.new_message_callback(id, instance, body)
+        self.new_message_callback.emit(id, instance, body)
+        
+        if self.num_messages_received > 1:
+            # Check for dropped packet's
+            expected_packet_num = self.last_rx_packet_num + 1
+            expected_packet_num = expected_packet_num if expected_packet_num < 256 else 0 
+            with self.counter_lock:
+                self.num_dropped_messages += max(0, packet_num - expected_packet_num)
+        
+        self.last_rx_packet_num = packet_num
+
+class ParserThread(GlobParser, threading.Thread):
+    
+    def __init__(self, connection, message_start_byte, new_message_callback):
+        
+        threading.Thread.__init__(self)
+        GlobParser.__init__(self, message_start_byte, new_message_callback)
+
+        self.connection = connection
+        self.stop_request = threading.Event()
+        
+    def run(self):
+        '''Process bytes put into queue by port connection.'''
+        while True:
+            try:
+                receive_time, data_buffer = self.connection.read(timeout=0.5)
+                self.parse_data(list(data_buffer), receive_time)
+            except (Queue.Empty, serial.SerialException):
+                if self.stop_request.is_set():
+                    break # exit thread
+
+class MessageSignal(object):
+    '''Stand-in for a pyqtSignal so a link can be used without Qt. Slots are called from the emitting thread.'''
+    
+    def __init__(self):
+        self.slots = []
+        
+    def connect(self, slot):
+        self.slots.append(slot)
+        
+    def emit(self, *args):
+        for slot in self.slots:
+            slot(*args)
+
+class FanoutSignal(object):
+    '''Passes parsed messages to the link's fan-out server (if it has one running) then its new_message signal.'''
+
+    def __init__(self, link):
+        self.link = link
+
+    def emit(self, id, instance, body):
+        if self.link.fanout:
+            self.link.fanout.publish(id, instance, body)
+        self.link.new_message.emit(id, instance, body)
+
+class BaseGlobLink(object):
+    '''Serial link that doesn't depend on Qt.  Subclasses must provide a 'new_message' signal.'''
+    
+    def __init__(self):
+        
+        # Port to receive and transmit bytes over.
+        self.connection = None
+    
+        # Special byte that begins each new message.
+        self.message_start_byte = 0xFE
+        
+        self.parser = None
+        
+        # If false then connection and parser threads aren't started and whoever owns the link
+        # needs to call read_available() when the port has data (e.g. a shared reader loop).
+        self.use_reader_threads = True
+    
+        # Transfer fields 
+        self.num_bytes_sent = 0
+        self.num_messages_sent = 0
+        self.next_packet_num = 0 # used to detect dropped packets
+        # Frame buffers messages are packed into, reused once written. Taken by senders and given back by
+        # transmitter thread (deque append and pop are thread safe).  Grows to however many messages are queued.
+        # Frames of messages that are never written (e.g. replaced while waiting) are just left to be collected.
+        self.free_frames = deque()
+        
+        self.baud_rate = DEFAULT_BAUD_RATE
+        
+        # Byte and message rates, updated by whoever calls meter.update() (e.g. connection controller timer).
+        self.meter = LinkMeter(self)
+        
+        # Message layouts of connected robot's firmware (newest until robot reports its version).
+        self.codecs = codecs_for_firmware(None)
+        
+        # Sent messages wait here by priority until the port can take them (see transmit_lanes.py).
+        self.transmitter = TransmitLanes(self.write_frame, self.baud_rate, prepare=self.prepare_frame)
+
+        # Publishes received messages to other programs when started (see telemetry_fanout.py).
+        self.fanout = None
+
+        # If true nothing is sent, e.g. while finding out which robot is on a port.
+        self.receive_only = False
+        self.received = FanoutSignal(self)
+        
+    def connect(self, port_name, exclusive=False):
+        '''
+        Open port. If exclusive then fail if another program that locks ports (e.g. another EevaUI) has it open.
+        Ports are opened unlocked if pyserial is too old to lock them.
+        '''
+        
+        if self.connection_open():
+            raise IOError('Connection still open.')
+
+        if self.parser:
+            # Ask old parser to stop before we create another one for the new connection.
+            self.stop_parser()
+            
+        # Older pyserial doesn't know 'exclusive' so it's only passed when asked for and supported.
+        options = {'exclusive': True} if exclusive and supports_exclusive else {}
+        self.connection = SerialConnection(port=port_name, timeout=0.3, writeTimeout=0.5, baudrate=self.baud_rate,
+                                           **options)
+        
+        # Could be a different robot.
+        self.codecs = codecs_for_firmware(None)
+        
+        self.transmitter.set_baud_rate(self.baud_rate)
+        self.transmitter.reset_stats()
+        self.transmitter.start()
+        
+        if not self.use_reader_threads:
+            self.parser = GlobParser(self.message_start_byte, self.received)
+            return
+        
+        self.connection.reader_running = True
+        connection_thread = threading.Thread(target=self.connection.run)
+        connection_thread.setDaemon(True)
+        connection_thread.start()
+        
+        self.parser = ParserThread(self.connection, self.message_start_byte, self.received)
+        self.parser.setDaemon(True)
+        self.parser.start()
+        
+    def disconnect(self):
+        
+        # Give messages already queued (e.g. stop capture) a chance to go out first.
+        self.transmitter.stop()
+        
+        # reset stats
+        self.num_bytes_sent = 0
+        self.num_messages_sent = 0
+        
+        if self.parser:
+            self.stop_parser()
+            self.parser = None
+        
+        if self.connection_open():
+            self.connection.close()
+            self.connection = None
+            return True
+        
+        return False # connection already closed
+    
+    def start_fanout(self, address):
+        '''Publish every received message to subscribers at address. Returns address they should connect to.'''
+
+        from telemetry_fanout import FanoutServer
+        self.stop_fanout()
+        server = FanoutServer(address, lambda: self.codecs, self.message_start_byte)
+        bound_address = server.start()
+        self.fanout = server
+        return bound_address
+
+    def stop_fanout(self):
+
+        if self.fanout:
+            self.fanout.stop()
+            self.fanout = None
+
+    def stop_parser(self):
+        
+        if isinstance(self.parser, ParserThread):
+            self.parser.stop_request.set()
+            
+    def fileno(self):
+        '''Return OS handle of open port so it can be watched by select/poll.'''
+        return self.connection.fileno()
+    
+    def read_available(self):
+        '''Parse any bytes waiting on the port. Only used when reader threads are disabled.'''
+        data = self.connection.read_available()
+        if data:
+            self.parser.parse_data(data)
+        return len(data)
+            
+    def connection_open(self):
+        
+        return self.connection and self.connection.connection_is_open()
+    
+    def arrival_time(self, id, body):
+        '''Return monotonic time received message's bytes arrived, or None if it isn't one that's timestamped.'''
+        parser = self.parser
+        if not parser or id not in timestamped_ids:
+            return None
+        return parser.arrival_times.pop(bytes(body), None)
+    
+    def send(self, glob):
+        '''Queue glob to be sent, ahead of less important messages already waiting. Can be called from any thread.'''
+        
+        if not self.connection_open() or self.receive_only:
+            return
+        
+        self.transmitter.send(glob)
+        
+    def set_firmware_version(self, firmware_version):
+        '''Pack and unpack messages with layouts of this robot firmware version.'''
+        self.codecs = codecs_for_firmware(firmware_version)
+        
+    def prepare_frame(self, glob):
+        '''
+        Pack glob and its header into a frame buffer. Returns (frame, body size). Called by send() on the sender's
+        thread so a glob that can't be packed raises there. Packet number and CRC are filled in by write_frame().
+        '''
+        
+        try:
+            frame = self.free_frames.pop()
+        except IndexError:
+            frame = bytearray(MAX_MESSAGE_SIZE)
+        
+        try:
+            # Body goes right after header.
+            body_size = self.codecs.pack_into(glob, frame, message_header.size)
+            
+            # Send a 1 at start of header to show that CRC and packet number should be valid.
+            message_header.pack_into(frame, 0, self.message_start_byte, 1, glob.id, glob.instance, 0, body_size)
+        except Exception:
+            self.free_frames.append(frame)
+            raise
+        
+        return frame, body_size
+        
+    def write_frame(self, frame):
+        '''
+        Number frame, add its CRC and write it to port, then give its buffer back. Called by transmitter thread in
+        the order messages go out.
+        '''
+        try:
+            connection = self.connection
+            if not connection or not connection.connection_is_open():
+                return
+            
+            frame[packet_num_index] = self.next_packet_num
+            crc_index = message_header.size + frame[body_size_index]
+            frame_view = memoryview(frame)
+            message_footer.pack_into(frame, crc_index, calculate_crc(frame_view, crc_index, 0xFFFF))
+            message_size = crc_index + message_footer.size
+
+            try:
+                connection.write(frame_view[:message_size])
+            except (serial.SerialException, OSError, IOError):
+                return # port went away, connection controller notices
+            
+            self.num_bytes_sent += message_size
+            self.num_messages_sent += 1
+            self.next_packet_num += 1
+            if self.next_packet_num > 255:
+                self.next_packet_num = 0
+        finally:
+            self.free_frames.append(frame)
+
+    def link_counters(self):
+        '''Return dictionary of byte and message counts in each direction (see LinkMeter).'''
+        
+        parser = self.parser
+        bytes_received, messages_received = parser.counters()[:2] if parser else (0, 0)
+        
+        return {'bytes_sent': self.num_bytes_sent, 'messages_sent': self.num_messages_sent,
+                'bytes_received': bytes_received, 'messages_received': messages_received}
+
+    @property
+    def num_messages_received(self):
+        if self.parser:
+            return self.parser.num_messages_received
+        return 0
+    
+    @property
+    def num_bytes_received(self):
+        if self.parser:
+            return self.parser.num_bytes_received
+        return 0
+    
+    @property
+    def num_bad_crc_messages(self):
+        if self.parser:
+            return self.parser.num_bad_crc_messages
+        return 0
+
+    @property
+    def num_dropped_messages(self):
+        if self.parser:
+            return self.parser.num_dropped_messages
+        return 0
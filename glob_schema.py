@@ -0,0 +1,257 @@
+'''
+Declarative layouts for glob bodies, turned into fast codecs once at start up.
+
+Each glob class lists its fields in a 'schemas' dictionary of first firmware version -> list of Field (and
+Derived) so a layout change in new firmware is just another entry.  For every layout a GlobCodec is built with
+a precompiled struct.Struct and pack/unpack functions generated for exactly those fields, so decoding doesn't
+loop over fields or look anything up by index.
+
+GlobCodecs holds the codec of every glob for one firmware version (see codecs_for_firmware() in eeva_glob).
+Until the robot's version is known the newest layouts are used, and a body that doesn't match the expected
+size is checked against the other layouts of the same glob.
+'''
+import struct
+import math
+
+class Field(object):
+    '''
+    One value (or count values) in a glob body.  Type is a struct format character (e.g. 'f', 'B', '200s').
+    Decoded value is raw * scale / (value of 'per' field) then passed through convert.  A field without a
+    name is padding, sent as zero.  Unconvert turns the decoded value back for packing.
+    '''
+
+    def __init__(self, name, type_code, count=1, scale=None, per=None, unit=None, convert=None, unconvert=None):
+        self.name = name
+        self.type_code = type_code
+        self.count = count
+        self.scale = scale
+        self.per = per
+        self.unit = unit
+        self.convert = convert
+        self.unconvert = unconvert
+
+    @property
+    def format(self):
+        return self.type_code * self.count if self.count > 1 else self.type_code
+
+    @property
+    def packable(self):
+        return self.convert is None or self.unconvert is not None
+
+def padding(type_code='B', count=1):
+    return Field(None, type_code, count)
+
+class Derived(object):
+    '''Value computed from other fields after unpacking, e.g. 'battery * left_pwm / 100.0'. Never packed.'''
+
+    def __init__(self, name, expression, unit=None):
+        self.name = name
+        self.expression = expression
+        self.unit = unit
+
+# Common unit conversions.
+RADIANS_TO_DEGREES = 180.0 / math.pi
+RAD_PER_SEC_TO_RPM = 60.0 / (2 * math.pi)
+
+def hex_string(values):
+    return ''.join('{:02X}'.format(b) for b in values)
+
+class GlobCodec(object):
+    '''Packs and unpacks the body of one glob for one layout.'''
+
+    def __init__(self, glob_class, first_firmware_version, fields):
+
+        self.glob_class = glob_class
+        self.glob_id = glob_class.id
+        self.first_firmware_version = first_firmware_version
+        self.fields = fields
+
+        # Decoded values go in this attribute (a dictionary) instead of being attributes of the glob.
+        self.target = getattr(glob_class, 'fields_target', None)
+
+        self.format = '<' + ''.join(field.format for field in fields if isinstance(field, Field))
+        self.struct = struct.Struct(self.format)
+        self.size = self.struct.size
+
+        self.unpack_into = self.build_unpack()
+        if all(f.packable for f in fields if isinstance(f, Field)):
+            self.pack = self.build_pack()
+            self.pack_into = self.build_pack_into()
+        else:
+            self.pack = self.pack_into = None
+
+    def target_expression(self):
+        return 'glob.{}'.format(self.target) if self.target else 'glob.__dict__'
+
+    def build_unpack(self):
+        '''Generate function(glob, data_bytes) that sets every field of glob.'''
+
+        namespace = {'struct_unpack': self.struct.unpack}
+        lines = ['def unpack_into(glob, data_bytes):',
+                 '    v = struct_unpack(data_bytes)',
+                 '    d = {}'.format(self.target_expression())]
+
+        index = 0
+        for field in self.fields:
+            if isinstance(field, Derived):
+                lines.append('    {0} = d[{0!r}] = {1}'.format(field.name, field.expression))
+                continue
+            if field.count > 1:
+                if field.scale is not None or field.per is not None:
+                    raise ValueError('Field {} with count > 1 can only be converted.'.format(field.name))
+                value = 'v[{}:{}]'.format(index, index + field.count)
+            else:
+                value = 'v[{}]'.format(index)
+            index += field.count
+            if field.name is None:
+                continue # padding
+            if field.scale is not None:
+                value = '{} * {!r}'.format(value, float(field.scale))
+            if field.per is not None:
+                value = '{} / {}'.format(value, field.per)
+            if field.convert is not None:
+                converter = 'convert_' + field.name
+                namespace[converter] = field.convert
+                value = '{}({})'.format(converter, value)
+            lines.append('    {0} = d[{0!r}] = {1}'.format(field.name, value))
+
+        exec '\n'.join(lines) in namespace
+        return namespace['unpack_into']
+
+    def pack_arguments(self, namespace):
+        '''Return list of expressions (using 'd' for values) that pack() passes to struct.'''
+
+        arguments = []
+        for field in self.fields:
+            if isinstance(field, Derived):
+                continue
+            if field.name is None:
+                arguments.extend(['0'] * field.count)
+                continue
+            value = 'd[{!r}]'.format(field.name)
+            if field.unconvert is not None:
+                unconverter = 'unconvert_' + field.name
+                namespace[unconverter] = field.unconvert
+                value = '{}({})'.format(unconverter, value)
+            if field.per is not None:
+                value = '{} * d[{!r}]'.format(value, field.per)
+            if field.scale is not None:
+                value = '{} / {!r}'.format(value, float(field.scale))
+            if field.count > 1:
+                arguments.extend('{}[{}]'.format(value, i) for i in range(field.count))
+            else:
+                arguments.append(value)
+        return arguments
+
+    def build_pack(self):
+        '''Generate function(glob) that returns packed body.'''
+
+        namespace = {'struct_pack': self.struct.pack}
+        lines = ['def pack(glob):',
+                 '    d = {}'.format(self.target_expression()),
+                 '    return struct_pack({})'.format(', '.join(self.pack_arguments(namespace)))]
+        exec '\n'.join(lines) in namespace
+        return namespace['pack']
+
+    def build_pack_into(self):
+        '''Generate function(glob, buffer, offset) that packs body straight into buffer (e.g. a message frame).'''
+
+        namespace = {'struct_pack_into': self.struct.pack_into}
+        lines = ['def pack_into(glob, buffer, offset):',
+                 '    d = {}'.format(self.target_expression()),
+                 '    struct_pack_into(buffer, offset, {})'.format(', '.join(self.pack_arguments(namespace)))]
+        exec '\n'.join(lines) in namespace
+        return namespace['pack_into']
+
+    def decode(self, data_bytes, instance=1):
+        glob = self.glob_class(instance=instance)
+        self.unpack_into(glob, data_bytes)
+        return glob
+
+    def __repr__(self):
+        return '<GlobCodec {} firmware {}+ {}>'.format(self.glob_class.__name__, self.first_firmware_version,
+                                                       self.format)
+
+class GlobCodecRegistry(object):
+    '''Every layout of every glob class, compiled once. Hands out GlobCodecs for a firmware version.'''
+
+    def __init__(self, glob_classes):
+
+        # Glob ID -> list of codecs, oldest layout first.
+        self.layouts = {}
+        for glob_class in glob_classes:
+            codecs = [GlobCodec(glob_class, version, fields)
+                      for version, fields in sorted(glob_class.schemas.items())]
+            self.layouts[glob_class.id] = codecs
+
+        # Firmware version -> GlobCodecs.
+        self.by_firmware = {}
+
+    def latest(self, glob_id):
+        return self.layouts[glob_id][-1]
+
+    def codec_for(self, glob_id, firmware_version):
+        '''Newest layout that firmware version uses, or newest layout if version is unknown (None).'''
+        codecs = self.layouts.get(glob_id)
+        if not codecs:
+            return None
+        if firmware_version is None:
+            return codecs[-1]
+        usable = [codec for codec in codecs if codec.first_firmware_version <= firmware_version]
+        return usable[-1] if usable else codecs[0]
+
+    def codecs_for_firmware(self, firmware_version):
+
+        codecs = self.by_firmware.get(firmware_version)
+        if codecs is None:
+            codecs = self.by_firmware[firmware_version] = GlobCodecs(self, firmware_version)
+        return codecs
+
+class GlobCodecs(object):
+    '''Codec of every glob for one firmware version.'''
+
+    def __init__(self, registry, firmware_version):
+
+        self.registry = registry
+        self.firmware_version = firmware_version
+        self.codecs = dict((glob_id, registry.codec_for(glob_id, firmware_version))
+                           for glob_id in registry.layouts)
+
+    def get(self, glob_id):
+        return self.codecs.get(glob_id)
+
+    def decode(self, glob_id, instance, body):
+        '''Return glob decoded from body, or None if it's not a glob this GUI knows or body doesn't fit any layout.'''
+
+        codec = self.codecs.get(glob_id)
+        if codec is None:
+            return None
+        if len(body) != codec.size:
+            # Robot's version not known yet (or wrong), look for a layout that fits.
+            matching = [c for c in self.registry.layouts[glob_id] if c.size == len(body)]
+            if not matching:
+                return None
+            codec = matching[-1]
+        return codec.decode(body, instance)
+
+    def pack(self, glob):
+        '''Return body of glob in this firmware's layout.'''
+        codec = self.codecs.get(glob.id)
+        if codec is None or codec.pack is None:
+            return glob.pack() # variable length or hand written
+        return codec.pack(glob)
+
+    def body_size(self, glob):
+        '''Number of bytes pack_into() will write for glob.'''
+        codec = self.codecs.get(glob.id)
+        if codec is None or codec.pack_into is None:
+            return glob.body_size()
+        return codec.size
+
+    def pack_into(self, glob, buffer, offset):
+        '''Pack body of glob into buffer starting at offset, without making a copy. Returns body size.'''
+        codec = self.codecs.get(glob.id)
+        if codec is None or codec.pack_into is None:
+            return glob.pack_into(buffer, offset)
+        codec.pack_into(glob, buffer, offset)
+        return codec.size
@@ -0,0 +1,94 @@
+'''
+Link throughput measured from snapshots of the link's counters, each timestamped with a monotonic clock.
+Rates are divided by the time that actually passed between snapshots so they stay right when whatever
+updates the meter runs late (e.g. GUI thread busy).
+'''
+import math
+from clock import monotonic
+
+# Seconds for average rates to move about 2/3 of the way to a new steady rate.
+DEFAULT_TIME_CONSTANT = 2.0
+
+# Bits sent on the wire for every byte (start bit, 8 data bits, stop bit).
+BITS_PER_BYTE = 10
+
+link_counter_names = ('bytes_sent', 'messages_sent', 'bytes_received', 'messages_received')
+
+class Rate(object):
+    '''Per second rate of one counter.'''
+
+    def __init__(self):
+        self.instant = 0.0  # over last interval
+        self.average = 0.0  # exponentially weighted moving average
+        self.peak = 0.0     # highest instant rate since reset
+
+    def update(self, delta, elapsed, weight):
+        self.instant = delta / elapsed
+        self.average += weight * (self.instant - self.average)
+        self.peak = max(self.peak, self.instant)
+
+class LinkMeter(object):
+
+    def __init__(self, link, time_constant=DEFAULT_TIME_CONSTANT):
+
+        # Needs link_counters() and baud_rate.
+        self.link = link
+        self.time_constant = time_constant
+        self.reset()
+
+    def reset(self):
+
+        self.rates = dict((name, Rate()) for name in link_counter_names)
+        self.last_counters = None
+        self.last_time = None
+
+        # Monotonic time bytes were last received (or meter was reset).
+        self.last_receive_time = monotonic()
+
+    def update(self):
+        '''Take snapshot of link counters and update rates. Returns seconds since last snapshot (0 if first).'''
+
+        counters = self.link.link_counters()
+        now = monotonic()
+
+        last_counters = self.last_counters
+        if last_counters is None or any(counters[name] < last_counters[name] for name in link_counter_names):
+            # First snapshot, or link was reconnected and its counters started over.
+            if last_counters is not None:
+                self.reset()
+            self.last_counters = counters
+            self.last_time = now
+            return 0.0
+
+        elapsed = now - self.last_time
+        if elapsed <= 0:
+            return 0.0
+
+        # Weight depends on elapsed time so a late update counts for as much time as it covers.
+        weight = 1 - math.exp(-elapsed / self.time_constant)
+        for name in link_counter_names:
+            self.rates[name].update(counters[name] - last_counters[name], elapsed, weight)
+
+        if counters['bytes_received'] > last_counters['bytes_received']:
+            self.last_receive_time = now
+
+        self.last_counters = counters
+        self.last_time = now
+        return elapsed
+
+    def seconds_since_received(self):
+        return monotonic() - self.last_receive_time
+
+    def utilization(self, direction):
+        '''Percent of baud rate used by average byte rate. Direction is 'sent' or 'received'.'''
+        bits_per_second = self.rates['bytes_' + direction].average * BITS_PER_BYTE
+        return 100.0 * bits_per_second / self.link.baud_rate
+
+    def stats(self):
+        '''Return dictionary of rate dictionaries (instant, average, peak) by counter name, plus utilization.'''
+        stats = dict((name, {'instant': rate.instant, 'average': rate.average, 'peak': rate.peak})
+                     for name, rate in self.rates.items())
+        stats['tx_utilization'] = self.utilization('sent')
+        stats['rx_utilization'] = self.utilization('received')
+        stats['baud_rate'] = self.link.baud_rate
+        return stats
@@ -0,0 +1,179 @@
+import os
+import json
+from eeva_glob import PidParams
+
+PID_PROFILE_FILENAME = 'pid_profiles.json'
+
+# Gain fields stored in profiles. Limits are stored separately, robot doesn't require them to be symmetric.
+profile_fields = ('kp', 'ki', 'kd', 'integral_lolimit', 'integral_hilimit', 'lolimit', 'hilimit')
+
+def params_match(params1, params2):
+    '''True if both would be stored the same on the robot (compares single precision values).'''
+    if params1 is None or params2 is None:
+        return False
+    return params1.pack() == params2.pack()
+
+def params_to_profile_entry(params):
+    return dict((field, getattr(params, field)) for field in profile_fields)
+
+def profile_entry_to_params(entry, index):
+    params = PidParams(instance=index + 1)
+    for field in profile_fields:
+        setattr(params, field, float(entry.get(field, 0)))
+    return params
+
+class PidParamCache(object):
+    '''
+    Remembers the last gains the robot confirmed for each controller so that only controllers whose
+    gains actually changed get sent.
+    '''
+
+    def __init__(self, link, requests, notify=None):
+
+        self.link = link
+        self.requests = requests
+        # Called with a message when robot doesn't end up with the gains that were sent.
+        self.notify = notify
+        self.clear()
+
+    def clear(self):
+        '''Forget everything, should be called when (re)connecting since robot may have restarted.'''
+
+        # Last params robot reported for each controller (None until received).
+        self.confirmed = [None] * PidParams.num_controllers
+
+        # Last params sent that robot hasn't confirmed yet.
+        self.sent = [None] * PidParams.num_controllers
+
+        self.num_sends_skipped = 0
+        self.num_unconfirmed = 0
+
+    def confirm(self, params):
+        '''Should be called with every PidParams received from robot.'''
+
+        index = params.instance - 1
+        self.confirmed[index] = params
+        if params_match(self.sent[index], params):
+            self.sent[index] = None
+
+    def needs_update(self, index, params):
+        '''True if params differ from both what robot has and what's already on the way.'''
+        return not params_match(self.confirmed[index], params) and not params_match(self.sent[index], params)
+
+    def update(self, index, params):
+        '''Send params for controller index if they changed. Returns true if they were sent.'''
+
+        params.instance = index + 1
+
+        if not self.needs_update(index, params):
+            self.num_sends_skipped += 1
+            return False
+
+        self.sent[index] = params
+        self.link.send(params)
+        # Ask for gains back to verify that robot got them.
+        self.requests.request(PidParams.id, instance=params.instance, fresh=True,
+                              callback=lambda request: self.check_reply(request, {index: params}))
+        return True
+
+    def update_many(self, params_by_index):
+        '''
+        Send every changed controller in dictionary of index -> params and verify them with as few
+        messages as possible. Returns list of indices that were sent.
+        '''
+        changed = [index for index, params in sorted(params_by_index.items()) if self.needs_update(index, params)]
+        self.num_sends_skipped += len(params_by_index) - len(changed)
+
+        for index in changed:
+            params = params_by_index[index]
+            params.instance = index + 1
+            self.sent[index] = params
+            self.link.send(params)
+
+        # One request for everything costs 1 message out and one back per controller, individual
+        # requests cost 2 per changed controller, so pick whichever is fewer.
+        if 2 * len(changed) > 1 + PidParams.num_controllers:
+            all_instances = range(1, PidParams.num_controllers + 1)
+            sent_params = dict((index, params_by_index[index]) for index in changed)
+            self.requests.request(PidParams.id, instance=0, expected_instances=all_instances, fresh=True,
+                                  callback=lambda request: self.check_reply(request, sent_params))
+        else:
+            for index in changed:
+                sent_params = {index: params_by_index[index]}
+                self.requests.request(PidParams.id, instance=index + 1, fresh=True,
+                                      callback=lambda request, sent_params=sent_params:
+                                          self.check_reply(request, sent_params))
+
+        return changed
+
+    def check_reply(self, request, sent_params):
+        '''
+        Called when verify request for dictionary of index -> params sent finishes.  If robot didn't answer, or
+        answered with different gains (e.g. message lost or robot limited a value), they're forgotten as sent so
+        entering the same gains again sends them again.
+        '''
+        for index, params in sent_params.items():
+            if self.sent[index] is not params:
+                continue # already confirmed, or newer gains sent since
+            body = request.replies.get(index + 1) if request.succeeded else None
+            reply = self.link.codecs.decode(PidParams.id, index + 1, body) if body is not None else None
+            if params_match(params, reply):
+                continue # confirm() clears it
+            self.sent[index] = None
+            self.num_unconfirmed += 1
+            if self.notify:
+                if reply is None:
+                    self.notify('Robot did not confirm gains for controller {}.'.format(index))
+                else:
+                    self.notify('Robot has different gains than were sent for controller {}.'.format(index))
+
+    def current_params(self, index):
+        '''Best known params for controller: confirmed, or on the way if robot hasn't answered yet.'''
+        return self.sent[index] or self.confirmed[index]
+
+class PidProfileStore(object):
+    '''Named sets of gains for every controller, saved as JSON.'''
+
+    def __init__(self, filepath):
+
+        self.filepath = filepath
+
+    def load_all(self):
+
+        if not os.path.exists(self.filepath):
+            return {}
+        with open(self.filepath, 'r') as profile_file:
+            return json.load(profile_file)
+
+    def profile_names(self):
+        return sorted(self.load_all().keys())
+
+    def save(self, name, cache):
+        '''Save best known gains of every controller under name. Controllers with unknown gains are left out.'''
+
+        profiles = self.load_all()
+        entry = {}
+        for index in range(PidParams.num_controllers):
+            params = cache.current_params(index)
+            if params is not None:
+                entry[str(index)] = params_to_profile_entry(params)
+        profiles[name] = entry
+
+        with open(self.filepath, 'w') as profile_file:
+            json.dump(profiles, profile_file, indent=4, sort_keys=True)
+
+    def delete(self, name):
+
+        profiles = self.load_all()
+        if profiles.pop(name, None) is not None:
+            with open(self.filepath, 'w') as profile_file:
+                json.dump(profiles, profile_file, indent=4, sort_keys=True)
+
+    def get(self, name):
+        '''Return dictionary of controller index -> PidParams. Raises KeyError if profile doesn't exist.'''
+        entry = self.load_all()[name]
+        return dict((int(index), profile_entry_to_params(values, int(index))) for index, values in entry.items())
+
+    def restore(self, name, cache):
+        '''Send saved gains to robot, only for controllers that differ. Returns list of indices that were sent.'''
+        return cache.update_many(self.get(name))
@@ -0,0 +1,339 @@
+'''
+Keeps a list of serial ports up to date in a background thread so the GUI never waits on a port scan.
+
+On Linux /dev and /dev/serial/by-id are watched with inotify, and only ports that were added or removed are
+looked up.  Everywhere else (or if inotify isn't available) every port is listed again every few seconds.
+Whoever created the watcher is told about changes through the scheduler so it happens in the main thread.
+
+Each port is a dictionary with 'device' (name to open), 'description', 'hwid' (includes USB serial number
+when there is one) and 'by_id' (stable /dev/serial/by-id name on Linux, None otherwise).
+'''
+import os
+import re
+import sys
+import glob
+import select
+import struct
+import threading
+
+# Seconds between full scans when ports can't be watched.
+PORT_POLL_INTERVAL = 2.0
+
+# Seconds to wait after a change before looking at ports, since a device creates several files at once.
+PORT_SETTLE_TIME = 0.1
+
+DEV_DIRECTORY = '/dev'
+SERIAL_DIRECTORY = '/dev/serial'
+BY_ID_DIRECTORY = '/dev/serial/by-id'
+
+# Same devices pyserial lists on Linux.
+linux_port_pattern = re.compile(r'^(ttyS|ttyUSB|ttyXRUSB|ttyACM|ttyAMA|rfcomm|ttyAP)\d+$')
+
+# inotify event masks (from sys/inotify.h)
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000 # watch was removed, e.g. directory deleted
+inotify_event_header = struct.Struct('iIII') # watch descriptor, mask, cookie, name length
+
+def scan_ports():
+    '''Return list of every serial port (slow on some machines, this is what the watcher avoids doing).'''
+
+    from serial.tools import list_ports
+    by_id = read_by_id_links()
+    return [{'device': p[0], 'description': p[1], 'hwid': p[2], 'by_id': by_id.get(p[0])}
+            for p in list_ports.comports()]
+
+def describe_linux_port(device, by_id):
+    '''
+    Return port dictionary for one device, or None if it's not a usable port.
+    Raises ImportError if pyserial is too old to look up one port at a time.
+    '''
+    from serial.tools.list_ports_linux import SysFS
+    info = SysFS(device)
+    if info.subsystem == 'platform':
+        return None # internal port that isn't really there
+    return {'device': device, 'description': info.description, 'hwid': info.hwid, 'by_id': by_id.get(device)}
+
+def read_by_id_links():
+    '''Return dictionary of device -> /dev/serial/by-id link that points to it.'''
+    by_id = {}
+    for link in glob.glob(os.path.join(BY_ID_DIRECTORY, '*')):
+        by_id[os.path.realpath(link)] = link
+    return by_id
+
+def same_device(port1, port2):
+    '''True if both port dictionaries look like the same adapter (e.g. after it was unplugged and plugged back in).'''
+    if port1 is None or port2 is None:
+        return False
+    if port1['by_id'] and port1['by_id'] == port2['by_id']:
+        return True
+    # Hardware ID has USB serial number, if adapter doesn't have one this could match a different adapter of the
+    # same type which is still better than trying ports in random order.
+    return bool(port1['hwid']) and port1['hwid'] not in ('n/a', 'PNP0501') and port1['hwid'] == port2['hwid']
+
+class Inotify(object):
+    '''Minimal inotify wrapper using ctypes. Raises OSError if inotify isn't available.'''
+
+    def __init__(self):
+
+        import ctypes
+        import ctypes.util
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError('libc not found')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init'):
+            raise OSError('inotify not supported')
+
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+
+        self.watches = {} # watch descriptor -> directory
+
+    def add_watch(self, directory, mask):
+        '''Returns true if directory is being watched.'''
+        wd = self.libc.inotify_add_watch(self.fd, directory, mask)
+        if wd < 0:
+            return False
+        self.watches[wd] = directory
+        return True
+
+    def read_events(self):
+        '''Return list of (directory, name, mask) for events waiting on fd.'''
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset + inotify_event_header.size <= len(data):
+            wd, mask, _, name_length = inotify_event_header.unpack_from(data, offset)
+            offset += inotify_event_header.size
+            name = data[offset:offset + name_length].rstrip('\0')
+            offset += name_length
+            events.append((self.watches.get(wd), name, mask))
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class PortWatcher(object):
+
+    def __init__(self, scheduler, ports_changed=None, poll_interval=PORT_POLL_INTERVAL):
+
+        self.scheduler = scheduler
+
+        # Called with list of port dictionaries in the main thread whenever ports change.
+        self.ports_changed = ports_changed
+
+        self.poll_interval = poll_interval
+
+        # Device name -> port dictionary. Only changed while holding lock.
+        self.port_cache = {}
+        self.lock = threading.Lock()
+
+        # Set once first scan is done.
+        self.scanned = threading.Event()
+
+        self.thread = None
+        self.stop_request = threading.Event()
+        self.scan_request = threading.Event()
+
+        # Writing to this pipe wakes up thread waiting on inotify.
+        self.wake_read_fd, self.wake_write_fd = None, None
+
+    def start(self):
+
+        if self.thread is not None:
+            return
+        self.stop_request.clear()
+        if os.name == 'posix':
+            self.wake_read_fd, self.wake_write_fd = os.pipe()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+
+        if self.thread is None:
+            return
+        self.stop_request.set()
+        self.wake()
+        self.thread.join(1.0)
+        self.thread = None
+        if self.wake_read_fd is not None:
+            os.close(self.wake_read_fd)
+            os.close(self.wake_write_fd)
+            self.wake_read_fd, self.wake_write_fd = None, None
+
+    def wake(self):
+        self.scan_request.set()
+        if self.wake_write_fd is not None:
+            os.write(self.wake_write_fd, 'x')
+
+    def request_scan(self):
+        '''Have background thread list every port again (e.g. user clicked refresh).'''
+        if self.thread is None:
+            self.scan()
+        else:
+            self.wake()
+
+    def ports(self):
+        '''Return cached list of port dictionaries sorted by device name.'''
+        with self.lock:
+            return sorted(self.port_cache.values(), key=lambda port: port['device'])
+
+    def port_names(self):
+        return [port['device'] for port in self.ports()]
+
+    def get(self, device):
+        '''Return port dictionary for device, or None if it's not (or no longer) there.'''
+        with self.lock:
+            return self.port_cache.get(device)
+
+    def scan(self):
+        '''List every port now (blocks) and update cache. Returns list of port dictionaries.'''
+        try:
+            ports = scan_ports()
+        except (OSError, IOError):
+            ports = []
+        self.set_ports(dict((port['device'], port) for port in ports))
+        self.scanned.set()
+        return self.ports()
+
+    def set_ports(self, new_cache):
+
+        with self.lock:
+            changed = new_cache != self.port_cache
+            self.port_cache = new_cache
+
+        if changed or not self.scanned.is_set():
+            self.notify()
+
+    def notify(self):
+
+        if self.ports_changed:
+            ports = self.ports()
+            self.scheduler.call_from_thread(lambda: self.ports_changed(ports))
+
+    def run(self):
+
+        self.scan()
+
+        inotify = None
+        if sys.platform.startswith('linux'):
+            try:
+                inotify = Inotify()
+            except OSError:
+                pass # poll instead
+
+        if inotify is None:
+            self.poll()
+        else:
+            try:
+                self.watch(inotify)
+            finally:
+                inotify.close()
+
+    def poll(self):
+
+        while not self.stop_request.is_set():
+            self.scan_request.wait(self.poll_interval)
+            self.scan_request.clear()
+            if not self.stop_request.is_set():
+                self.scan()
+
+    def watch(self, inotify):
+
+        mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+        inotify.add_watch(DEV_DIRECTORY, mask)
+        watching_by_id = inotify.add_watch(BY_ID_DIRECTORY, mask)
+        # Only needed while by-id doesn't exist, so its creation is seen even if it's made after /dev/serial.
+        watching_serial = False
+
+        while not self.stop_request.is_set():
+
+            readable, _, _ = select.select([inotify.fd, self.wake_read_fd], [], [])
+
+            if self.wake_read_fd in readable:
+                os.read(self.wake_read_fd, 4096)
+                if self.stop_request.is_set():
+                    break
+                if self.scan_request.is_set():
+                    self.scan_request.clear()
+                    self.scan()
+
+            if inotify.fd not in readable:
+                continue
+
+            # Wait for the rest of the files a new device creates before looking at it.
+            self.stop_request.wait(PORT_SETTLE_TIME)
+            events = inotify.read_events()
+
+            added, removed, by_id_changed = set(), set(), False
+            for directory, name, event_mask in events:
+                if event_mask & IN_Q_OVERFLOW:
+                    self.scan() # missed events
+                    added, removed, by_id_changed = set(), set(), False
+                    continue
+                if directory == BY_ID_DIRECTORY:
+                    by_id_changed = True
+                    if event_mask & IN_IGNORED:
+                        # Last USB adapter was unplugged and by-id directory went with it.
+                        watching_by_id = False
+                elif directory == SERIAL_DIRECTORY:
+                    by_id_changed = True
+                    if event_mask & IN_IGNORED:
+                        watching_serial = False
+                elif name == 'serial':
+                    by_id_changed = True
+                elif linux_port_pattern.match(name):
+                    device = os.path.join(DEV_DIRECTORY, name)
+                    if event_mask & (IN_DELETE | IN_MOVED_FROM):
+                        removed.add(device)
+                        added.discard(device)
+                    else:
+                        added.add(device)
+                        removed.discard(device)
+
+            if not watching_by_id:
+                # First USB adapter plugged in since start up (or since the last one was unplugged) creates
+                # /dev/serial then by-id.  Parent is watched first so by-id is seen whichever way that races.
+                if not watching_serial and os.path.isdir(SERIAL_DIRECTORY):
+                    watching_serial = inotify.add_watch(SERIAL_DIRECTORY, mask)
+                if os.path.isdir(BY_ID_DIRECTORY):
+                    watching_by_id = inotify.add_watch(BY_ID_DIRECTORY, mask)
+                    by_id_changed = True
+
+            if added or removed or by_id_changed:
+                self.update_ports(added, removed)
+
+    def update_ports(self, added, removed):
+        '''Look up only the ports that changed.'''
+
+        by_id = read_by_id_links()
+        new_cache = dict((device, dict(port)) for device, port in self.ports_by_device().items()
+                         if device not in removed)
+
+        for device in added:
+            try:
+                port = describe_linux_port(device, by_id) if os.path.exists(device) else None
+            except ImportError:
+                self.scan()
+                return
+            if port is None:
+                new_cache.pop(device, None)
+            else:
+                new_cache[device] = port
+
+        for device, port in new_cache.items():
+            port['by_id'] = by_id.get(device)
+
+        self.set_ports(new_cache)
+
+    def ports_by_device(self):
+        with self.lock:
+            return dict(self.port_cache)
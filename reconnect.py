@@ -0,0 +1,221 @@
+'''
+Reconnects to the robot when it stops responding or its port goes away, then puts back the mode, gains and
+capture settings it had so the user doesn't have to.
+
+The port the robot was on is tried first.  If the robot's ID is known every other serial port is tried too,
+since a USB adapter that gets unplugged can come back with a different name (e.g. /dev/ttyUSB1 instead of 0).
+Ports the port watcher says are the same adapter (same /dev/serial/by-id link or USB serial number) go first.
+After every port has been tried the next attempt waits twice as long as the last one, up to a limit.
+
+Ports are opened locked, so ports another EevaUI has open are skipped, and nothing is sent on a port until the
+robot on it reports the ID of the one that was lost, so a robot that isn't ours never has its capture stopped.
+'''
+import os
+import time
+from port_watcher import same_device
+
+# Seconds to wait before first attempt, doubled after every attempt that doesn't find the robot.
+RECONNECT_INITIAL_DELAY = 0.5
+RECONNECT_MAX_DELAY = 8.0
+
+# Seconds to wait for robot to report its ID after a port is opened.
+ROBOT_RESPONSE_TIMEOUT = 2.0
+RESPONSE_CHECK_INTERVAL = 0.05
+
+# Failed attempts before suggesting things for the user to check.
+ATTEMPTS_BEFORE_HINT = 3
+
+# States
+IDLE = 'idle'               # not connected, or user disconnected
+CONNECTED = 'connected'     # robot responding
+WAITING = 'waiting'         # connection lost, waiting before next attempt
+VERIFYING = 'verifying'     # port open, waiting for robot to report its ID
+RESTORING = 'restoring'     # robot found, waiting for it to confirm restored settings
+
+class AutoReconnector(object):
+
+    def __init__(self, connection_controller, scheduler, port_watcher=None):
+
+        self.connection = connection_controller
+        self.controller = connection_controller.controller
+        self.scheduler = scheduler
+
+        # Has current list of serial ports. Only needed to look for a robot that moved to another port.
+        self.port_watcher = port_watcher
+
+        self.enabled = True
+        self.state = IDLE
+
+        # Incremented whenever state machine is started or stopped so old timers do nothing.
+        self.generation = 0
+
+        # Port and robot from the connection that was lost.
+        self.port_name = None
+        self.robot_id = None
+        self.port_changed = False
+
+        # Port watcher info (description, hardware ID...) of port, to recognize same adapter on a new port.
+        self.port_info = None
+
+        # Robot settings to restore (from EevaController.robot_state()).
+        self.saved_state = None
+
+        self.attempts = 0
+        self.delay = RECONNECT_INITIAL_DELAY
+        self.candidate_ports = []
+        self.response_deadline = 0
+
+        # Times (time.time()) of the recovery in progress.
+        self.lost_time = None
+        self.responding_time = None
+
+        # One dictionary per completed recovery, see restore_finished().
+        self.recoveries = []
+
+    def connection_made(self, port_name):
+        '''Should be called when user connects to a port.'''
+        self.generation += 1
+        self.state = CONNECTED
+        self.port_name = port_name
+        self.port_info = self.port_watcher.get(port_name) if self.port_watcher else None
+
+    def stop(self):
+        '''Should be called when user disconnects. Cancels reconnect in progress.'''
+        self.generation += 1
+        self.state = IDLE
+
+    @property
+    def reconnecting(self):
+        return self.state in (WAITING, VERIFYING, RESTORING)
+
+    def connection_lost(self, reason):
+        '''Start reconnecting if connected. Reason is shown to the user.'''
+
+        if not self.enabled or self.state != CONNECTED:
+            return
+
+        self.generation += 1
+        self.state = WAITING
+        self.lost_time = time.time()
+        self.responding_time = None
+        self.robot_id = self.controller.robot_id
+        if self.port_watcher:
+            self.port_info = self.port_watcher.get(self.port_name) or self.port_info
+        self.saved_state = self.controller.robot_state()
+        self.attempts = 0
+        self.delay = RECONNECT_INITIAL_DELAY
+
+        self.controller.display_message('Lost connection to robot ({}). Reconnecting...'.format(reason))
+        if self.controller.capturing_data:
+            self.controller.display_message('Data being collected was lost.')
+
+        self.connection.close_port()
+        self.call_later(self.delay, self.start_attempt)
+
+    def call_later(self, delay, callback):
+
+        generation = self.generation
+
+        def call_if_current():
+            if generation == self.generation:
+                callback()
+
+        self.scheduler.call_later(delay, call_if_current)
+
+    def find_candidate_ports(self):
+
+        candidates = []
+        if os.name != 'posix' or os.path.exists(self.port_name):
+            candidates.append(self.port_name)
+
+        if self.port_watcher:
+            others = [port for port in self.port_watcher.ports() if port['device'] != self.port_name]
+            if self.robot_id is None:
+                # Can't tell if it's the same robot, so only try the same adapter.
+                others = [port for port in others if same_device(self.port_info, port)]
+            # Same adapter is most likely.
+            others.sort(key=lambda port: not same_device(self.port_info, port))
+            candidates.extend(port['device'] for port in others)
+
+        return candidates
+
+    def start_attempt(self):
+
+        self.attempts += 1
+        self.candidate_ports = self.find_candidate_ports()
+        self.try_next_port()
+
+    def try_next_port(self):
+
+        while self.candidate_ports:
+            port_name = self.candidate_ports.pop(0)
+            if self.connection.reopen_port(port_name):
+                self.state = VERIFYING
+                self.response_deadline = time.time() + ROBOT_RESPONSE_TIMEOUT
+                self.call_later(RESPONSE_CHECK_INTERVAL, lambda: self.check_for_robot(port_name))
+                return
+
+        # Every port tried, wait longer before trying again.
+        if self.attempts == ATTEMPTS_BEFORE_HINT:
+            self.controller.display_message("Still can't reach robot. Check that it's on and in range, and that "
+                                            "your operating system isn't using a power-save mode for bluetooth.")
+        self.state = WAITING
+        self.delay = min(self.delay * 2, RECONNECT_MAX_DELAY)
+        self.call_later(self.delay, self.start_attempt)
+
+    def check_for_robot(self, port_name):
+
+        if self.controller.verified_robot_id:
+            if self.robot_id is None or self.controller.robot_id == self.robot_id:
+                self.robot_found(port_name)
+                return
+            self.controller.display_message('Robot on {} is a different robot.'.format(port_name))
+        elif time.time() < self.response_deadline:
+            self.call_later(RESPONSE_CHECK_INTERVAL, lambda: self.check_for_robot(port_name))
+            return
+
+        self.connection.close_port()
+        self.try_next_port()
+
+    def robot_found(self, port_name):
+
+        self.state = RESTORING
+        self.responding_time = time.time()
+        self.port_changed = port_name != self.port_name
+        self.port_name = port_name
+        if self.port_watcher:
+            self.port_info = self.port_watcher.get(port_name) or self.port_info
+
+        self.connection.port_reconnected(port_name)
+        self.controller.restore_robot_state(self.saved_state, callback=self.restore_finished)
+
+    def restore_finished(self, request):
+
+        if self.state != RESTORING:
+            return # user disconnected while restoring
+
+        self.state = CONNECTED
+        restored_time = time.time()
+
+        recovery = {'lost_time': self.lost_time,
+                    'time_to_respond': self.responding_time - self.lost_time,
+                    'time_to_restore': restored_time - self.responding_time,
+                    'time_to_recover': restored_time - self.lost_time,
+                    'attempts': self.attempts,
+                    'port': self.port_name,
+                    'port_changed': self.port_changed,
+                    'restore_confirmed': request.succeeded}
+        self.recoveries.append(recovery)
+
+        self.controller.display_message('Reconnected{} in {:.1f} s ({} attempts, settings restored in {:.2f} s).'.format(
+                                        ' on {}'.format(self.port_name) if self.port_changed else '',
+                                        recovery['time_to_recover'], self.attempts, recovery['time_to_restore']))
+        if not request.succeeded:
+            self.controller.display_message("Robot didn't confirm all restored gains.")
+
+    def recovery_stats(self):
+        '''Return dictionary with number of recoveries and mean and max time to recover (seconds).'''
+        times = [recovery['time_to_recover'] for recovery in self.recoveries]
+        if not times:
+            return {'count': 0, 'mean': 0.0, 'max': 0.0}
+        return {'count': len(times), 'mean': sum(times) / len(times), 'max': max(times)}
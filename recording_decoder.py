@@ -0,0 +1,431 @@
+'''
+Decodes raw recordings of the serial link (every byte the robot sent, as written by a serial logger) into one
+numpy structured array per glob type, without going through GlobParser one byte at a time.
+
+The file is memory mapped and split into blocks that start at resync points (the start of a message with a
+valid CRC) so each block can be decoded on its own by a process pool.  In each block:
+
+ - every start byte followed by a valid CRC flag, and a size that fits the glob ID, is a candidate message
+ - CRCs of all candidates are computed at once, one column of bytes at a time (longest messages first)
+ - messages that start inside an earlier valid message are thrown out, like the parser would never see them
+ - bodies of each glob type are gathered into a 2D byte array and viewed as a structured array built from
+   the glob's schema, then scales and derived values (see glob_schema.py) are applied to whole columns
+
+Every array also has the message's file offset, instance and packet number.  Fields with a convert function
+(e.g. StatusData robot_id) are left as raw values.
+
+    python recording_decoder.py link.bin --output link.npz --globs CaptureData StatusData
+
+Needs numpy.
+'''
+import os
+import sys
+import mmap
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from crc import crc_table, calculate_crc
+from glob_schema import Field, Derived
+from eeva_glob import glob_codecs, codecs_for_firmware, CaptureData, StatusData
+
+MESSAGE_START_BYTE = 0xFE
+
+# Start byte, CRC flag, ID, instance (2), packet number, body size.
+HEADER_SIZE = 7
+CRC_SIZE = 2
+
+# Bytes per block handed to a process. Small enough that a block's temporary arrays stay well under 1 GB.
+DEFAULT_BLOCK_SIZE = 16 * 1024 * 1024
+
+# Bytes searched for a resync point before giving up on splitting there.
+RESYNC_WINDOW = 64 * 1024
+
+default_glob_ids = (CaptureData.id, StatusData.id)
+
+numpy_types = {'b': 'i1', 'B': 'u1', '?': '?', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4', 'l': '<i4',
+               'L': '<u4', 'q': '<i8', 'Q': '<u8', 'f': '<f4', 'd': '<f8'}
+
+np_crc_table = np.array(crc_table, dtype=np.uint16)
+
+def body_dtype(codec):
+    '''Numpy dtype with the same layout as codec's struct (little-endian, no padding). Padding is named _padN.'''
+
+    fields = []
+    for index, field in enumerate(f for f in codec.fields if isinstance(f, Field)):
+        name = field.name if field.name is not None else '_pad{}'.format(index)
+        if field.type_code.endswith('s'):
+            fields.append((name, 'S{}'.format(field.type_code[:-1] or 1)))
+        elif field.count > 1:
+            fields.append((name, numpy_types[field.type_code], (field.count,)))
+        else:
+            fields.append((name, numpy_types[field.type_code]))
+
+    dtype = np.dtype(fields)
+    if dtype.itemsize != codec.size:
+        raise ValueError('{} has a type numpy can not match.'.format(codec))
+    return dtype
+
+def decode_columns(codec, raw):
+    '''Return list of (name, array) of decoded values for structured array of raw bodies.'''
+
+    count = len(raw)
+    decoded = {}
+    columns = []
+    for field in codec.fields:
+
+        if isinstance(field, Derived):
+            # Expressions are written for one glob, so fields with several values are given with values first
+            # (e.g. 'values[0]' is then the first value of every message).
+            namespace = dict((name, value.T if value.ndim > 1 else value) for name, value in decoded.items())
+            try:
+                value = np.asarray(eval(field.expression, {}, namespace))
+            except Exception:
+                continue # doesn't work on whole columns
+            if value.ndim == 0:
+                value = np.repeat(value, count)
+            elif value.ndim > 1:
+                value = value.T
+            if value.shape[0] != count:
+                continue
+        elif field.name is None:
+            continue # padding
+        else:
+            value = raw[field.name]
+            if field.convert is None:
+                if field.scale is not None:
+                    value = value * float(field.scale)
+                if field.per is not None:
+                    value = value / decoded[field.per]
+
+        decoded[field.name] = value
+        columns.append((field.name, value))
+
+    return columns
+
+def structured_array(offsets, headers, columns):
+    '''Combine message file offsets, header columns and decoded columns into one structured array.'''
+
+    columns = [('file_offset', offsets), ('instance', headers['instance']),
+               ('packet_num', headers['packet_num'])] + columns
+    dtype = np.dtype([(name, value.dtype, value.shape[1:]) for name, value in columns])
+    array = np.empty(len(offsets), dtype=dtype)
+    for name, value in columns:
+        array[name] = value
+    return array
+
+def allowed_sizes(firmware_version):
+    '''
+    Return 256 x 256 boolean array, true for (glob ID, body size) a message could have.  IDs without a schema
+    can be any size.  Also returns dictionary of (glob ID, body size) -> codec, preferring firmware's layout.
+    '''
+    allowed = np.ones((256, 256), dtype=bool)
+    codecs = {}
+    firmware_codecs = codecs_for_firmware(firmware_version)
+    for glob_id, layouts in glob_codecs.layouts.items():
+        allowed[glob_id, :] = False
+        for codec in layouts:
+            if codec.size < 256:
+                allowed[glob_id, codec.size] = True
+                codecs[(glob_id, codec.size)] = codec
+        preferred = firmware_codecs.get(glob_id)
+        if preferred is not None and preferred.size < 256:
+            codecs[(glob_id, preferred.size)] = preferred
+    return allowed, codecs
+
+def bulk_crc(data, starts, lengths):
+    '''Return CRC of every message (header and body) starting at starts with body lengths.'''
+
+    # Longest first so the messages still being summed are always the first ones.
+    order = np.argsort(-lengths, kind='mergesort')
+    sorted_starts = starts[order]
+    sorted_ends = HEADER_SIZE + lengths[order]
+
+    crcs = np.empty(len(starts), dtype=np.uint16)
+    crcs.fill(0xFFFF)
+    num_columns = int(sorted_ends[0]) if len(starts) else 0
+    remaining = len(starts)
+    for column in range(num_columns):
+        # Drop messages that are already done.
+        while remaining and sorted_ends[remaining - 1] <= column:
+            remaining -= 1
+        crc = crcs[:remaining]
+        byte = data[sorted_starts[:remaining] + column]
+        crcs[:remaining] = ((crc & 0xFF) << 8) ^ np_crc_table[(crc >> 8) ^ byte]
+
+    result = np.empty_like(crcs)
+    result[order] = crcs
+    return result
+
+def select_messages(starts, ends):
+    '''Return boolean array, false for messages that start inside an earlier selected message.'''
+
+    keep = np.ones(len(starts), dtype=bool)
+    if len(starts) < 2:
+        return keep
+    if (starts[1:] >= np.maximum.accumulate(ends)[:-1]).all():
+        return keep
+
+    # Only when a start byte inside a message happened to pass its CRC too, so rare enough to walk.
+    last_end = 0
+    for index, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        if start < last_end:
+            keep[index] = False
+        else:
+            last_end = end
+    return keep
+
+def find_messages(data, block_start, block_end, allowed):
+    '''
+    Return (starts, body lengths, stats) of messages that start in [block_start, block_end) of data (uint8
+    array of the whole file, messages can end past block end).
+    '''
+    size = len(data)
+    last_start = min(block_end, size - HEADER_SIZE - CRC_SIZE + 1)
+    starts = np.flatnonzero(data[block_start:max(block_start, last_start)] == MESSAGE_START_BYTE) + block_start
+
+    flags = data[starts + 1]
+    starts = starts[flags <= 1]
+    ids = data[starts + 2]
+    lengths = data[starts + 6].astype(np.int64)
+    ends = starts + HEADER_SIZE + lengths + CRC_SIZE
+    candidates = allowed[ids, lengths] & (ends <= size)
+    starts, lengths, ends = starts[candidates], lengths[candidates], ends[candidates]
+
+    checked = data[starts + 1] == 1
+    crc_index = starts + HEADER_SIZE + lengths
+    expected_crcs = data[crc_index].astype(np.uint16) | (data[crc_index + 1].astype(np.uint16) << 8)
+    valid = np.zeros(len(starts), dtype=bool)
+    valid[checked] = bulk_crc(data, starts[checked], lengths[checked]) == expected_crcs[checked]
+
+    # Nothing to check messages without a CRC against, so only trust them if another message follows right after.
+    unchecked = ~checked
+    follows = np.ones(len(starts), dtype=bool)
+    inside = ends < size
+    follows[inside] = data[ends[inside]] == MESSAGE_START_BYTE
+    valid[unchecked] = follows[unchecked]
+
+    failed_starts = starts[checked & ~valid]
+    starts, lengths, ends = starts[valid], lengths[valid], ends[valid]
+    keep = select_messages(starts, ends)
+    starts, lengths, ends = starts[keep], lengths[keep], ends[keep]
+
+    # Failed CRCs inside a good message are just body bytes that look like a start byte.
+    previous = np.searchsorted(starts, failed_starts, side='right') - 1
+    inside_message = (previous >= 0) & (failed_starts < ends[np.maximum(previous, 0)])
+    stats = {'bad_crc': int((~inside_message).sum()),
+             'unchecked': int(unchecked[valid][keep].sum()) if len(keep) else 0,
+             'message_bytes': int((ends - starts).sum())}
+
+    return starts, lengths, stats
+
+def gather_bodies(data, starts, length):
+    '''Return 2D uint8 array with one row per body of given length.'''
+    bodies = np.empty((len(starts), length), dtype=np.uint8)
+    body_starts = starts + HEADER_SIZE
+    for column in range(length):
+        bodies[:, column] = data[body_starts + column]
+    return bodies
+
+def decode_block(filepath, block_start, block_end, glob_ids, firmware_version=None):
+    '''
+    Decode messages starting in [block_start, block_end) of recording.  Returns dictionary with 'globs'
+    (dictionary of (glob ID, codec first firmware version) -> structured array), 'counts' (glob ID -> number of
+    messages), packet numbers of first and last checked message, dropped messages in between and stats.
+    '''
+    allowed, codecs = allowed_sizes(firmware_version)
+
+    with open(filepath, 'rb') as recording:
+        mapped = mmap.mmap(recording.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            data = np.frombuffer(mapped, dtype=np.uint8)
+            starts, lengths, stats = find_messages(data, block_start, block_end, allowed)
+
+            ids = data[starts + 2]
+            headers = {'instance': data[starts + 3].astype(np.uint16) | (data[starts + 4].astype(np.uint16) << 8),
+                       'packet_num': data[starts + 5]}
+            checked = data[starts + 1] == 1
+            packet_nums = headers['packet_num'][checked].astype(np.int64)
+
+            counts = dict((int(glob_id), int(count)) for glob_id, count in
+                          zip(*np.unique(ids, return_counts=True)))
+
+            globs = {}
+            for glob_id in glob_ids:
+                of_type = ids == glob_id
+                for length in np.unique(lengths[of_type]).tolist():
+                    codec = codecs[(glob_id, length)]
+                    selected = of_type & (lengths == length)
+                    bodies = gather_bodies(data, starts[selected], length)
+                    raw = bodies.view(body_dtype(codec)).reshape(-1)
+                    columns = decode_columns(codec, raw)
+                    header_columns = dict((name, value[selected]) for name, value in headers.items())
+                    globs[(glob_id, codec.first_firmware_version)] = structured_array(starts[selected], header_columns,
+                                                                                      columns)
+
+            # Copy everything out of mapped file before it's closed.
+            del data
+        finally:
+            mapped.close()
+
+    stats['dropped'] = int(((np.diff(packet_nums) - 1) % 256).sum()) if len(packet_nums) else 0
+    return {'globs': globs,
+            'counts': counts,
+            'first_packet_num': int(packet_nums[0]) if len(packet_nums) else None,
+            'last_packet_num': int(packet_nums[-1]) if len(packet_nums) else None,
+            'stats': stats,
+            'block': (block_start, block_end)}
+
+def decode_block_args(args):
+    # Pool.imap only passes one argument.
+    return decode_block(*args)
+
+def is_message_start(mapped, position):
+    '''True if a message with a valid CRC starts at position of mapped file.'''
+    if position + HEADER_SIZE + CRC_SIZE > len(mapped):
+        return False
+    if ord(mapped[position + 1]) != 1:
+        return False
+    end = position + HEADER_SIZE + ord(mapped[position + 6])
+    if end + CRC_SIZE > len(mapped):
+        return False
+    expected_crc = ord(mapped[end]) + (ord(mapped[end + 1]) << 8)
+    return calculate_crc(mapped[position:end], end - position) == expected_crc
+
+def find_resync_point(mapped, position, limit):
+    '''Return first message start at or after position (and before limit), or None if there isn't one.'''
+    limit = min(limit, position + RESYNC_WINDOW, len(mapped))
+    while position < limit:
+        position = mapped.find(chr(MESSAGE_START_BYTE), position, limit)
+        if position < 0:
+            return None
+        if is_message_start(mapped, position):
+            return position
+        position += 1
+    return None
+
+def split_blocks(filepath, block_size=DEFAULT_BLOCK_SIZE):
+    '''Return list of (start, end) covering whole file, every start except the first at a resync point.'''
+
+    file_size = os.path.getsize(filepath)
+    if file_size == 0:
+        return []
+
+    boundaries = [0]
+    with open(filepath, 'rb') as recording:
+        mapped = mmap.mmap(recording.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            position = block_size
+            while position < file_size:
+                resync = find_resync_point(mapped, position, file_size)
+                if resync is not None and resync > boundaries[-1]:
+                    boundaries.append(resync)
+                    position = resync + block_size
+                else:
+                    position += block_size # no message near there, make the block bigger
+        finally:
+            mapped.close()
+
+    boundaries.append(file_size)
+    return zip(boundaries[:-1], boundaries[1:])
+
+def glob_name(glob_id):
+    codecs = glob_codecs.layouts.get(glob_id)
+    return codecs[0].glob_class.__name__ if codecs else 'glob_{}'.format(glob_id)
+
+def decode_recording(filepath, glob_ids=default_glob_ids, firmware_version=None, processes=None,
+                     block_size=DEFAULT_BLOCK_SIZE):
+    '''
+    Decode raw link recording. Returns (globs, stats) where globs is a dictionary of glob name -> structured
+    array in file order (name has '_fwN' added if messages of one glob used more than one layout) and stats has
+    message counts by glob name, bad CRCs, dropped messages and how much of the file was messages.
+    Processes is the size of the process pool (default number of cores, 1 to run in this process).
+    '''
+    start_time = time.time()
+
+    for glob_id in glob_ids:
+        if glob_id not in glob_codecs.layouts:
+            raise ValueError('Glob {} has no fixed layout to decode with.'.format(glob_id))
+
+    blocks = split_blocks(filepath, block_size)
+    jobs = [(filepath, block_start, block_end, glob_ids, firmware_version) for block_start, block_end in blocks]
+
+    if processes == 1 or len(jobs) <= 1:
+        results = [decode_block_args(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(decode_block_args, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    # Blocks come back in file order, so arrays only need to be joined.
+    pieces = {}
+    counts = {}
+    stats = {'bad_crc': 0, 'unchecked': 0, 'message_bytes': 0, 'dropped': 0}
+    last_packet_num = None
+    for result in results:
+        for key, array in result['globs'].items():
+            pieces.setdefault(key, []).append(array)
+        for glob_id, count in result['counts'].items():
+            counts[glob_id] = counts.get(glob_id, 0) + count
+        for name in stats:
+            stats[name] += result['stats'][name]
+        if result['first_packet_num'] is not None:
+            if last_packet_num is not None:
+                stats['dropped'] += (result['first_packet_num'] - last_packet_num - 1) % 256
+            last_packet_num = result['last_packet_num']
+
+    layouts_used = {}
+    for glob_id, first_firmware_version in pieces:
+        layouts_used[glob_id] = layouts_used.get(glob_id, 0) + 1
+
+    globs = {}
+    for (glob_id, first_firmware_version), arrays in pieces.items():
+        name = glob_name(glob_id)
+        if layouts_used[glob_id] > 1:
+            name += '_fw{}'.format(first_firmware_version)
+        globs[name] = np.concatenate(arrays)
+
+    file_size = os.path.getsize(filepath)
+    stats.update({'messages': dict((glob_name(glob_id), count) for glob_id, count in counts.items()),
+                  'file_bytes': file_size,
+                  'skipped_bytes': file_size - stats['message_bytes'],
+                  'blocks': len(blocks),
+                  'seconds': time.time() - start_time})
+    return globs, stats
+
+def main(argv):
+
+    names = dict((glob_name(glob_id), glob_id) for glob_id in glob_codecs.layouts)
+
+    parser = argparse.ArgumentParser(description='Decode raw serial link recording into numpy arrays.')
+    parser.add_argument('recording', help='file with every byte received from the robot')
+    parser.add_argument('--output', default=None, help='npz file to write (default recording name with .npz)')
+    parser.add_argument('--globs', nargs='+', default=[glob_name(glob_id) for glob_id in default_glob_ids],
+                        choices=sorted(names), help='globs to decode')
+    parser.add_argument('--firmware', type=int, default=None, help='robot firmware version (default newest)')
+    parser.add_argument('--processes', type=int, default=None, help='number of processes (default number of cores)')
+    parser.add_argument('--block-mb', type=float, default=DEFAULT_BLOCK_SIZE / 1024.0 / 1024.0,
+                        help='megabytes of recording per block')
+    args = parser.parse_args(argv)
+
+    globs, stats = decode_recording(args.recording, [names[name] for name in args.globs], args.firmware,
+                                    args.processes, int(args.block_mb * 1024 * 1024))
+
+    output_path = args.output if args.output else os.path.splitext(args.recording)[0] + '.npz'
+    np.savez(output_path, **globs)
+    print 'Created {}'.format(output_path)
+
+    for name, count in sorted(stats['messages'].items()):
+        print '{:<20} {:>10} messages{}'.format(name, count, ' (decoded)' if name in globs else '')
+    megabytes = stats['file_bytes'] / 1024.0 / 1024.0
+    print '{:.1f} MB in {} blocks, {:.2f} s ({:.1f} MB/s)'.format(megabytes, stats['blocks'], stats['seconds'],
+                                                                megabytes / max(stats['seconds'], 1e-9))
+    print 'Bad CRC {}  Dropped {}  Without CRC {}  Skipped bytes {}'.format(stats['bad_crc'], stats['dropped'],
+                                                                          stats['unchecked'], stats['skipped_bytes'])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,169 @@
+from eeva_glob import Request
+
+# Request settings
+REQUEST_TIMEOUT = 0.5 # seconds to wait for first reply before retrying
+MAX_REQUEST_RETRIES = 4
+MAX_REQUEST_BACKOFF = 4.0 # seconds, longest wait between retries
+
+class PendingRequest(object):
+    '''Outstanding request for a glob. Works like a future: callbacks run once it succeeds or gives up.'''
+
+    def __init__(self, glob_id, instance, expected_instances):
+
+        self.glob_id = glob_id
+        self.instance = instance
+
+        # Instances that must arrive before request is complete.  Instance 0 asks for every instance.
+        self.expected_instances = set(expected_instances)
+
+        # Instance -> body of reply.
+        self.replies = {}
+
+        self.num_sends = 0
+        
+        # Goes up every time request is sent (never reset, unlike num_sends) so older timeout checks are ignored.
+        self.generation = 0
+        
+        # Set when something changed on robot after request went out, so first reply could be out of date.
+        self.resend_on_reply = False
+        
+        self.finished = False
+        self.succeeded = False
+        self.callbacks = []
+
+    @property
+    def missing_instances(self):
+        return self.expected_instances - set(self.replies.keys())
+
+    def add_callback(self, callback):
+        '''Call callback(request) when request finishes. Called right away if it already has.'''
+        if self.finished:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def finish(self, succeeded):
+
+        self.finished = True
+        self.succeeded = succeeded
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+class RequestManager(object):
+    '''
+    Keeps track of outstanding requests by (glob ID, instance) so the same glob is never asked for twice at once.
+    Unanswered requests are re-sent with exponential backoff until MAX_REQUEST_RETRIES is reached.
+    '''
+
+    def __init__(self, link, scheduler, timeout=REQUEST_TIMEOUT, max_retries=MAX_REQUEST_RETRIES,
+                 max_backoff=MAX_REQUEST_BACKOFF):
+
+        self.link = link
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+
+        # (glob id, instance) -> PendingRequest
+        self.pending = {}
+
+        # Stats so link problems can be shown to user.
+        self.num_requests_sent = 0
+        self.num_duplicates_avoided = 0
+        self.num_failed = 0
+
+    def request(self, glob_id, instance=1, expected_instances=None, callback=None, fresh=False):
+        '''
+        Ask robot for glob. Use instance 0 with a list of expected_instances to ask for all instances at once.
+        Set fresh if the glob was just changed, so a reply to an older outstanding request isn't trusted.
+        Returns PendingRequest.  Callback is called with the request once it succeeds or fails.
+        '''
+        request = self.pending.get((glob_id, instance))
+        if request is None and instance != 0:
+            # Request for every instance that's still missing this one covers it too.
+            covering = self.pending.get((glob_id, 0))
+            if covering and instance in covering.missing_instances:
+                request = covering
+
+        if request is not None:
+            self.num_duplicates_avoided += 1
+            if fresh:
+                request.resend_on_reply = True
+        else:
+            if expected_instances is None:
+                expected_instances = [instance]
+            request = PendingRequest(glob_id, instance, expected_instances)
+            self.pending[(glob_id, instance)] = request
+            self.send_request(request)
+
+        if callback:
+            request.add_callback(callback)
+
+        return request
+
+    def send_request(self, request):
+
+        if not self.link.connection_open():
+            self.remove(request)
+            self.num_failed += 1
+            request.finish(False)
+            return
+
+        missing = request.missing_instances
+        if request.instance == 0 and 0 < len(missing) <= 2:
+            # Only a couple instances got lost so just ask for those instead of everything again.
+            for instance in sorted(missing):
+                self.link.send(Request(request.glob_id, instance=instance))
+                self.num_requests_sent += 1
+        else:
+            self.link.send(Request(request.glob_id, instance=request.instance))
+            self.num_requests_sent += 1
+
+        request.num_sends += 1
+        request.generation += 1
+
+        backoff = min(self.timeout * (2 ** (request.num_sends - 1)), self.max_backoff)
+        generation = request.generation
+        self.scheduler.call_later(backoff, lambda: self.check_timeout(request, generation))
+
+    def check_timeout(self, request, generation):
+
+        if request.finished or request.generation != generation:
+            return # already answered or re-sent since this check was scheduled
+
+        if request.num_sends > self.max_retries:
+            self.remove(request)
+            self.num_failed += 1
+            request.finish(False)
+        else:
+            self.send_request(request)
+
+    def message_received(self, id, instance, body):
+        '''Should be called for every received message.'''
+
+        for request in [r for r in self.pending.values() if r.glob_id == id]:
+            if instance in request.expected_instances:
+                if request.resend_on_reply:
+                    # Reply could be from before the latest change so ask one more time.
+                    request.resend_on_reply = False
+                    request.replies = {}
+                    request.num_sends = 0
+                    self.send_request(request)
+                    continue
+                request.replies[instance] = body
+                if not request.missing_instances:
+                    self.remove(request)
+                    request.finish(True)
+
+    def remove(self, request):
+        self.pending.pop((request.glob_id, request.instance), None)
+
+    def cancel_all(self):
+        '''Forget every outstanding request without calling callbacks, e.g. when connection is reset.'''
+        for request in self.pending.values():
+            request.finished = True
+        self.pending = {}
+
+    def is_pending(self, glob_id, instance=1):
+        return (glob_id, instance) in self.pending
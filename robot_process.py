@@ -0,0 +1,329 @@
+'''
+Runs the serial connection, parser and capture data decoding for one robot in its own process so a noisy
+link can't slow down the GUI or other robots.  Decoded capture samples are written to a shared memory ring
+and everything else is passed back as raw message bodies on a queue.
+'''
+import serial
+import Queue
+import threading
+import multiprocessing
+from glob_link_base import BaseGlobLink, MessageSignal, DEFAULT_BAUD_RATE
+from link_meter import LinkMeter
+from eeva_glob import GlobID, CaptureData, codecs_for_firmware
+
+# How often worker tells the GUI about new samples if no other message comes along first.
+SAMPLE_FLUSH_INTERVAL = 0.05 # seconds
+
+# How long to wait for worker to open port.
+CONNECT_TIMEOUT = 5.0 # seconds
+
+# Indices into shared link statistics array.
+STAT_BYTES_RX = 0
+STAT_MSGS_RX = 1
+STAT_BAD_CRC = 2
+STAT_DROPPED = 3
+STAT_BYTES_TX = 4
+STAT_MSGS_TX = 5
+NUM_STATS = 6
+
+class CaptureRing(object):
+    '''
+    Fixed size ring of capture samples in shared memory.  Single writer (worker process) and single reader.
+    Samples are addressed by the total number written so far, so the reader can tell if it fell behind.
+    '''
+
+    def __init__(self, capacity=50000, width=9):
+
+        self.capacity = capacity
+        self.width = width
+        self.buffer = multiprocessing.RawArray('d', capacity * width)
+        self.head = multiprocessing.RawValue('L', 0) # total number of samples ever written
+
+    def write(self, values):
+
+        head = self.head.value
+        idx = (head % self.capacity) * self.width
+        self.buffer[idx : idx + self.width] = values
+        # Only publish sample after it's completely written.
+        self.head.value = head + 1
+
+    def read(self, start, stop):
+        '''Return (samples, num_lost) for sample numbers [start, stop). Lost samples were overwritten before reading.'''
+
+        num_lost = max(0, (stop - start) - self.capacity)
+        start += num_lost
+
+        samples = []
+        for k in xrange(start, stop):
+            idx = (k % self.capacity) * self.width
+            samples.append(tuple(self.buffer[idx : idx + self.width]))
+
+        # Writer may have lapped us while we were copying.
+        overwritten = self.head.value - self.capacity - start
+        if overwritten > 0:
+            samples = samples[overwritten:]
+            num_lost += overwritten
+
+        return samples, num_lost
+
+class RobotWorker(multiprocessing.Process):
+    '''Process that owns the serial link to one robot.'''
+
+    def __init__(self, port_name, ring, event_queue, command_queue, stats, connected, exclusive=False):
+
+        super(RobotWorker, self).__init__()
+        self.daemon = True
+
+        self.port_name = port_name
+        self.ring = ring
+        self.event_queue = event_queue
+        self.command_queue = command_queue
+        self.stats = stats
+        self.connected = connected
+        self.exclusive = exclusive
+
+    def run(self):
+
+        # Parser thread decodes into the ring and the main thread flushes, so protect the notify bookkeeping.
+        self.lock = threading.Lock()
+        self.notified_head = 0
+        self.capture_struct = CaptureData.codec.struct
+
+        link = BaseGlobLink()
+        link.new_message = MessageSignal()
+        link.new_message.connect(self.message_received)
+
+        try:
+            link.connect(self.port_name, self.exclusive)
+        except (serial.SerialException, IOError) as e:
+            self.event_queue.put(('error', str(e)))
+            return
+
+        self.connected.value = 1
+        self.event_queue.put(('connected',))
+
+        while True:
+            try:
+                command = self.command_queue.get(timeout=SAMPLE_FLUSH_INTERVAL)
+            except Queue.Empty:
+                command = None
+
+            if command is not None:
+                if command[0] == 'send':
+                    link.send(command[1])
+                elif command[0] == 'firmware':
+                    link.set_firmware_version(command[1])
+                    self.capture_struct = link.codecs.get(GlobID.CaptureData).struct
+                elif command[0] == 'stop':
+                    break
+
+            self.flush_samples()
+            self.update_stats(link)
+
+        link.disconnect()
+        self.connected.value = 0
+        self.flush_samples()
+        self.event_queue.put(('closed',))
+
+    def message_received(self, id, instance, body):
+
+        if id == GlobID.CaptureData:
+            self.ring.write(self.capture_struct.unpack(bytes(body)))
+            return
+
+        with self.lock:
+            # Tell reader how many samples came before this message so it can keep them in order.
+            head = self.ring.head.value
+            self.notified_head = head
+            self.event_queue.put(('message', id, instance, bytes(body), head))
+
+    def flush_samples(self):
+
+        with self.lock:
+            head = self.ring.head.value
+            if head != self.notified_head:
+                self.notified_head = head
+                self.event_queue.put(('samples', head))
+
+    def update_stats(self, link):
+
+        self.stats[STAT_BYTES_RX] = link.num_bytes_received
+        self.stats[STAT_MSGS_RX] = link.num_messages_received
+        self.stats[STAT_BAD_CRC] = link.num_bad_crc_messages
+        self.stats[STAT_DROPPED] = link.num_dropped_messages
+        self.stats[STAT_BYTES_TX] = link.num_bytes_sent
+        self.stats[STAT_MSGS_TX] = link.num_messages_sent
+
+class BaseProcessGlobLink(object):
+    '''
+    Same interface as GlobLink but the serial port is handled by a RobotWorker process.
+    Subclasses must provide 'new_message' and 'new_capture_samples' signals.
+    '''
+
+    def __init__(self, ring_capacity=50000):
+
+        self.ring_capacity = ring_capacity
+        self.worker = None
+        self.event_reader = None
+        self.ring = None
+        self.stats = multiprocessing.RawArray('L', NUM_STATS)
+        self.connected = multiprocessing.RawValue('B', 0)
+
+        # Samples overwritten in ring before GUI process read them.
+        self.num_lost_samples = 0
+
+        self.baud_rate = DEFAULT_BAUD_RATE
+        self.meter = LinkMeter(self)
+        
+        # Layouts for decoding messages passed back from worker, which packs with the same ones.
+        self.codecs = codecs_for_firmware(None)
+
+        # Publishes received messages to other programs when started (see telemetry_fanout.py).
+        self.fanout = None
+
+        # If true nothing is sent, e.g. while finding out which robot is on a port.
+        self.receive_only = False
+
+    def connect(self, port_name, exclusive=False):
+
+        if self.connection_open():
+            raise IOError('Connection still open.')
+
+        self.ring = CaptureRing(self.ring_capacity)
+        self.codecs = codecs_for_firmware(None)
+        self.stats[:] = [0] * NUM_STATS
+        self.event_queue = multiprocessing.Queue()
+        self.command_queue = multiprocessing.Queue()
+        self.worker = RobotWorker(port_name, self.ring, self.event_queue, self.command_queue,
+                                  self.stats, self.connected, exclusive)
+        self.worker.start()
+
+        try:
+            reply = self.event_queue.get(timeout=CONNECT_TIMEOUT)
+        except Queue.Empty:
+            reply = ('error', 'Timed out opening {}'.format(port_name))
+
+        if reply[0] != 'connected':
+            self.stop_worker()
+            raise serial.SerialException(reply[1])
+
+        self.read_position = 0
+        self.event_reader = threading.Thread(target=self.read_events, args=(self.worker, self.event_queue, self.ring))
+        self.event_reader.setDaemon(True)
+        self.event_reader.start()
+
+    def disconnect(self):
+
+        if not self.worker:
+            return False # connection already closed
+
+        was_open = self.connection_open()
+        self.stop_worker()
+        return was_open
+
+    def stop_worker(self):
+
+        self.command_queue.put(('stop',))
+        self.worker.join(2.0)
+        if self.worker.is_alive():
+            self.worker.terminate()
+        self.worker = None
+        self.connected.value = 0
+
+    def connection_open(self):
+
+        return bool(self.worker and self.worker.is_alive() and self.connected.value)
+
+    def arrival_time(self, id, body):
+        '''Messages come through worker process so when their bytes arrived isn't known here.'''
+        return None
+
+    def send(self, glob):
+
+        if not self.connection_open() or self.receive_only:
+            return
+
+        self.command_queue.put(('send', glob))
+
+    def set_firmware_version(self, firmware_version):
+
+        self.codecs = codecs_for_firmware(firmware_version)
+        if self.connection_open():
+            self.command_queue.put(('firmware', firmware_version))
+
+    def start_fanout(self, address):
+        '''Publish every received message to subscribers at address. Returns address they should connect to.'''
+
+        from telemetry_fanout import FanoutServer
+        self.stop_fanout()
+        server = FanoutServer(address, lambda: self.codecs)
+        bound_address = server.start()
+        self.fanout = server
+        return bound_address
+
+    def stop_fanout(self):
+
+        if self.fanout:
+            self.fanout.stop()
+            self.fanout = None
+
+    def read_events(self, worker, event_queue, ring):
+        '''Runs in a thread. Passes worker events on through signals, keeping samples and messages in order.'''
+
+        while True:
+            try:
+                event = event_queue.get(timeout=0.5)
+            except Queue.Empty:
+                if not worker.is_alive():
+                    break # worker was killed before it could say it closed
+                continue
+            kind = event[0]
+
+            if kind == 'closed':
+                break # exit thread
+
+            head = event[-1]
+            if head > self.read_position:
+                samples, num_lost = ring.read(self.read_position, head)
+                self.read_position = head
+                self.num_lost_samples += num_lost
+                if samples:
+                    if self.fanout:
+                        self.fanout.publish_samples(samples)
+                    self.new_capture_samples.emit(samples)
+
+            if kind == 'message':
+                _, id, instance, body, _ = event
+                if self.fanout:
+                    self.fanout.publish(id, instance, body)
+                self.new_message.emit(id, instance, bytearray(body))
+
+    def link_counters(self):
+        '''Return dictionary of byte and message counts in each direction (see LinkMeter).'''
+        stats = self.stats[:] # copy all at once
+        return {'bytes_sent': stats[STAT_BYTES_TX], 'messages_sent': stats[STAT_MSGS_TX],
+                'bytes_received': stats[STAT_BYTES_RX], 'messages_received': stats[STAT_MSGS_RX]}
+
+    @property
+    def num_bytes_sent(self):
+        return self.stats[STAT_BYTES_TX]
+
+    @property
+    def num_messages_sent(self):
+        return self.stats[STAT_MSGS_TX]
+
+    @property
+    def num_messages_received(self):
+        return self.stats[STAT_MSGS_RX]
+
+    @property
+    def num_bytes_received(self):
+        return self.stats[STAT_BYTES_RX]
+
+    @property
+    def num_bad_crc_messages(self):
+        return self.stats[STAT_BAD_CRC]
+
+    @property
+    def num_dropped_messages(self):
+        return self.stats[STAT_DROPPED]
@@ -0,0 +1,147 @@
+import os
+import csv
+import json
+import datetime
+from eeva_io import locked_file
+
+REGISTRY_FILENAME = 'eeva_robots.jsonl'
+
+# Older list of robot IDs. Still added to when a new robot shows up so it stays complete.
+ID_LIST_FILENAME = 'eeva_ids.csv'
+
+class RobotRegistry(object):
+    '''
+    Every robot that has connected to this computer.  Stored as an append-only log of events (one JSON object per
+    line) that any number of GUI/script instances can add to.  The log is read once and after that only new
+    lines are read, so checking a robot doesn't get slower as the history grows.
+    '''
+
+    def __init__(self, output_directory):
+
+        self.output_directory = output_directory
+        self.filepath = os.path.join(output_directory, REGISTRY_FILENAME)
+        self.id_list_filepath = os.path.join(output_directory, ID_LIST_FILENAME)
+
+        # Robot ID -> dictionary of robot info.
+        self.robots = {}
+
+        # How much of log has been read into robots.
+        self.read_offset = 0
+
+    def is_known(self, robot_id):
+        self.refresh()
+        return robot_id in self.robots
+
+    def get(self, robot_id):
+        '''Return dictionary of robot info or None if robot has never connected.'''
+        self.refresh()
+        return self.robots.get(robot_id)
+
+    def all_robots(self):
+        '''Return list of robot info sorted by when each robot was last seen, most recent first.'''
+        self.refresh()
+        return sorted(self.robots.values(), key=lambda r: r['last_seen'], reverse=True)
+
+    def robot_seen(self, robot_id, firmware_version=None):
+        '''Record that robot connected. Returns true if it has never connected before.'''
+
+        is_new = self.add_event({'event': 'seen', 'id': robot_id, 'firmware': firmware_version})
+
+        if is_new:
+            with locked_file(self.id_list_filepath, 'ab') as id_file:
+                csv.writer(id_file).writerow([robot_id, self.robots[robot_id]['first_seen']])
+
+        return is_new
+
+    def capture_added(self, robot_id):
+        '''Record that a capture was saved from robot.'''
+        if robot_id:
+            self.add_event({'event': 'capture', 'id': robot_id})
+
+    def refresh(self):
+        '''Read anything other instances have added since last time.'''
+
+        if not os.path.exists(self.filepath):
+            if not os.path.exists(self.id_list_filepath):
+                return
+            # Registry gets created from the old ID list the first time anything is added.
+            self.add_event(None)
+            return
+
+        with locked_file(self.filepath, 'rb') as registry_file:
+            self.read_new_events(registry_file)
+
+    def add_event(self, event):
+        '''Append event to log (after reading everything before it). Returns true if event is for a new robot.'''
+
+        if not os.path.exists(self.output_directory):
+            os.makedirs(self.output_directory)
+
+        with locked_file(self.filepath, 'ab+') as registry_file:
+
+            registry_file.seek(0, os.SEEK_END)
+            if registry_file.tell() == 0:
+                self.import_id_list(registry_file)
+
+            self.read_new_events(registry_file)
+
+            if event is None:
+                return False
+
+            is_new = event['id'] not in self.robots
+            event['time'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            registry_file.seek(0, os.SEEK_END)
+            registry_file.write(json.dumps(event, sort_keys=True) + '\n')
+            registry_file.flush()
+            self.apply_event(event)
+            self.read_offset = registry_file.tell()
+
+        return is_new
+
+    def read_new_events(self, registry_file):
+
+        registry_file.seek(self.read_offset)
+        new_data = registry_file.read()
+
+        # Ignore anything after last newline in case a line is only partly written.
+        complete_length = new_data.rfind('\n') + 1
+        for line in new_data[:complete_length].splitlines():
+            try:
+                self.apply_event(json.loads(line))
+            except (ValueError, KeyError):
+                continue # corrupt line
+
+        self.read_offset += complete_length
+
+    def apply_event(self, event):
+
+        robot_id = event['id']
+        robot = self.robots.get(robot_id)
+        if robot is None:
+            robot = self.robots[robot_id] = {'robot_id': robot_id, 'first_seen': event['time'],
+                                             'last_seen': event['time'], 'firmware_versions': [],
+                                             'num_connections': 0, 'total_captures': 0}
+
+        if event['event'] == 'seen':
+            robot['last_seen'] = event['time']
+            robot['num_connections'] += 1
+            firmware = event.get('firmware')
+            if firmware is not None and firmware not in robot['firmware_versions']:
+                robot['firmware_versions'].append(firmware)
+        elif event['event'] == 'capture':
+            robot['total_captures'] += 1
+
+    def import_id_list(self, registry_file):
+        '''Start log with robots from the old ID list so they aren't reported as new.'''
+
+        if not os.path.exists(self.id_list_filepath):
+            return
+
+        with open(self.id_list_filepath, 'rb') as id_file:
+            for row in csv.reader(id_file):
+                if not row or not row[0].strip():
+                    continue
+                first_seen = row[1].strip() if len(row) > 1 else ''
+                event = {'event': 'seen', 'id': row[0].strip(), 'firmware': None, 'time': first_seen}
+                registry_file.write(json.dumps(event, sort_keys=True) + '\n')
+        registry_file.flush()
@@ -0,0 +1,68 @@
+import time
+import heapq
+import itertools
+import threading
+
+class QtScheduler(object):
+    '''Runs delayed callbacks from the Qt event loop.  Must be created in the main thread.'''
+
+    def __init__(self):
+
+        # Import here so modules that take a scheduler can still be used without Qt.
+        from PyQt4.QtCore import QObject, pyqtSignal
+
+        class ThreadCallbacks(QObject):
+            # Emitted from other threads so connection is queued and callback runs in the main thread.
+            callback = pyqtSignal(object)
+
+        self.thread_callbacks = ThreadCallbacks()
+        self.thread_callbacks.callback.connect(lambda callback: callback())
+
+    def call_later(self, delay, callback):
+
+        from PyQt4.QtCore import QTimer
+        QTimer.singleShot(int(delay * 1000), callback)
+
+    def call_from_thread(self, callback):
+        '''Run callback in the main thread as soon as possible. Can be called from any thread.'''
+        self.thread_callbacks.callback.emit(callback)
+
+class HeadlessScheduler(object):
+    '''Runs delayed callbacks from whichever thread calls run_pending().'''
+
+    def __init__(self):
+
+        # Heap of (due time, sequence number, callback). Sequence number keeps ordering stable.
+        self.timers = []
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+
+    def call_later(self, delay, callback):
+
+        with self.lock:
+            heapq.heappush(self.timers, (time.time() + delay, next(self.sequence), callback))
+
+    def call_from_thread(self, callback):
+        '''Run callback from run_pending() as soon as possible. Can be called from any thread.'''
+        self.call_later(0, callback)
+
+    def time_until_next(self, default=None):
+        '''Return seconds until next callback is due, or default if nothing is scheduled.'''
+        with self.lock:
+            if not self.timers:
+                return default
+            return max(0, self.timers[0][0] - time.time())
+
+    def run_pending(self):
+        '''Call every callback that is due. Returns number of callbacks that were run.'''
+        num_run = 0
+        while True:
+            with self.lock:
+                if not self.timers or self.timers[0][0] > time.time():
+                    break
+                _, _, callback = heapq.heappop(self.timers)
+            # Call outside of lock since callbacks typically reschedule themselves.
+            callback()
+            num_run += 1
+
+        return num_run
@@ -0,0 +1,123 @@
+'''
+Measures how many messages per second the send path can pack, frame and write for each glob the GUI sends.
+
+"in place" is the path every link uses: the body is packed straight into a reused frame buffer after the
+header, the CRC is computed over a memoryview of that buffer and a memoryview of the frame is written.
+"copying" is the path it replaced, which packed the body into a new string, copied it into a frame buffer and
+wrote a copy of the frame.  Both compute the CRC in C (binascii) so only the copies are compared.  The CRC
+columns separately compare that with the one byte at a time CRC the old path used.  Writes go to a port
+stand-in that does nothing so only the time spent on this side is measured.
+
+Run "python send_benchmark.py [seconds per glob]".
+'''
+import sys
+import timeit
+from crc import calculate_crc, table_crc
+from glob_link_base import BaseGlobLink, message_header, message_footer
+from eeva_glob import (DrivingCommand, CaptureCommand, Modes, RobotCommand, Wave, WaveChunk, PidParams, Request,
+                       Ping, StatusData)
+
+class NullConnection(object):
+    '''Port that accepts every write.'''
+
+    def __init__(self):
+        self.num_bytes_written = 0
+
+    def connection_is_open(self):
+        return True
+
+    def write(self, data):
+        self.num_bytes_written += len(data)
+
+def sample_globs():
+    '''Return list of (name, glob) with typical values for every glob that gets sent.'''
+    return [('DrivingCommand', DrivingCommand(DrivingCommand.forward, 0.5, 0.1)),
+            ('CaptureCommand', CaptureCommand(is_start=1, freq=100, desired_samples=1000)),
+            ('Modes', Modes(Modes.balance)),
+            ('RobotCommand', RobotCommand(RobotCommand.stop)),
+            ('Wave', Wave(wave_type=Wave.sine, mag=0.1, freq=2, duration=10)),
+            ('PidParams', PidParams(kp=1.5, ki=0.1, kd=0.01, int_sat_limit=1, sat_limit=5, instance=3)),
+            ('Request', Request(StatusData.id)),
+            ('Ping', Ping(7)),
+            ('WaveChunk', WaveChunk(0, [0.25] * WaveChunk.max_samples))]
+
+def copying_write(link, glob, transfer_buffer):
+    '''Send path before packing in place (same checks and counters as write_frame), kept to compare against.'''
+
+    connection = link.connection
+    if not connection or not connection.connection_is_open():
+        return
+
+    body_bytes = link.codecs.pack(glob)
+    body_size = len(body_bytes)
+    header_size = message_header.size
+    message_header.pack_into(transfer_buffer, 0, link.message_start_byte, 1, glob.id, glob.instance,
+                             link.next_packet_num, body_size)
+    transfer_buffer[header_size : header_size + body_size] = body_bytes
+    crc = calculate_crc(transfer_buffer, header_size + body_size, 0xFFFF)
+    message_footer.pack_into(transfer_buffer, header_size + body_size, crc)
+    message_size = header_size + body_size + message_footer.size
+
+    connection.write(transfer_buffer[:message_size])
+
+    link.num_bytes_sent += message_size
+    link.num_messages_sent += 1
+    link.next_packet_num += 1
+    if link.next_packet_num > 255:
+        link.next_packet_num = 0
+
+def messages_per_second(write, duration):
+    '''Call write() repeatedly for about duration seconds and return how many calls per second it managed.'''
+
+    number = 100
+    while True:
+        elapsed = timeit.timeit(write, number=number)
+        if elapsed >= duration:
+            return number / elapsed
+        number = int(number * min(10, 1.2 * duration / max(elapsed, 1e-6)))
+
+def measure_send_rates(duration=0.5):
+    '''
+    Return list of (glob name, message size, in place msgs/sec, copying msgs/sec, C CRCs/sec, byte at a time
+    CRCs/sec).
+    '''
+
+    link = BaseGlobLink()
+    link.connection = NullConnection()
+
+    copied_buffer = bytearray(300)
+    results = []
+    for name, glob in sample_globs():
+        # Same bytes out of both paths or the comparison means nothing.
+        link.next_packet_num = 0
+        in_place_frame, body_size = link.prepare_frame(glob)
+        link.write_frame(in_place_frame)
+        message_size = message_header.size + body_size + message_footer.size
+        link.next_packet_num = 0
+        copying_write(link, glob, copied_buffer)
+        link.next_packet_num = 0
+        if copied_buffer[:message_size] != in_place_frame[:message_size]:
+            raise AssertionError('{} frames differ'.format(name))
+
+        in_place_rate = messages_per_second(lambda: link.write_frame(link.prepare_frame(glob)[0]), duration)
+        copying_rate = messages_per_second(lambda: copying_write(link, glob, copied_buffer), duration)
+        crc_size = message_size - message_footer.size
+        c_crc_rate = messages_per_second(lambda: calculate_crc(copied_buffer, crc_size), duration)
+        table_crc_rate = messages_per_second(lambda: table_crc(copied_buffer, crc_size), duration)
+        results.append((name, message_size, in_place_rate, copying_rate, c_crc_rate, table_crc_rate))
+
+    return results
+
+def main():
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+
+    print '{:<16} {:>6} {:>14} {:>14} {:>8} {:>14} {:>14} {:>8}'.format(
+        'Glob', 'Bytes', 'In place /s', 'Copying /s', 'Speedup', 'C CRC /s', 'Table CRC /s', 'Speedup')
+    for name, message_size, in_place_rate, copying_rate, c_crc_rate, table_crc_rate in measure_send_rates(duration):
+        print '{:<16} {:>6} {:>14,.0f} {:>14,.0f} {:>7.2f}x {:>14,.0f} {:>14,.0f} {:>7.2f}x'.format(
+            name, message_size, in_place_rate, copying_rate, in_place_rate / copying_rate,
+            c_crc_rate, table_crc_rate, c_crc_rate / table_crc_rate)
+
+if __name__ == '__main__':
+    main()
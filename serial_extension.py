@@ -1,8 +1,16 @@
 import sys
+import inspect
 import eeva_glob
 import serial
 import Queue
 from threading import Event
+from clock import monotonic
+
+# Locking ports when they're opened ('exclusive' option) was added in pyserial 3.3.
+try:
+    supports_exclusive = 'exclusive' in inspect.getargspec(serial.Serial.__init__).args
+except TypeError:
+    supports_exclusive = False
 
 class SerialConnection(serial.Serial):
 
@@ -13,9 +21,12 @@ class SerialConnection(serial.Serial):
         self.receive_queue = Queue.Queue()
         self.send_queue = Queue.Queue()
         self.close_request = Event()
+        
+        # True once run() owns the port.  Otherwise port is read directly with read_available().
+        self.reader_running = False
 
     def read(self, timeout=0):
-        
+        '''Return (monotonic time bytes were read, bytes) from reader thread.'''
         return self.receive_queue.get(block=True, timeout=timeout)
 
     def write(self, data):
@@ -25,9 +36,17 @@ class SerialConnection(serial.Serial):
         except serial.SerialTimeoutException:
             pass # data couldn't be sent.
 
+    def read_available(self):
+        '''Return whatever bytes are waiting on port without blocking. Don't use while run() is reading.'''
+        return bytearray(serial.Serial.read(self, self.inWaiting()))
+
     def close(self):
 
         self.close_request.set()
+        
+        if not self.reader_running:
+            # Nothing else is going to close the port.
+            serial.Serial.close(self)
 
     def connection_is_open(self):
         
@@ -39,9 +58,12 @@ class SerialConnection(serial.Serial):
 
         while True:
         
-            new_data = bytearray(serial.Serial.read(self))
+            try:
+                new_data = bytearray(serial.Serial.read(self))
+            except serial.SerialException:
+                break # device went away (e.g. USB adapter unplugged)
             if new_data and len(new_data) > 0:
-                self.receive_queue.put(new_data)
+                self.receive_queue.put((monotonic(), new_data))
             
             if self.close_request.is_set():
                 break
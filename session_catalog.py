@@ -0,0 +1,248 @@
+'''
+SQLite catalog of every capture written under eeva_output so runs can be found without opening folders.
+
+Captures are added as they're exported.  Folders written before the catalog existed (or by another program)
+are added by index_directory(), which only looks at folders that changed since they were last indexed.
+
+From the command line:
+    python session_catalog.py DIR/eeva_output index
+    python session_catalog.py DIR/eeva_output find --robot-id ABAB... --mode 3 --since 2016-05-01
+'''
+import os
+import sys
+import csv
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+CATALOG_FILENAME = 'catalog.sqlite'
+
+catalog_columns = ('path', 'session', 'created', 'robot_id', 'firmware_version', 'main_mode', 'sub_mode',
+                   'wave_type', 'wave_freq', 'wave', 'pid', 'sample_rate', 'expected_samples', 'num_samples',
+                   'num_lost', 'dropped_messages')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,     -- relative to eeva_output
+    session TEXT,                  -- session folder name
+    created TEXT,                  -- YYYY-mm-dd HH:MM:SS
+    robot_id TEXT,
+    firmware_version INTEGER,
+    main_mode INTEGER,
+    sub_mode INTEGER,
+    wave_type INTEGER,
+    wave_freq REAL,
+    wave TEXT,                     -- JSON of all wave settings
+    pid TEXT,                      -- JSON list of gains for each controller
+    sample_rate REAL,
+    expected_samples INTEGER,
+    num_samples INTEGER,
+    num_lost INTEGER,              -- samples robot sent that never arrived
+    dropped_messages INTEGER       -- messages link reported dropped during capture
+);
+CREATE INDEX IF NOT EXISTS captures_robot ON captures (robot_id, created);
+CREATE INDEX IF NOT EXISTS captures_created ON captures (created);
+CREATE INDEX IF NOT EXISTS captures_mode ON captures (main_mode, sub_mode);
+CREATE TABLE IF NOT EXISTS indexed_directories (
+    path TEXT PRIMARY KEY,
+    mtime REAL
+);
+'''
+
+class SessionCatalog(object):
+    '''Catalog database in output directory. Safe to use from several threads.'''
+
+    def __init__(self, output_directory):
+
+        self.output_directory = output_directory
+        self.db_path = os.path.join(output_directory, CATALOG_FILENAME)
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        # Opened on first use so nothing is created until something is cataloged.
+        if self.connection is None:
+            if not os.path.exists(self.output_directory):
+                os.makedirs(self.output_directory)
+            self.connection = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            self.connection.row_factory = sqlite3.Row
+            self.connection.executescript(schema)
+        return self.connection
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def relative_path(self, filepath):
+        return os.path.relpath(os.path.abspath(filepath), os.path.abspath(self.output_directory))
+
+    def add_capture(self, filepath, num_samples, info=None):
+        '''Record capture file. Info is a dictionary with any of catalog_columns (wave and pid as objects).'''
+
+        info = dict(info) if info else {}
+        relative_path = self.relative_path(filepath)
+
+        record = dict((column, info.get(column)) for column in catalog_columns)
+        record['path'] = relative_path
+        record['session'] = os.path.dirname(relative_path)
+        record['created'] = info.get('created') or time.strftime("%Y-%m-%d %H:%M:%S")
+        record['num_samples'] = num_samples
+        wave = info.get('wave')
+        if wave:
+            record['wave_type'] = wave.get('type')
+            record['wave_freq'] = wave.get('freq')
+        record['wave'] = json.dumps(wave, sort_keys=True) if wave else None
+        record['pid'] = json.dumps(info['pid']) if info.get('pid') else None
+        if record['num_lost'] is None and record['expected_samples'] is not None:
+            record['num_lost'] = max(0, record['expected_samples'] - num_samples)
+
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO captures ({}) VALUES ({})'.format(
+                                   ', '.join(catalog_columns), ', '.join('?' * len(catalog_columns))),
+                                   [record[column] for column in catalog_columns])
+
+    def find(self, robot_id=None, main_mode=None, sub_mode=None, wave_type=None, since=None, until=None,
+             session=None, limit=None):
+        '''Return list of capture rows (dictionaries) matching every given filter, newest first.'''
+
+        conditions = []
+        values = []
+        for column, value in (('robot_id', robot_id), ('main_mode', main_mode), ('sub_mode', sub_mode),
+                              ('wave_type', wave_type), ('session', session)):
+            if value is not None:
+                conditions.append('{} = ?'.format(column))
+                values.append(value)
+        if since is not None:
+            conditions.append('created >= ?')
+            values.append(since)
+        if until is not None:
+            conditions.append('created <= ?')
+            values.append(until)
+
+        query = 'SELECT * FROM captures'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY created DESC, path DESC'
+        if limit is not None:
+            query += ' LIMIT {}'.format(int(limit))
+
+        with self.lock:
+            rows = self.connect().execute(query, values).fetchall()
+
+        return [self.row_to_dict(row) for row in rows]
+
+    def row_to_dict(self, row):
+
+        record = dict(zip(row.keys(), row))
+        record['wave'] = json.loads(record['wave']) if record['wave'] else None
+        record['pid'] = json.loads(record['pid']) if record['pid'] else None
+        record['filepath'] = os.path.join(self.output_directory, record['path'])
+        return record
+
+    def count(self):
+        with self.lock:
+            return self.connect().execute('SELECT COUNT(*) FROM captures').fetchone()[0]
+
+    def index_directory(self):
+        '''
+        Add every capture csv under output directory that isn't cataloged yet. Folders that haven't changed
+        since they were last indexed are skipped. Returns number of captures added.
+        '''
+        with self.lock:
+            connection = self.connect()
+            indexed = dict(connection.execute('SELECT path, mtime FROM indexed_directories').fetchall())
+            known_paths = set(row[0] for row in connection.execute('SELECT path FROM captures'))
+
+        num_added = 0
+        for directory, _, filenames in os.walk(self.output_directory):
+
+            relative_directory = self.relative_path(directory)
+            mtime = os.path.getmtime(directory)
+            if indexed.get(relative_directory) == mtime:
+                continue # nothing added or removed since last time
+
+            for filename in filenames:
+                if not filename.endswith('.csv') or filename.endswith('_manifest.csv'):
+                    continue
+                filepath = os.path.join(directory, filename)
+                if self.relative_path(filepath) in known_paths:
+                    continue
+                info = read_capture_file_info(filepath)
+                if info is None:
+                    continue # not a capture file (ids, task timing, ...)
+                num_samples = info.pop('num_samples')
+                self.add_capture(filepath, num_samples, info)
+                num_added += 1
+
+            with self.lock:
+                with connection:
+                    connection.execute('INSERT OR REPLACE INTO indexed_directories VALUES (?, ?)',
+                                       (relative_directory, mtime))
+
+        return num_added
+
+def read_capture_file_info(filepath):
+    '''Return what can be learned from a capture csv by itself, or None if it isn't a capture file.'''
+
+    with open(filepath, 'rb') as infile:
+        reader = csv.reader(infile)
+        header = next(reader, None)
+        if not header or header[0] != 'time':
+            return None
+        first_time = last_time = None
+        num_samples = 0
+        for row in reader:
+            try:
+                last_time = float(row[0])
+            except (ValueError, IndexError):
+                continue
+            if first_time is None:
+                first_time = last_time
+            num_samples += 1
+
+    info = {'num_samples': num_samples,
+            'created': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(filepath)))}
+    if num_samples > 1 and last_time > first_time:
+        info['sample_rate'] = round((num_samples - 1) / (last_time - first_time), 3)
+
+    return info
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(description='Index and search captures under eeva_output.')
+    parser.add_argument('output_directory', help='eeva_output directory')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('index', help='add captures that are missing from catalog')
+    find_parser = subparsers.add_parser('find', help='list captures')
+    find_parser.add_argument('--robot-id', default=None)
+    find_parser.add_argument('--mode', type=int, default=None, help='main mode number')
+    find_parser.add_argument('--sub-mode', type=int, default=None)
+    find_parser.add_argument('--wave-type', type=int, default=None)
+    find_parser.add_argument('--since', default=None, help='YYYY-mm-dd [HH:MM:SS]')
+    find_parser.add_argument('--until', default=None, help='YYYY-mm-dd [HH:MM:SS]')
+    find_parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    catalog = SessionCatalog(args.output_directory)
+
+    if args.command == 'index':
+        print 'Added {} captures, {} total.'.format(catalog.index_directory(), catalog.count())
+    else:
+        for row in catalog.find(args.robot_id, args.mode, args.sub_mode, args.wave_type, args.since, args.until,
+                                limit=args.limit):
+            print '{}  {}  robot {}  mode {}/{}  {} samples @ {} Hz  lost {}'.format(
+                  row['created'], row['path'], row['robot_id'] or '-', row['main_mode'], row['sub_mode'],
+                  row['num_samples'], row['sample_rate'], row['num_lost'])
+
+    catalog.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,93 @@
+'''
+Timing breakdown of GUI start up (run eeva_ui.py with --profile-startup).
+
+Each step of start up is timed, and while import timing is on every import that loads new modules is timed
+too so slow imports show up.  Cumulative time includes modules the import loaded in turn, self time doesn't.
+'''
+import sys
+import timeit
+import __builtin__
+
+class StartupProfile(object):
+
+    def __init__(self, enabled=True):
+
+        self.enabled = enabled
+
+        # Best timer for this platform (clock on Windows, time elsewhere).
+        self.timer = timeit.default_timer
+        self.start_time = self.last_step_time = self.timer()
+
+        self.steps = [] # (name, seconds)
+
+        # Module name -> [cumulative seconds, self seconds]
+        self.imports = {}
+
+        # Time spent in imports nested inside each import currently running.
+        self.child_times = []
+
+        self.original_import = None
+
+    def step(self, name):
+        '''Record time since last step (or start).'''
+        if not self.enabled:
+            return
+        now = self.timer()
+        self.steps.append((name, now - self.last_step_time))
+        self.last_step_time = now
+
+    def start_import_timing(self):
+
+        if not self.enabled or self.original_import is not None:
+            return
+        self.original_import = __builtin__.__import__
+        __builtin__.__import__ = self.timed_import
+
+    def stop_import_timing(self):
+
+        if self.original_import is None:
+            return
+        __builtin__.__import__ = self.original_import
+        self.original_import = None
+
+    def timed_import(self, name, *args, **kwargs):
+
+        num_modules = len(sys.modules)
+        self.child_times.append(0.0)
+        start_time = self.timer()
+        try:
+            return self.original_import(name, *args, **kwargs)
+        finally:
+            elapsed = self.timer() - start_time
+            child_time = self.child_times.pop()
+            if self.child_times:
+                self.child_times[-1] += elapsed
+            if len(sys.modules) > num_modules:
+                # Only count imports that actually loaded something.
+                if not name:
+                    # "from . import x" is named after the package doing it.
+                    importer = args[0] if args and args[0] else {}
+                    name = '{}.'.format(importer.get('__package__') or importer.get('__name__', ''))
+                times = self.imports.setdefault(name, [0.0, 0.0])
+                times[0] += elapsed
+                times[1] += elapsed - child_time
+
+    def report(self, num_imports=15):
+        '''Return report as a string.'''
+
+        lines = ['Startup profile (ms)']
+        for name, seconds in self.steps:
+            lines.append('  {:<30} {:8.1f}'.format(name, seconds * 1000))
+        lines.append('  {:<30} {:8.1f}'.format('total', (self.last_step_time - self.start_time) * 1000))
+
+        if self.imports:
+            lines.append('Slowest imports (ms)          cumulative     self')
+            slowest = sorted(self.imports.items(), key=lambda item: item[1][0], reverse=True)
+            for name, (cumulative, self_time) in slowest[:num_imports]:
+                lines.append('  {:<30} {:8.1f} {:8.1f}'.format(name, cumulative * 1000, self_time * 1000))
+
+        return '\n'.join(lines)
+
+    def print_report(self):
+        if self.enabled:
+            print self.report()
@@ -0,0 +1,232 @@
+'''
+History of robot task timing results across runs, robots and firmware versions.
+
+Each run's results are appended to one file in eeva_output as a line of JSON that stores each field as a
+column (list of values), and are joined into one set of columns in memory so trends for a task only need the
+columns being looked at.  Runs are appended under a lock so several instances can share the file, and nothing
+already written is rewritten, so a crash can at most lose the run being added.
+'''
+import os
+import json
+import datetime
+from eeva_io import locked_file
+
+TASK_TIMING_HISTORY_FILENAME = 'task_timing_history.json'
+
+# Regressions are flagged when a metric is this much worse (fraction) than it was in previous runs.
+DEFAULT_REGRESSION_THRESHOLD = 0.2
+
+# Number of previous runs of a task the latest run is compared against.
+DEFAULT_BASELINE_RUNS = 5
+
+timing_columns = ('run', 'time', 'robot_id', 'firmware_version', 'task', 'duration', 'counts', 'skipped',
+                  'delay_max', 'delay_min', 'delay_avg', 'run_max', 'run_min', 'run_avg',
+                  'interval_max', 'interval_min', 'interval_avg', 'cpu_percent')
+
+# Metrics (all in microseconds except cpu_percent) where bigger is worse.
+trend_metrics = ('run_avg', 'run_max', 'delay_avg', 'delay_max', 'interval_avg', 'interval_max', 'cpu_percent')
+
+def result_to_row(result):
+    '''Return dictionary of timing columns (except run, time, robot and firmware) for TaskTimingResult.'''
+
+    total_run_time = result.run_usec_avg * result.execute_counts / 1e6 # seconds
+    cpu_percent = total_run_time * 100 / result.recording_duration if result.recording_duration else 0
+
+    return {'task': result.task_name.rstrip('\0').strip(),
+            'duration': result.recording_duration,
+            'counts': result.execute_counts,
+            'skipped': result.times_skipped,
+            'delay_max': result.delay_usec_max, 'delay_min': result.delay_usec_min, 'delay_avg': result.delay_usec_avg,
+            'run_max': result.run_usec_max, 'run_min': result.run_usec_min, 'run_avg': result.run_usec_avg,
+            'interval_max': result.interval_usec_max, 'interval_min': result.interval_usec_min,
+            'interval_avg': result.interval_usec_avg,
+            'cpu_percent': cpu_percent}
+
+class TaskTimingStore(object):
+
+    def __init__(self, output_directory):
+
+        self.filepath = os.path.join(output_directory, TASK_TIMING_HISTORY_FILENAME)
+        self.columns = dict((column, []) for column in timing_columns)
+
+        # Bytes of file already read into columns.
+        self.read_offset = 0
+
+    def load(self):
+        '''Read history from file (replaces whatever is in memory).'''
+
+        self.columns = dict((column, []) for column in timing_columns)
+        self.read_offset = 0
+        if not os.path.exists(self.filepath):
+            return
+        with locked_file(self.filepath, 'rb') as history_file:
+            self.read_new_runs(history_file)
+
+    def read_new_runs(self, history_file):
+        '''Add runs written since file was last read. Must hold lock so nothing is half written.'''
+
+        history_file.seek(self.read_offset)
+        contents = history_file.read()
+        self.read_offset += len(contents)
+
+        for line in contents.split('\n'):
+            if not line.strip():
+                continue
+            try:
+                stored = json.loads(line)['columns']
+            except (ValueError, KeyError, TypeError):
+                continue # cut off by a crash while it was being written
+            num_rows = len(stored.get('run', []))
+            # Columns added in a later version are filled in as unknown for older rows.
+            for column in timing_columns:
+                self.columns[column].extend(stored.get(column, [None] * num_rows))
+
+    @property
+    def num_rows(self):
+        return len(self.columns['run'])
+
+    def add_run(self, results, robot_id=None, firmware_version=None):
+        '''Add list of TaskTimingResult from one run. Returns run number.'''
+
+        directory = os.path.dirname(self.filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with locked_file(self.filepath, 'ab+') as history_file:
+
+            # Pick up runs other instances added.
+            self.read_new_runs(history_file)
+
+            run = max(self.columns['run']) + 1 if self.num_rows else 0
+            now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+            added = dict((column, []) for column in timing_columns)
+            for result in results:
+                row = result_to_row(result)
+                row.update({'run': run, 'time': now, 'robot_id': robot_id, 'firmware_version': firmware_version})
+                for column in timing_columns:
+                    added[column].append(row[column])
+                    self.columns[column].append(row[column])
+
+            # Files from before runs were appended (or cut off by a crash) don't end with a new line.
+            line = json.dumps({'columns': added}) + '\n'
+            history_file.seek(0, os.SEEK_END)
+            if history_file.tell() > 0:
+                history_file.seek(-1, os.SEEK_END)
+                if history_file.read(1) != '\n':
+                    line = '\n' + line
+            history_file.seek(0, os.SEEK_END)
+            history_file.write(line)
+            self.read_offset = history_file.tell()
+
+        return run
+
+    def rows(self, task=None, robot_id=None):
+        '''Return list of row indices for task and robot (all if None), oldest first.'''
+        tasks = self.columns['task']
+        robots = self.columns['robot_id']
+        return [i for i in range(self.num_rows)
+                if (task is None or tasks[i] == task) and (robot_id is None or robots[i] == robot_id)]
+
+    def task_names(self):
+        return sorted(set(self.columns['task']))
+
+    def trend(self, task, metric, robot_id=None):
+        '''Return list of (run, time, firmware_version, value) for task, oldest first.'''
+        columns = self.columns
+        return [(columns['run'][i], columns['time'][i], columns['firmware_version'][i], columns[metric][i])
+                for i in self.rows(task, robot_id)]
+
+    def trend_summary(self, robot_id=None, metrics=trend_metrics):
+        '''
+        Return list of dictionaries, one per task, with 'task', 'runs' and for each metric its first, last,
+        min, max and mean value and slope (change per run, least squares fit).
+        '''
+        summaries = []
+        for task in self.task_names():
+            indices = self.rows(task, robot_id)
+            if not indices:
+                continue
+            summary = {'task': task, 'runs': len(indices)}
+            for metric in metrics:
+                values = [self.columns[metric][i] for i in indices if self.columns[metric][i] is not None]
+                if not values:
+                    continue
+                summary[metric] = {'first': values[0], 'last': values[-1], 'min': min(values),
+                                   'max': max(values), 'mean': sum(values) / len(values), 'slope': slope(values)}
+            summaries.append(summary)
+        return summaries
+
+    def find_regressions(self, robot_id=None, threshold=DEFAULT_REGRESSION_THRESHOLD,
+                         baseline_runs=DEFAULT_BASELINE_RUNS, metrics=trend_metrics):
+        '''
+        Compare latest run of each task to the average of the baseline_runs runs before it. Returns list of
+        dictionaries (task, metric, baseline, latest, change) where metric got worse by more than threshold.
+        '''
+        regressions = []
+        for task in self.task_names():
+            indices = self.rows(task, robot_id)
+            if len(indices) < 2:
+                continue
+            latest = indices[-1]
+            baseline = indices[-1 - baseline_runs : -1]
+            for metric in metrics:
+                baseline_values = [self.columns[metric][i] for i in baseline if self.columns[metric][i] is not None]
+                latest_value = self.columns[metric][latest]
+                if not baseline_values or latest_value is None:
+                    continue
+                baseline_value = sum(baseline_values) / len(baseline_values)
+                if baseline_value <= 0:
+                    continue
+                change = (latest_value - baseline_value) / baseline_value
+                if change > threshold:
+                    regressions.append({'task': task, 'metric': metric, 'baseline': baseline_value,
+                                        'latest': latest_value, 'change': change,
+                                        'firmware_version': self.columns['firmware_version'][latest]})
+        return regressions
+
+def slope(values):
+    '''Least squares slope of values against their index.'''
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean_x = (n - 1) / 2.0
+    mean_y = sum(values) / float(n)
+    numerator = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+    denominator = sum((x - mean_x) ** 2 for x in range(n))
+    return numerator / denominator
+
+def format_regression(regression):
+    return '{task} {metric} {change:+.0%} ({baseline:.1f} -> {latest:.1f})'.format(**regression)
+
+def main(argv):
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Show task timing trends and regressions across runs.')
+    parser.add_argument('output_directory', help='eeva_output directory')
+    parser.add_argument('--robot-id', default=None)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help='flag metrics that got worse by more than this fraction')
+    parser.add_argument('--baseline-runs', type=int, default=DEFAULT_BASELINE_RUNS)
+    args = parser.parse_args(argv)
+
+    store = TaskTimingStore(args.output_directory)
+    store.load()
+
+    print '{:<20} {:>5} {:>12} {:>12} {:>12} {:>8}'.format('Task', 'Runs', 'Run Avg', 'Run Max', 'Intv. Max', 'CPU %')
+    for summary in store.trend_summary(args.robot_id):
+        # Metrics with no values (e.g. columns older files don't have) are shown as blank.
+        last = ['{:.1f}'.format(summary[metric]['last']) if metric in summary else ''
+                for metric in ('run_avg', 'run_max', 'interval_max')]
+        cpu_percent = '{:.2f}'.format(summary['cpu_percent']['last']) if 'cpu_percent' in summary else ''
+        print '{:<20} {:>5} {:>12} {:>12} {:>12} {:>8}'.format(summary['task'], summary['runs'], *(last + [cpu_percent]))
+
+    regressions = store.find_regressions(args.robot_id, args.threshold, args.baseline_runs)
+    for regression in regressions:
+        print 'Regression: {}'.format(format_regression(regression))
+
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,584 @@
+'''
+Local server that passes every message the robot sends on to other programs, so viewers and tools can watch
+the live stream without opening the serial port (only the program that owns the port can read it).
+
+The link publishes each received message to the server (see start_fanout() on the links) and any number of
+subscribers connect to it over localhost TCP, or a Unix socket on Linux/Mac.  Subscribers can't send anything
+to the robot.  A subscriber asks for one of two formats:
+
+    raw    messages framed exactly like on the serial link, so GlobParser reads them.  Packet numbers are
+           counted per subscriber so messages it missed show up as dropped (like on the link, only up to 255
+           in a row are counted).
+    json   one JSON object per line with the decoded fields and a sequence number ("seq") that skips the
+           messages it missed, for tools not written in Python.
+
+Each subscriber has its own bounded queue so a slow one never holds up the link or other subscribers.  When its
+queue is full it either loses the oldest waiting message, loses the new one, or is disconnected.
+
+A subscriber connects and sends one line of JSON, e.g.
+    {"format": "json", "globs": ["StatusData"], "queue": 1000, "drop": "oldest"}
+every key optional, and gets a line of JSON back (format, firmware version, or "error") before messages start.
+
+To watch from the command line:
+    python telemetry_fanout.py [ADDRESS] --json --globs StatusData
+'''
+import os
+import sys
+import stat
+import json
+import time
+import errno
+import socket
+import select
+import argparse
+import threading
+from collections import deque
+from crc import calculate_crc
+from glob_link_base import GlobParser, message_header, message_footer
+from eeva_glob import received_glob_types, codecs_for_firmware, CaptureData
+
+DEFAULT_FANOUT_ADDRESS = '127.0.0.1:47800'
+
+# Messages waiting to go to a subscriber before its drop policy kicks in.
+DEFAULT_QUEUE_SIZE = 1000
+
+# What to do when a subscriber's queue is full.
+DROP_OLDEST = 'oldest'
+DROP_NEWEST = 'newest'
+DROP_DISCONNECT = 'disconnect'
+drop_policies = (DROP_OLDEST, DROP_NEWEST, DROP_DISCONNECT)
+
+message_formats = ('raw', 'json')
+
+# Longest subscribe request accepted.
+MAX_REQUEST_BYTES = 4096
+
+# Messages framed per subscriber in one go by the server thread.
+SEND_BATCH = 200
+
+# Seconds server thread waits in select() when it can't be woken by a pipe (Windows).
+POLL_INTERVAL = 0.02
+
+glob_names = dict((glob_type.__name__, glob_id) for glob_id, glob_type in received_glob_types.items())
+
+def parse_address(address):
+    '''
+    Return (socket family, address) for 'unix:PATH', 'HOST:PORT' or just 'PORT' (on localhost).
+    '''
+    address = str(address)
+    if address.startswith('unix:'):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError('Unix sockets are not available on this system.')
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError('Invalid address "{}", expected HOST:PORT or unix:PATH.'.format(address))
+    return socket.AF_INET, (host or '127.0.0.1', port)
+
+def format_address(family, address):
+    if family == socket.AF_INET:
+        return '{}:{}'.format(*address)
+    return 'unix:' + address
+
+def glob_ids_for(globs):
+    '''Return set of glob IDs from list of glob names and/or IDs, or None for every glob.'''
+    if not globs:
+        return None
+    glob_ids = set()
+    for glob in globs:
+        if isinstance(glob, int) or str(glob).isdigit():
+            glob_ids.add(int(glob))
+        elif glob in glob_names:
+            glob_ids.add(glob_names[glob])
+        else:
+            raise ValueError('Unknown glob "{}".'.format(glob))
+    return glob_ids
+
+def json_value(value):
+    if isinstance(value, str):
+        return value.rstrip('\0').decode('utf-8', 'replace')
+    if isinstance(value, (tuple, list)):
+        return [json_value(v) for v in value]
+    return value
+
+def glob_fields(glob):
+    '''Return dictionary of decoded field values of glob.'''
+    codec = getattr(glob, 'codec', None)
+    target = getattr(codec, 'target', None)
+    fields = getattr(glob, target) if target else glob.__dict__
+    return dict((name, json_value(value)) for name, value in fields.items() if name != 'instance')
+
+class PublishedMessage(object):
+    '''Message from the robot shared by every subscriber queue it's in.'''
+
+    __slots__ = ('id', 'instance', 'body', 'time', 'json_fields')
+
+    def __init__(self, id, instance, body, time):
+        self.id = id
+        self.instance = instance
+        self.body = body
+        self.time = time
+        self.json_fields = None # decoded the first time a json subscriber sends it
+
+class Subscriber(object):
+
+    def __init__(self, sock, peer):
+
+        self.sock = sock
+        self.peer = peer
+        self.request = bytearray()
+        self.subscribed = False
+        self.closing = False
+        self.close_when_sent = False # after telling it why its request was refused
+
+        self.format = 'raw'
+        self.glob_ids = None
+        self.drop = DROP_OLDEST
+        self.queue = deque()
+        self.queue_size = DEFAULT_QUEUE_SIZE
+
+        # Sequence number of next message queued. Messages are sent with it so a gap means some were dropped.
+        self.next_sequence = 0
+        self.outgoing = b''
+
+        self.num_sent = 0
+        self.num_dropped = 0
+        self.max_queued = 0
+
+    def subscribe(self, request):
+        '''Apply subscribe request (dictionary). Raises ValueError if it's invalid.'''
+
+        message_format = request.get('format', 'raw')
+        if message_format not in message_formats:
+            raise ValueError('Unknown format "{}".'.format(message_format))
+        drop = request.get('drop', DROP_OLDEST)
+        if drop not in drop_policies:
+            raise ValueError('Unknown drop policy "{}".'.format(drop))
+        queue_size = int(request.get('queue', DEFAULT_QUEUE_SIZE))
+        if queue_size < 1:
+            raise ValueError('Queue size must be at least 1.')
+
+        self.glob_ids = glob_ids_for(request.get('globs'))
+        self.format = message_format
+        self.drop = drop
+        self.queue_size = queue_size
+        self.subscribed = True
+
+    def put(self, message):
+        '''Queue message, applying drop policy if queue is full. Called with server lock held.'''
+
+        if self.glob_ids is not None and message.id not in self.glob_ids:
+            return
+        if len(self.queue) >= self.queue_size:
+            self.num_dropped += 1
+            if self.drop == DROP_NEWEST:
+                self.next_sequence += 1
+                return
+            if self.drop == DROP_DISCONNECT:
+                self.closing = True
+                return
+            self.queue.popleft()
+        self.queue.append((self.next_sequence, message))
+        self.next_sequence += 1
+        self.max_queued = max(self.max_queued, len(self.queue))
+
+    def stats(self):
+        return {'peer': self.peer, 'format': self.format, 'drop': self.drop, 'sent': self.num_sent,
+                'dropped': self.num_dropped, 'queued': len(self.queue), 'max_queued': self.max_queued}
+
+class FanoutServer(object):
+    '''
+    Publishes messages to subscribers from a background thread.  publish() can be called from any thread and
+    only queues the message, so the link never waits on a subscriber.  Current codecs (for decoding json
+    messages and telling subscribers the firmware version) come from calling get_codecs().
+    '''
+
+    def __init__(self, address=DEFAULT_FANOUT_ADDRESS, get_codecs=None, message_start_byte=0xFE):
+
+        self.family, self.address = parse_address(address)
+        self.get_codecs = get_codecs if get_codecs else lambda: codecs_for_firmware(None)
+        self.message_start_byte = message_start_byte
+
+        self.listener = None
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+
+        # Pipe to wake server thread when messages are queued (select() on Windows only takes sockets).
+        self.wake_read = self.wake_write = None
+        self.wake_pending = False
+
+        self.frame_buffer = bytearray(message_header.size + 255 + message_footer.size)
+        self.frame_view = memoryview(self.frame_buffer)
+
+        self.num_published = 0
+
+    def start(self):
+        '''Start listening. Returns address subscribers should connect to (port filled in if 0 was asked for).'''
+
+        if self.thread is not None:
+            return self.bound_address()
+
+        if self.family == socket.AF_UNIX:
+            self.remove_stale_socket()
+        self.listener = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen(5)
+        self.listener.setblocking(False)
+
+        if os.name == 'posix':
+            self.wake_read, self.wake_write = os.pipe()
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        return self.bound_address()
+
+    def remove_stale_socket(self):
+        '''Delete unix socket file at address if it was left behind by a program that didn't close cleanly.'''
+
+        try:
+            if not stat.S_ISSOCK(os.stat(self.address).st_mode):
+                return # not ours to delete, bind will fail
+        except OSError:
+            return # nothing there
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.address)
+        except socket.error:
+            os.unlink(self.address) # nobody listening
+        else:
+            raise socket.error(errno.EADDRINUSE, '{} is in use by another program'.format(self.address))
+        finally:
+            probe.close()
+
+    def bound_address(self):
+        return format_address(self.family, self.listener.getsockname())
+
+    def stop(self):
+
+        if self.thread is None:
+            return
+        self.running = False
+        self.wake()
+        self.thread.join(1.0)
+        self.thread = None
+
+        for subscriber in self.subscribers:
+            subscriber.sock.close()
+        self.subscribers = []
+        self.listener.close()
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+        if self.wake_read is not None:
+            os.close(self.wake_read)
+            os.close(self.wake_write)
+            self.wake_read = self.wake_write = None
+
+    def wake(self):
+        if self.wake_write is not None:
+            os.write(self.wake_write, b'x')
+
+    def publish(self, id, instance, body):
+        '''Queue message for every subscriber that wants it.'''
+
+        if not self.subscribers:
+            return
+
+        message = PublishedMessage(id, instance, bytes(body), time.time())
+        with self.lock:
+            self.num_published += 1
+            for subscriber in self.subscribers:
+                if subscriber.subscribed:
+                    subscriber.put(message)
+            # Only one wake up needed until server thread gets to it.
+            wake = not self.wake_pending
+            self.wake_pending = True
+        if wake:
+            self.wake()
+
+    def publish_samples(self, samples):
+        '''Publish capture samples (tuples of CaptureData values) as CaptureData messages.'''
+        if self.subscribers:
+            pack = CaptureData.codec.struct.pack
+            for values in samples:
+                self.publish(CaptureData.id, 1, pack(*values))
+
+    def stats(self):
+        '''Return list of dictionaries, one per subscriber, of messages sent, dropped and waiting.'''
+        with self.lock:
+            return [subscriber.stats() for subscriber in self.subscribers]
+
+    def run(self):
+
+        while self.running:
+
+            waiting = [self.listener] + [subscriber.sock for subscriber in self.subscribers]
+            if self.wake_read is not None:
+                waiting.append(self.wake_read)
+            with self.lock:
+                self.wake_pending = False
+                writable = [subscriber.sock for subscriber in self.subscribers
+                            if subscriber.outgoing or subscriber.queue]
+            timeout = None if self.wake_read is not None else POLL_INTERVAL
+
+            try:
+                readable, writable, _ = select.select(waiting, writable, [], timeout)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if self.wake_read in readable:
+                os.read(self.wake_read, 4096)
+            if self.listener in readable:
+                self.accept()
+
+            for subscriber in list(self.subscribers):
+                if subscriber.sock in readable:
+                    self.read_request(subscriber)
+                if subscriber.sock in writable and not subscriber.closing:
+                    self.send_queued(subscriber)
+                    if subscriber.close_when_sent and not subscriber.outgoing:
+                        subscriber.closing = True
+                if subscriber.closing:
+                    self.remove(subscriber)
+
+    def accept(self):
+
+        try:
+            sock, peer = self.listener.accept()
+        except socket.error:
+            return
+        sock.setblocking(False)
+        with self.lock:
+            self.subscribers.append(Subscriber(sock, format_address(self.family, peer) if peer else 'unix'))
+
+    def remove(self, subscriber):
+
+        with self.lock:
+            self.subscribers.remove(subscriber)
+        subscriber.sock.close()
+
+    def read_request(self, subscriber):
+        '''Read subscribe request. Anything sent after it is ignored, subscribers can only listen.'''
+
+        try:
+            data = subscriber.sock.recv(4096)
+        except socket.error:
+            data = b''
+        if not data:
+            subscriber.closing = True # subscriber went away
+            return
+        if subscriber.subscribed:
+            return
+
+        subscriber.request.extend(data)
+        if b'\n' not in subscriber.request:
+            if len(subscriber.request) > MAX_REQUEST_BYTES:
+                self.refuse(subscriber, 'Request too long.')
+            return
+
+        line = bytes(subscriber.request).split(b'\n', 1)[0]
+        try:
+            request = json.loads(line) if line.strip() else {}
+            if not isinstance(request, dict):
+                raise ValueError('Request must be a JSON object.')
+            with self.lock:
+                subscriber.subscribe(request)
+        except ValueError as e:
+            self.refuse(subscriber, str(e))
+            return
+
+        codecs = self.get_codecs()
+        self.reply(subscriber, {'format': subscriber.format, 'drop': subscriber.drop,
+                                'queue': subscriber.queue_size, 'firmware_version': codecs.firmware_version,
+                                'message_start_byte': self.message_start_byte})
+
+    def reply(self, subscriber, reply):
+        subscriber.outgoing += json.dumps(reply) + '\n'
+
+    def refuse(self, subscriber, reason):
+        self.reply(subscriber, {'error': reason})
+        subscriber.close_when_sent = True
+
+    def send_queued(self, subscriber):
+
+        if not subscriber.outgoing:
+            with self.lock:
+                batch = [subscriber.queue.popleft() for _ in xrange(min(SEND_BATCH, len(subscriber.queue)))]
+            if subscriber.format == 'raw':
+                subscriber.outgoing = b''.join(self.frame(sequence, message) for sequence, message in batch)
+            else:
+                subscriber.outgoing = b''.join(self.json_line(sequence, message) for sequence, message in batch)
+            subscriber.num_sent += len(batch)
+
+        try:
+            num_sent = subscriber.sock.send(subscriber.outgoing)
+        except socket.error as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                subscriber.closing = True
+            return
+        subscriber.outgoing = subscriber.outgoing[num_sent:]
+
+    def frame(self, sequence, message):
+        '''Return message framed like on the serial link, with sequence as its packet number.'''
+
+        body_size = len(message.body)
+        header_size = message_header.size
+        message_header.pack_into(self.frame_buffer, 0, self.message_start_byte, 1, message.id, message.instance,
+                                 sequence & 0xFF, body_size)
+        self.frame_buffer[header_size : header_size + body_size] = message.body
+        crc = calculate_crc(self.frame_buffer, header_size + body_size, 0xFFFF)
+        message_footer.pack_into(self.frame_buffer, header_size + body_size, crc)
+        return self.frame_view[:header_size + body_size + message_footer.size].tobytes()
+
+    def json_line(self, sequence, message):
+
+        if message.json_fields is None:
+            glob = self.get_codecs().decode(message.id, message.instance, message.body)
+            message.json_fields = glob_fields(glob) if glob else {}
+        glob_type = received_glob_types.get(message.id)
+        return json.dumps({'seq': sequence, 'time': message.time, 'id': message.id,
+                           'glob': glob_type.__name__ if glob_type else None, 'instance': message.instance,
+                           'fields': message.json_fields}) + '\n'
+
+class FanoutClient(object):
+    '''
+    Read only connection to a FanoutServer.  read() returns decoded globs for 'raw' subscriptions and
+    dictionaries (see json_line()) for 'json' ones.
+    '''
+
+    def __init__(self, address=DEFAULT_FANOUT_ADDRESS, format='raw', globs=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 drop=DROP_OLDEST):
+
+        self.family, self.address = parse_address(address)
+        self.request = {'format': format, 'globs': globs, 'queue': queue_size, 'drop': drop}
+        self.sock = None
+        self.received = b''
+        self.firmware_version = None
+        self.codecs = None
+        self.parser = None
+        self.decoded = []
+
+        # Messages the server dropped for this subscriber (json format; raw counts them in parser).
+        self.num_missed = 0
+        self.next_sequence = None
+
+    def connect(self, timeout=2.0):
+        '''Connect and subscribe. Raises IOError if server refuses the request.'''
+
+        self.sock = socket.socket(self.family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(self.address)
+        self.sock.sendall(json.dumps(self.request) + '\n')
+
+        while b'\n' not in self.received:
+            data = self.sock.recv(4096)
+            if not data:
+                raise IOError('Server closed connection.')
+            self.received += data
+        line, self.received = self.received.split(b'\n', 1)
+        reply = json.loads(line)
+        if 'error' in reply:
+            self.close()
+            raise IOError(reply['error'])
+
+        self.firmware_version = reply.get('firmware_version')
+        self.codecs = codecs_for_firmware(self.firmware_version)
+        self.parser = GlobParser(reply.get('message_start_byte', 0xFE), self)
+        return reply
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def emit(self, id, instance, body):
+        '''Called by parser for each raw message.'''
+        glob = self.codecs.decode(id, instance, body)
+        if glob is not None:
+            self.decoded.append(glob)
+
+    @property
+    def num_dropped_messages(self):
+        if self.request['format'] == 'raw':
+            return self.parser.num_dropped_messages if self.parser else 0
+        return self.num_missed
+
+    def read(self, timeout=1.0):
+        '''
+        Wait up to timeout seconds for messages and return all that arrived (empty list if none).
+        Raises IOError once server has closed the connection.
+        '''
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(65536)
+        except socket.timeout:
+            return []
+        if not data:
+            raise IOError('Server closed connection.')
+
+        if self.request['format'] == 'raw':
+            self.parser.parse_data(bytearray(data))
+            decoded, self.decoded = self.decoded, []
+            return decoded
+
+        lines = (self.received + data).split(b'\n')
+        self.received = lines.pop()
+        messages = [json.loads(line) for line in lines if line]
+        for message in messages:
+            if self.next_sequence is not None:
+                self.num_missed += max(0, message['seq'] - self.next_sequence)
+            self.next_sequence = message['seq'] + 1
+        return messages
+
+    def messages(self):
+        '''Yield messages until the server closes the connection.'''
+        while True:
+            try:
+                batch = self.read()
+            except IOError:
+                return
+            for message in batch:
+                yield message
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(description='Print messages from a running EevaUI or eeva_cli.py --fanout.')
+    parser.add_argument('address', nargs='?', default=DEFAULT_FANOUT_ADDRESS, help='HOST:PORT or unix:PATH')
+    parser.add_argument('--json', action='store_true', help='ask for decoded JSON instead of raw frames')
+    parser.add_argument('--globs', nargs='+', default=None, metavar='NAME', help='only these globs (e.g. StatusData)')
+    parser.add_argument('--queue', type=int, default=DEFAULT_QUEUE_SIZE, help='messages server keeps waiting')
+    parser.add_argument('--drop', choices=drop_policies, default=DROP_OLDEST, help='what server does when queue is full')
+    args = parser.parse_args(argv)
+
+    client = FanoutClient(args.address, 'json' if args.json else 'raw', args.globs, args.queue, args.drop)
+    try:
+        client.connect()
+    except (IOError, socket.error) as e:
+        print 'Could not subscribe to {}: {}'.format(args.address, e)
+        return 1
+
+    try:
+        for message in client.messages():
+            if args.json:
+                print json.dumps(message)
+            else:
+                print '{} {} {}'.format(type(message).__name__, message.instance, glob_fields(message))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print 'Dropped {} messages.'.format(client.num_dropped_messages)
+        client.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
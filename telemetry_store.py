@@ -0,0 +1,537 @@
+'''
+Every StatusData message a robot sends, kept in eeva_output/telemetry so battery and motor trends can be looked
+at across days or weeks.
+
+Each robot has three append-only files:
+
+    status_ID.evt        every status message (about 10 a second)
+    status_ID_1s.evt     count, min, max and mean of every value for each second
+    status_ID_1min.evt   same for each minute, built from the one second rows
+
+Rows are stored in blocks of up to a few hundred.  Inside a block the time column and each value column are
+stored one after another (columnar) and compressed together with zlib.  Block headers have the time range, so
+a query only decompresses blocks it needs.  A week of one minute rows is about 10000 rows, which reads in a
+few milliseconds.
+
+Messages are handed to a background thread, which writes the blocks and updates the rollups so the GUI never
+waits on the disk.  Only whole seconds and minutes are written to rollup files.  When a store is opened again,
+rows written after the last rollup are rolled up first, e.g. after the GUI was closed or crashed.  Status
+messages that haven't made it into a block yet (at most BLOCK_MAX_AGE seconds of them) are lost in a crash.
+
+From the command line:
+    python telemetry_store.py DIR/eeva_output                    (robots with telemetry)
+    python telemetry_store.py DIR/eeva_output ID --columns battery left_voltage --since 2016-05-01
+'''
+import os
+import sys
+import json
+import time
+import zlib
+import array
+import bisect
+import struct
+import atexit
+import argparse
+import datetime
+import threading
+import Queue
+from eeva_glob import StatusData
+from glob_schema import Field, Derived
+from eeva_io import locked_file
+
+TELEMETRY_DIRECTORY = 'telemetry'
+
+FILE_MAGIC = 'EVTS'
+BLOCK_MAGIC = 'EVTB'
+FILE_VERSION = 1
+
+# Magic, version, length of JSON that follows (column names and resolution).
+file_header = struct.Struct('<4sHI')
+
+# Magic, number of rows, number of columns, first time, last time, compressed size, CRC32 of compressed bytes.
+block_header = struct.Struct('<4sIIddIi')
+
+# Rows in a block before it's written.
+BLOCK_ROWS = 600
+
+# Seconds status rows are held before being written even if block isn't full.
+BLOCK_MAX_AGE = 60.0
+
+COMPRESSION_LEVEL = 6
+
+# Rollup resolutions in seconds, each built from the one before it (first from every status message).
+ROLLUP_RESOLUTIONS = (1, 60)
+rollup_suffixes = {1: '_1s', 60: '_1min'}
+rollup_statistics = ('min', 'max', 'mean')
+
+# Queries longer than these (seconds) use one second and one minute rollups when no resolution is given.
+ONE_SECOND_SPAN = 10 * 60
+ONE_MINUTE_SPAN = 6 * 60 * 60
+
+# Every numeric StatusData value (padding and robot ID aren't worth keeping).
+status_columns = tuple(field.name for field in StatusData.codec.fields
+                       if isinstance(field, Derived) or
+                       (isinstance(field, Field) and field.name and field.count == 1 and field.convert is None and
+                        not field.name.startswith('pad')))
+
+def rollup_columns(columns):
+    return ['count'] + ['{}_{}'.format(column, statistic) for column in columns for statistic in rollup_statistics]
+
+def to_little_endian(values):
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values
+
+class ColumnFile(object):
+    '''
+    Append-only file of blocks of rows.  Each row is a time (double) and one float per column.  Only one
+    writer per file, any number of readers (they only see whole blocks).  Safe to write from one thread while
+    reading from others.
+    '''
+
+    def __init__(self, filepath, columns, resolution=0):
+
+        self.filepath = filepath
+        # Column names and resolution are replaced by the ones in the file if it already exists.
+        self.columns = list(columns)
+        self.resolution = resolution
+
+        # (first time, last time, payload offset, payload size, number of rows) of every block read so far.
+        self.blocks = []
+        self.last_times = []
+
+        # How much of the file has been read into blocks.
+        self.read_offset = 0
+
+        # Held while blocks and read offset are updated or looked up.
+        self.lock = threading.Lock()
+
+    @property
+    def first_time(self):
+        self.refresh()
+        with self.lock:
+            return self.blocks[0][0] if self.blocks else None
+
+    @property
+    def last_time(self):
+        self.refresh()
+        with self.lock:
+            return self.blocks[-1][1] if self.blocks else None
+
+    @property
+    def num_rows(self):
+        self.refresh()
+        with self.lock:
+            return sum(block[4] for block in self.blocks)
+
+    def refresh(self):
+        '''Read headers of blocks added since last time.'''
+
+        with self.lock:
+            self.read_new_blocks()
+
+    def read_new_blocks(self):
+
+        if not os.path.exists(self.filepath):
+            return
+        with open(self.filepath, 'rb') as column_file:
+            file_size = os.fstat(column_file.fileno()).st_size
+            if self.read_offset == 0:
+                if not self.read_file_header(column_file):
+                    return
+            column_file.seek(self.read_offset)
+            while self.read_offset + block_header.size <= file_size:
+                header = column_file.read(block_header.size)
+                magic, num_rows, num_columns, first_time, last_time, payload_size, _ = block_header.unpack(header)
+                payload_offset = self.read_offset + block_header.size
+                if (magic != BLOCK_MAGIC or num_columns != len(self.columns) or
+                        payload_offset + payload_size > file_size):
+                    break # block still being written, or cut off when program was stopped
+                self.blocks.append((first_time, last_time, payload_offset, payload_size, num_rows))
+                self.last_times.append(last_time)
+                self.read_offset = payload_offset + payload_size
+                column_file.seek(self.read_offset)
+
+    def read_file_header(self, column_file):
+
+        header = column_file.read(file_header.size)
+        if len(header) < file_header.size:
+            return False
+        magic, version, info_size = file_header.unpack(header)
+        if magic != FILE_MAGIC:
+            raise IOError('{} is not a telemetry file.'.format(self.filepath))
+        info = column_file.read(info_size)
+        if len(info) < info_size:
+            return False
+        info = json.loads(info)
+        self.columns = info['columns']
+        self.resolution = info['resolution']
+        self.read_offset = file_header.size + info_size
+        return True
+
+    def open_for_writing(self):
+        '''Create file if needed and cut off a block that was only partly written. Returns true if file is new.'''
+
+        directory = os.path.dirname(self.filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with self.lock:
+            self.read_new_blocks()
+            with locked_file(self.filepath, 'ab+') as column_file:
+                column_file.seek(0, os.SEEK_END)
+                if column_file.tell() > self.read_offset:
+                    column_file.truncate(self.read_offset)
+                if self.read_offset == 0:
+                    info = json.dumps({'columns': self.columns, 'resolution': self.resolution})
+                    column_file.write(file_header.pack(FILE_MAGIC, FILE_VERSION, len(info)) + info)
+                    self.read_offset = column_file.tell()
+                    return True
+        return False
+
+    def append_block(self, times, values):
+        '''Write block of rows. Times is array('d') in increasing order, values is one array('f') per column.'''
+
+        if not times:
+            return
+        payload = ''.join(to_little_endian(column).tostring() for column in [times] + list(values))
+        compressed = zlib.compress(payload, COMPRESSION_LEVEL)
+        header = block_header.pack(BLOCK_MAGIC, len(times), len(self.columns), times[0], times[-1], len(compressed),
+                                   zlib.crc32(compressed))
+        with locked_file(self.filepath, 'ab') as column_file:
+            column_file.write(header + compressed)
+        self.refresh()
+
+    def read_block(self, column_file, block, column_indices):
+        '''Return (times, list of value arrays) of block, or None if it's corrupted.'''
+
+        first_time, last_time, payload_offset, payload_size, num_rows = block
+        column_file.seek(payload_offset - block_header.size)
+        crc = block_header.unpack(column_file.read(block_header.size))[-1]
+        compressed = column_file.read(payload_size)
+        if zlib.crc32(compressed) != crc:
+            return None
+        payload = zlib.decompress(compressed)
+
+        times = array.array('d', payload[:8 * num_rows])
+        values = []
+        for index in column_indices:
+            start = 8 * num_rows + 4 * num_rows * index
+            values.append(array.array('f', payload[start:start + 4 * num_rows]))
+        if sys.byteorder == 'big':
+            for column in [times] + values:
+                column.byteswap()
+        return times, values
+
+    def read(self, start_time=None, end_time=None, columns=None):
+        '''
+        Return dictionary with 'time' (array of doubles) and array of floats for each column (default every
+        column) of rows from start time to end time (seconds since epoch, None for no limit).
+        '''
+        self.refresh()
+        columns = self.columns if columns is None else columns
+        column_indices = [self.columns.index(column) for column in columns]
+
+        result = dict((column, array.array('f')) for column in columns)
+        result['time'] = array.array('d')
+
+        with self.lock:
+            first_block = bisect.bisect_left(self.last_times, start_time) if start_time is not None else 0
+            blocks = self.blocks[first_block:]
+        if not blocks:
+            return result
+
+        with open(self.filepath, 'rb') as column_file:
+            for block in blocks:
+                if end_time is not None and block[0] > end_time:
+                    break
+                decoded = self.read_block(column_file, block, column_indices)
+                if decoded is None:
+                    continue # corrupted on disk, skip it
+                times, values = decoded
+                start = bisect.bisect_left(times, start_time) if start_time is not None else 0
+                end = bisect.bisect_right(times, end_time) if end_time is not None else len(times)
+                result['time'].extend(times[start:end])
+                for column, column_values in zip(columns, values):
+                    result[column].extend(column_values[start:end])
+
+        return result
+
+class PendingBlock(object):
+    '''Rows waiting to be written to a column file.'''
+
+    def __init__(self, num_columns):
+        self.num_columns = num_columns
+        self.clear()
+
+    def clear(self):
+        self.times = array.array('d')
+        self.values = [array.array('f') for _ in range(self.num_columns)]
+        self.created_time = None
+
+    def add(self, row_time, row_values):
+        if self.created_time is None:
+            self.created_time = time.time()
+        self.times.append(row_time)
+        for column, value in zip(self.values, row_values):
+            column.append(value)
+
+    def __len__(self):
+        return len(self.times)
+
+class Rollup(object):
+    '''Combines rows into count/min/max/mean of every column for each resolution seconds.'''
+
+    def __init__(self, resolution, num_columns):
+        self.resolution = resolution
+        self.num_columns = num_columns
+        self.bucket = None
+
+    def start_bucket(self, bucket):
+        self.bucket = bucket
+        self.count = 0
+        self.mins = [float('inf')] * self.num_columns
+        self.maxs = [float('-inf')] * self.num_columns
+        self.sums = [0.0] * self.num_columns
+
+    def add(self, row_time, count, mins, maxs, sums):
+        '''
+        Add count rows' min, max and sum of each column (for one status message all three are its values).
+        Returns (time, rollup row) of the previous period when this row starts a new one, otherwise None.
+        '''
+        bucket = int(row_time // self.resolution)
+        finished = None
+        if bucket != self.bucket:
+            if self.bucket is not None and self.count:
+                finished = self.row()
+            self.start_bucket(bucket)
+
+        self.count += count
+        self.mins = map(min, self.mins, mins)
+        self.maxs = map(max, self.maxs, maxs)
+        self.sums = [total + value for total, value in zip(self.sums, sums)]
+        return finished
+
+    def row(self):
+        values = [self.count]
+        for minimum, maximum, total in zip(self.mins, self.maxs, self.sums):
+            values.extend((minimum, maximum, total / self.count))
+        return self.bucket * self.resolution, values
+
+def split_rollup_row(values):
+    '''Return (count, mins, maxs, sums) of a rollup row so it can be added to a coarser rollup.'''
+    count = values[0]
+    return count, values[1::3], values[2::3], [mean * count for mean in values[3::3]]
+
+class TelemetryStore(object):
+
+    def __init__(self, output_directory, robot_id, columns=status_columns):
+
+        self.robot_id = robot_id
+        self.directory = os.path.join(output_directory, TELEMETRY_DIRECTORY)
+
+        base_path = os.path.join(self.directory, 'status_{}'.format(robot_id))
+        self.raw = ColumnFile(base_path + '.evt', columns)
+        self.rollup_files = [ColumnFile(base_path + rollup_suffixes[resolution] + '.evt', rollup_columns(columns),
+                                        resolution) for resolution in ROLLUP_RESOLUTIONS]
+
+        # (time, status data dictionary) waiting for writer thread, None to stop it.
+        self.queue = Queue.Queue()
+        self.thread = None
+
+        # Status messages older than one already stored (system clock went back) aren't stored.
+        self.num_out_of_order = 0
+
+    def start(self):
+        '''Start background thread that stores status messages passed to append().'''
+
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def close(self, timeout=5.0):
+        '''Write everything waiting and stop background thread.'''
+
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+        self.thread = None
+
+    def append(self, status_time, data):
+        '''Store StatusData values (dictionary) received at status time (time.time()). Can be called from any thread.'''
+        self.queue.put((status_time, data))
+
+    def run(self):
+
+        for column_file in [self.raw] + self.rollup_files:
+            column_file.open_for_writing()
+
+        self.pending = [PendingBlock(len(column_file.columns)) for column_file in [self.raw] + self.rollup_files]
+        self.rollups = [Rollup(resolution, len(self.raw.columns)) for resolution in ROLLUP_RESOLUTIONS]
+        self.last_time = self.raw.last_time
+
+        self.catch_up()
+
+        while True:
+            try:
+                item = self.queue.get(timeout=1.0)
+            except Queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                status_time, data = item
+                self.add_status(status_time, [data.get(column, float('nan')) for column in self.raw.columns])
+            self.write_pending()
+
+        self.write_pending(everything=True)
+
+    def catch_up(self):
+        '''Roll up rows that were stored but not rolled up yet (e.g. GUI closed partway through a minute).'''
+
+        # Coarsest first, so rows the finer rollups finish here come after what it has already seen.
+        for level in reversed(range(len(self.rollups))):
+            rollup_file = self.rollup_files[level]
+            source = self.raw if level == 0 else self.rollup_files[level - 1]
+            last_rollup_time = rollup_file.last_time
+            start_time = last_rollup_time + rollup_file.resolution if last_rollup_time is not None else None
+            rows = source.read(start_time)
+            columns = [rows[column] for column in source.columns]
+            for index, row_time in enumerate(rows['time']):
+                values = [column[index] for column in columns]
+                if level == 0:
+                    self.add_to_rollup(level, row_time, 1, values, values, values)
+                else:
+                    self.add_to_rollup(level, row_time, *split_rollup_row(values))
+        self.write_pending(everything=True)
+
+    def add_status(self, status_time, values):
+
+        if self.last_time is not None and status_time < self.last_time:
+            self.num_out_of_order += 1
+            return
+        self.last_time = status_time
+
+        self.pending[0].add(status_time, values)
+        self.add_to_rollup(0, status_time, 1, values, values, values)
+
+    def add_to_rollup(self, level, row_time, count, mins, maxs, sums):
+        '''Add row to rollup level. If that finishes a period its row is stored and added to the next level.'''
+
+        finished = self.rollups[level].add(row_time, count, mins, maxs, sums)
+        if finished is None:
+            return
+        rollup_time, values = finished
+        self.pending[level + 1].add(rollup_time, values)
+        if level + 1 < len(self.rollups):
+            self.add_to_rollup(level + 1, rollup_time, *split_rollup_row(values))
+
+    def write_pending(self, everything=False):
+        '''Write blocks that are full or have been waiting too long (or everything waiting).'''
+
+        now = time.time()
+        for column_file, pending in zip([self.raw] + self.rollup_files, self.pending):
+            if not pending:
+                continue
+            # Rollups can always be rebuilt from status rows so they're only written when full.
+            too_old = column_file is self.raw and now - pending.created_time >= BLOCK_MAX_AGE
+            if everything or too_old or len(pending) >= BLOCK_ROWS:
+                try:
+                    column_file.append_block(pending.times, pending.values)
+                except (IOError, OSError):
+                    pass # disk full or removed, keep going with what's in memory
+                pending.clear()
+
+    def choose_file(self, start_time, end_time, resolution):
+
+        if resolution is None:
+            first_time = start_time if start_time is not None else self.raw.first_time
+            last_time = end_time if end_time is not None else self.raw.last_time
+            span = last_time - first_time if first_time is not None and last_time is not None else 0
+            resolution = 60 if span > ONE_MINUTE_SPAN else 1 if span > ONE_SECOND_SPAN else 0
+        if resolution == 0:
+            return self.raw
+        for column_file in self.rollup_files:
+            if column_file.resolution == resolution:
+                return column_file
+        raise ValueError('No rollup with resolution {} s.'.format(resolution))
+
+    def query(self, columns=None, start_time=None, end_time=None, resolution=None):
+        '''
+        Return dictionary of column -> array of values, plus 'time' and 'resolution'.  Resolution 0 is every
+        status message, 1 and 60 are rollups (columns like 'battery_min', 'battery_mean', or just 'battery' for
+        all three, plus 'count').  Default picks one from how long the time range is.
+        '''
+        column_file = self.choose_file(start_time, end_time, resolution)
+        if columns is not None and column_file.resolution:
+            rollup_names = ['count']
+            for column in columns:
+                if column in self.raw.columns:
+                    rollup_names.extend('{}_{}'.format(column, statistic) for statistic in rollup_statistics)
+                elif column != 'count':
+                    rollup_names.append(column)
+            columns = rollup_names
+        result = column_file.read(start_time, end_time, columns)
+        result['resolution'] = column_file.resolution
+        return result
+
+def stored_robot_ids(output_directory):
+    '''Return list of robot IDs with telemetry in output directory.'''
+    directory = os.path.join(output_directory, TELEMETRY_DIRECTORY)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[len('status_'):-len('.evt')] for name in os.listdir(directory)
+                  if name.startswith('status_') and name.endswith('.evt') and
+                  not any(name.endswith(suffix + '.evt') for suffix in rollup_suffixes.values()))
+
+def parse_time(text):
+    '''Return seconds since epoch of 'YYYY-mm-dd [HH:MM:SS]' local time, or None.'''
+    if text is None:
+        return None
+    text_format = '%Y-%m-%d %H:%M:%S' if ' ' in text else '%Y-%m-%d'
+    return time.mktime(datetime.datetime.strptime(text, text_format).timetuple())
+
+def format_time(seconds):
+    return datetime.datetime.fromtimestamp(seconds).strftime('%Y-%m-%d %H:%M:%S')
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(description='Look at StatusData stored for each robot.')
+    parser.add_argument('output_directory', help='eeva_output directory')
+    parser.add_argument('robot_id', nargs='?', default=None, help='robot to show (default list robots)')
+    parser.add_argument('--columns', nargs='+', default=['battery'], choices=status_columns)
+    parser.add_argument('--since', default=None, help='YYYY-mm-dd [HH:MM:SS]')
+    parser.add_argument('--until', default=None, help='YYYY-mm-dd [HH:MM:SS]')
+    parser.add_argument('--resolution', default=None, choices=['raw', '1s', '1min'],
+                        help='default picks one from the time range')
+    args = parser.parse_args(argv)
+
+    if args.robot_id is None:
+        for robot_id in stored_robot_ids(args.output_directory):
+            store = TelemetryStore(args.output_directory, robot_id)
+            if store.raw.num_rows:
+                print '{}  {} to {}  {} status messages'.format(robot_id, format_time(store.raw.first_time),
+                                                                format_time(store.raw.last_time), store.raw.num_rows)
+        return 0
+
+    store = TelemetryStore(args.output_directory, args.robot_id)
+    resolution = {None: None, 'raw': 0, '1s': 1, '1min': 60}[args.resolution]
+    start_query = time.time()
+    result = store.query(args.columns, parse_time(args.since), parse_time(args.until), resolution)
+    query_time = time.time() - start_query
+
+    columns = sorted(name for name in result if name not in ('time', 'resolution'))
+    print ','.join(['time'] + columns)
+    for index, row_time in enumerate(result['time']):
+        print ','.join([format_time(row_time)] + ['{:.6g}'.format(result[column][index]) for column in columns])
+    sys.stderr.write('{} rows at {} s resolution in {:.1f} ms\n'.format(len(result['time']), result['resolution'],
+                                                                         query_time * 1000))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
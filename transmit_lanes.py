@@ -0,0 +1,407 @@
+'''
+Priority lanes for messages sent to the robot, so a stop command never waits behind bulk traffic.
+
+Every glob goes into one of three lanes and a writer thread always sends from the highest lane that has
+something waiting:
+
+    safety   RobotCommand stop and reset. Never rate limited.
+    control  driving, mode changes, other robot commands, capture start/stop, requests and pings.
+    bulk     gains, wave settings and streamed wave chunks.
+
+Control messages go ahead of bulk ones unless they depend on them: a Request waits for gains or settings of
+the glob it asks about that were sent before it, and a start command waits for wave settings and chunks sent
+before it.  Control messages go out in the order they were sent, except driving commands and pings which can
+go ahead of ones waiting on bulk.  A stop or reset drops a start command that's still waiting.
+
+Control and bulk are each limited to a fraction of the link so they can't use all of it.  A control message
+that replaces one still waiting (e.g. a newer DrivingCommand or Modes) takes the old one's place in line
+instead of both being sent, as long as nothing else in the lane was sent after the old one.
+
+Messages are only written as fast as the baud rate can carry them.  Otherwise they'd pile up in the operating
+system's buffer, where a stop would have to wait behind them no matter which lane it came from.
+
+Run this module to see how long a stop waits to be sent while the link is busy, with and without lanes.
+'''
+import threading
+import traceback
+from collections import deque
+from eeva_glob import (RobotCommand, DrivingCommand, Modes, CaptureCommand, Request, Ping, Wave, WaveChunk,
+                       timestamped_ids)
+from clock import monotonic
+
+# Lanes, highest priority first.
+SAFETY = 0
+CONTROL = 1
+BULK = 2
+lane_names = ('safety', 'control', 'bulk')
+
+# Most of the link (fraction of baud rate) each lane can use.  None means no limit.
+DEFAULT_LANE_LIMITS = (None, 0.5, 0.7)
+
+# Bytes a rate limited lane can send at once after being idle.
+LANE_BURST_BYTES = 600
+
+# Seconds of bytes allowed to be written but not yet on the wire. Small so a stop doesn't wait long behind them.
+MAX_WRITE_BACKLOG = 0.005
+
+# Bits on the wire for every byte (start bit, 8 data bits, stop bit).
+BITS_PER_BYTE = 10
+
+# Message header and CRC, added to body size when pacing.
+FRAMING_BYTES = 9
+
+# Number of queue wait times kept for each lane.
+WAIT_HISTORY = 500
+
+safety_commands = (RobotCommand.stop, RobotCommand.reset)
+control_ids = (RobotCommand.id, DrivingCommand.id, Modes.id, CaptureCommand.id, Request.id, Ping.id)
+
+# Only the newest of these matters, so a new one replaces one still waiting with the same instance.
+collapsible_ids = (DrivingCommand.id, Modes.id)
+
+# Nothing sent before these changes what they do, so they can go ahead of control messages that are waiting.
+independent_ids = (DrivingCommand.id, Ping.id)
+
+def lane_for(glob):
+    '''Return lane glob should be sent in.'''
+    if glob.id == RobotCommand.id and glob.command in safety_commands:
+        return SAFETY
+    if glob.id in control_ids:
+        return CONTROL
+    return BULK
+
+def is_start(glob):
+    return glob.id == RobotCommand.id and glob.command == RobotCommand.start
+
+def dependencies(glob):
+    '''Return (glob id, instance or None for any) of bulk messages sent before glob that have to go out first.'''
+    if glob.id == Request.id:
+        return ((glob.requested_id, glob.instance),)
+    if is_start(glob):
+        return ((Wave.id, None), (WaveChunk.id, None))
+    return ()
+
+class PendingMessage(object):
+
+    def __init__(self, glob, payload, body_size, queued_time, sequence):
+        self.glob = glob
+        self.payload = payload # what gets passed to write()
+        self.size = body_size + FRAMING_BYTES
+        self.queued_time = queued_time
+        # Order message was sent in, and bulk messages sent before it that it has to wait for.
+        self.sequence = sequence
+        self.depends_on = dependencies(glob)
+
+    def waits_for(self, other):
+        '''Return true if this message has to wait for other one, which is in bulk lane.'''
+        if other.sequence > self.sequence:
+            return False
+        for glob_id, instance in self.depends_on:
+            if other.glob.id == glob_id and (instance is None or other.glob.instance == instance):
+                return True
+        return False
+
+class TokenBucket(object):
+    '''Rate limit in bytes per second with bursts up to burst bytes.'''
+
+    def __init__(self, rate, burst=LANE_BURST_BYTES):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_time = monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+
+    def time_until(self, size, now):
+        '''Seconds until size bytes can be sent (0 if they can be now).'''
+        self.refill(now)
+        # Message bigger than burst would never fit, so only wait for a full bucket.
+        missing = min(size, self.burst) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, size):
+        self.tokens -= size
+
+class TransmitLanes(object):
+    '''
+    Queues globs by lane and writes them from a background thread.  Prepare is called as prepare(glob) by send(),
+    on the sender's thread, and returns (payload, body size), e.g. the glob packed into its own frame, so a glob
+    that can't be packed raises there.  Write is called as write(payload) in the order messages go out (packet
+    numbers are assigned then).  By default the payload is the glob itself.
+    '''
+
+    def __init__(self, write, baud_rate, lane_limits=DEFAULT_LANE_LIMITS, pace=True, classify=lane_for,
+                 prepare=None):
+
+        self.write = write
+        self.classify = classify
+        self.prepare = prepare if prepare else lambda glob: (glob, glob.body_size())
+        self.pace = pace
+        self.lane_limits = lane_limits
+        self.set_baud_rate(baud_rate)
+
+        self.lanes = [deque() for _ in lane_names]
+        self.next_sequence = 0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+
+        # Monotonic time everything written so far will have left the port.
+        self.line_free_time = 0
+
+        self.reset_stats()
+
+    def set_baud_rate(self, baud_rate):
+
+        self.byte_rate = baud_rate / float(BITS_PER_BYTE)
+        self.buckets = [TokenBucket(limit * self.byte_rate) if limit else None for limit in self.lane_limits]
+
+    def reset_stats(self):
+
+        # Seconds each message waited in its lane, most recent last.
+        self.wait_times = [deque(maxlen=WAIT_HISTORY) for _ in lane_names]
+        self.num_sent = [0] * len(lane_names)
+        self.num_collapsed = [0] * len(lane_names)
+        self.max_queued = [0] * len(lane_names)
+        self.num_write_errors = 0
+
+    def start(self):
+
+        if self.thread is not None:
+            return
+        self.running = True
+        self.line_free_time = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self, flush_timeout=0.5):
+        '''Send whatever is waiting (up to flush_timeout seconds) then stop writer thread.'''
+
+        if self.thread is None:
+            return
+        self.flush(flush_timeout)
+        with self.condition:
+            self.running = False
+            for lane in self.lanes:
+                lane.clear()
+            self.condition.notify()
+        self.thread.join(1.0)
+        self.thread = None
+
+    def flush(self, timeout):
+        '''Wait up to timeout seconds for every lane to empty. Returns true if they did.'''
+
+        end_time = monotonic() + timeout
+        with self.condition:
+            while any(self.lanes) and self.running:
+                remaining = end_time - monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def send(self, glob):
+        '''Queue glob to be sent. Can be called from any thread. Raises whatever prepare() does (e.g. struct.error).'''
+
+        lane_index = self.classify(glob)
+        payload, body_size = self.prepare(glob)
+
+        with self.condition:
+            message = PendingMessage(glob, payload, body_size, monotonic(), self.next_sequence)
+            self.next_sequence += 1
+            lane = self.lanes[lane_index]
+            if lane_index == SAFETY:
+                self.drop_waiting_starts()
+            if not self.collapse(lane, lane_index, message):
+                lane.append(message)
+                self.max_queued[lane_index] = max(self.max_queued[lane_index], len(lane))
+            self.condition.notify_all()
+
+    def collapse(self, lane, lane_index, message):
+        '''Replace waiting message the new one makes out of date. Returns true if one was replaced.'''
+
+        glob = message.glob
+        if glob.id not in collapsible_ids:
+            return False
+        independent = glob.id in independent_ids
+        for i in range(len(lane) - 1, -1, -1):
+            waiting = lane[i]
+            if waiting.glob.id == glob.id and waiting.glob.instance == glob.instance:
+                # Keeps its place in line (and time it was queued) so it isn't pushed back by updates.
+                message.queued_time = waiting.queued_time
+                lane[i] = message
+                self.num_collapsed[lane_index] += 1
+                return True
+            if not independent and waiting.glob.id not in independent_ids:
+                return False # sent after the one it would replace, so can't be passed
+        return False
+
+    def drop_waiting_starts(self):
+        '''Remove start commands that haven't gone out yet, they'd start robot after the stop.'''
+        control = self.lanes[CONTROL]
+        starts = [message for message in control if is_start(message.glob)]
+        for message in starts:
+            control.remove(message)
+        self.num_collapsed[CONTROL] += len(starts)
+
+    def candidates(self):
+        '''
+        Yield (lane index, message) for every message allowed to go next, highest priority first: the head of each
+        lane, unless it's waiting on bulk messages, and in control lane driving commands and pings behind it.
+        '''
+        safety, control, bulk = self.lanes
+
+        if safety:
+            yield SAFETY, safety[0]
+
+        blocked = False
+        for message in control:
+            if message.glob.id in independent_ids:
+                yield CONTROL, message
+            elif not blocked:
+                if not any(message.waits_for(waiting) for waiting in bulk):
+                    yield CONTROL, message
+                blocked = True # rest of control lane is behind this one
+
+        if bulk:
+            yield BULK, bulk[0]
+
+    def next_message(self):
+        '''Return (lane index, message) that can be sent now, or (None, seconds to wait) if none can.'''
+
+        now = monotonic()
+        shortest_wait = None
+
+        for lane_index, message in self.candidates():
+            bucket = self.buckets[lane_index]
+            wait = bucket.time_until(message.size, now) if bucket and self.pace else 0.0
+            if wait <= 0:
+                self.lanes[lane_index].remove(message)
+                return lane_index, message
+            if shortest_wait is None or wait < shortest_wait:
+                shortest_wait = wait
+
+        return None, shortest_wait
+
+    def run(self):
+
+        while True:
+
+            with self.condition:
+                while self.running and not any(self.lanes):
+                    self.condition.wait()
+                if not self.running:
+                    return
+
+                # Don't pick a message until the port can take it, a stop could still show up while waiting.
+                backlog = self.line_free_time - monotonic()
+                if self.pace and backlog > MAX_WRITE_BACKLOG:
+                    self.condition.wait(backlog - MAX_WRITE_BACKLOG)
+                    continue
+
+                lane_index, message = self.next_message()
+                if lane_index is None:
+                    self.condition.wait(message)
+                    continue
+
+                now = monotonic()
+                bucket = self.buckets[lane_index]
+                if bucket:
+                    bucket.take(message.size)
+                self.line_free_time = max(now, self.line_free_time) + message.size / self.byte_rate
+                self.wait_times[lane_index].append(now - message.queued_time)
+                self.num_sent[lane_index] += 1
+                if not any(self.lanes):
+                    self.condition.notify_all() # anyone flushing
+
+            # Port write can block so it's done without holding lock.
+            try:
+                if message.glob.id in timestamped_ids:
+                    message.glob.write_time = monotonic()
+                self.write(message.payload)
+            except Exception:
+                # Only this message is lost, thread has to keep going or nothing (not even a stop) gets sent.
+                self.num_write_errors += 1
+                traceback.print_exc()
+
+    def last_wait(self, lane_index=SAFETY):
+        '''Seconds the last message sent in lane waited to be sent, or None if none sent yet.'''
+        waits = self.wait_times[lane_index]
+        return waits[-1] if waits else None
+
+    def stats(self):
+        '''Return dictionary of lane name -> sent, collapsed, queued, max_queued and wait times (ms).'''
+
+        stats = {}
+        with self.condition:
+            for lane_index, name in enumerate(lane_names):
+                waits = sorted(self.wait_times[lane_index])
+                stats[name] = {'sent': self.num_sent[lane_index],
+                               'collapsed': self.num_collapsed[lane_index],
+                               'queued': len(self.lanes[lane_index]),
+                               'max_queued': self.max_queued[lane_index],
+                               'wait_avg_ms': sum(waits) / len(waits) * 1000 if waits else 0.0,
+                               'wait_p99_ms': waits[int(0.99 * (len(waits) - 1))] * 1000 if waits else 0.0,
+                               'wait_max_ms': waits[-1] * 1000 if waits else 0.0}
+        return stats
+
+def measure_stop_wait(use_lanes=True, duration=3.0, baud_rate=115200, stop_interval=0.1):
+    '''
+    Load link with streamed wave chunks, gains and driving commands (more than it can carry) and send a stop
+    every stop_interval seconds. Returns dictionary of stop wait avg/p99/max in milliseconds.
+    Without lanes every message goes in one lane with no limit, same as a first in first out queue.
+    '''
+    import time
+    from eeva_glob import WaveChunk, PidParams
+
+    stop_queued_times = {} # id(glob) -> monotonic time queued
+    stop_waits = []
+
+    def write(glob):
+        queued_time = stop_queued_times.pop(id(glob), None)
+        if queued_time is not None:
+            stop_waits.append(monotonic() - queued_time)
+
+    if use_lanes:
+        writer = TransmitLanes(write, baud_rate)
+    else:
+        writer = TransmitLanes(write, baud_rate, lane_limits=(None, None, None), classify=lambda glob: BULK)
+    writer.start()
+
+    end_time = monotonic() + duration
+    next_stop_time = monotonic()
+    while monotonic() < end_time:
+        writer.send(WaveChunk(0, [0.0] * WaveChunk.max_samples))
+        writer.send(PidParams(kp=1.0, instance=1))
+        writer.send(DrivingCommand(DrivingCommand.forward))
+        if monotonic() >= next_stop_time:
+            stop = RobotCommand(RobotCommand.stop)
+            stop_queued_times[id(stop)] = monotonic()
+            writer.send(stop)
+            next_stop_time += stop_interval
+        time.sleep(0.01)
+
+    writer.stop(flush_timeout=0)
+
+    # Stops still waiting when load test ended count as waiting the whole time since they were queued.
+    now = monotonic()
+    stop_waits.extend(now - queued_time for queued_time in stop_queued_times.values())
+    stop_waits.sort()
+    return {'stops': len(stop_waits),
+            'wait_avg_ms': sum(stop_waits) / len(stop_waits) * 1000,
+            'wait_p99_ms': stop_waits[int(0.99 * (len(stop_waits) - 1))] * 1000,
+            'wait_max_ms': stop_waits[-1] * 1000}
+
+def main():
+
+    for use_lanes in (False, True):
+        stats = measure_stop_wait(use_lanes)
+        print '{:<10} {} stops waited avg {:8.1f} ms  p99 {:8.1f} ms  max {:8.1f} ms'.format(
+              'lanes' if use_lanes else 'one queue', stats['stops'], stats['wait_avg_ms'], stats['wait_p99_ms'],
+              stats['wait_max_ms'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+'''
+Trapezoidal motion profiles: accelerate at amax up to vmax, cruise, then decelerate to a stop after moving dx.
+If dx is too short to reach vmax the profile is a triangle with a lower peak velocity.
+
+Each profile has 3 segments (accelerate, cruise, decelerate).  Position within a segment is
+    x = c0 + c1 * tau + c2 * tau^2
+where tau is time since the segment started and x is relative to where the profile started.
+This is what gets sent to the robot in Wave.ts_and_cs as [t1, t2, t3, c0, c1, c2 (x3 segments)]
+where t1, t2 and t3 are the times each segment ends.
+
+plan_trapezoid() only needs the standard library.  plan_trapezoids() (many profiles at once, e.g. for sweeps)
+needs numpy.
+'''
+import math
+
+class TrapezoidError(ValueError):
+    pass
+
+def check_limits(vmax, amax, dx):
+
+    for name, value in (('vmax', vmax), ('amax', amax), ('dx', dx)):
+        if math.isnan(value) or math.isinf(value):
+            raise TrapezoidError('Trapezoid {} must be a finite number.'.format(name))
+    if vmax <= 0:
+        raise TrapezoidError('Trapezoid vmax must be greater than zero.')
+    if amax <= 0:
+        raise TrapezoidError('Trapezoid amax must be greater than zero.')
+
+class TrapezoidProfile(object):
+
+    def __init__(self, vmax, amax, dx, segment_times, coefficients):
+
+        self.vmax = vmax
+        self.amax = amax
+        self.dx = dx
+        self.segment_times = segment_times # (t1, t2, t3)
+        self.coefficients = coefficients # ((c0, c1, c2), ...) for each segment
+
+    @property
+    def total_time(self):
+        return self.segment_times[2]
+
+    @property
+    def peak_velocity(self):
+        return abs(self.coefficients[1][1])
+
+    @property
+    def reaches_vmax(self):
+        return self.segment_times[1] > self.segment_times[0]
+
+    def ts_and_cs(self):
+        '''Return the 12 values sent in Wave.ts_and_cs.'''
+        return list(self.segment_times) + [c for segment in self.coefficients for c in segment]
+
+    def describe(self):
+        return 'accelerate {:.3f} s, cruise {:.3f} s at {:.3f}, total {:.3f} s'.format(
+               self.segment_times[0], self.segment_times[1] - self.segment_times[0],
+               self.peak_velocity, self.total_time)
+
+def plan_trapezoid(vmax, amax, dx, max_duration=None):
+    '''
+    Return TrapezoidProfile that moves dx (may be negative). Raises TrapezoidError if the limits are invalid
+    or the profile takes longer than max_duration seconds.
+    '''
+    vmax, amax, dx = float(vmax), float(amax), float(dx)
+    check_limits(vmax, amax, dx)
+
+    direction = 1.0 if dx >= 0 else -1.0
+    distance = abs(dx)
+
+    if distance * amax >= vmax ** 2:
+        peak_velocity = vmax
+        accel_time = vmax / amax
+        cruise_time = (distance - vmax ** 2 / amax) / vmax
+    else:
+        # Never gets to vmax.
+        peak_velocity = math.sqrt(distance * amax)
+        accel_time = peak_velocity / amax
+        cruise_time = 0.0
+
+    t1 = accel_time
+    t2 = t1 + cruise_time
+    t3 = t2 + accel_time
+
+    x1 = direction * 0.5 * peak_velocity * accel_time
+    x2 = x1 + direction * peak_velocity * cruise_time
+
+    coefficients = ((0.0, 0.0, direction * 0.5 * amax),
+                    (x1, direction * peak_velocity, 0.0),
+                    (x2, direction * peak_velocity, -direction * 0.5 * amax))
+
+    if max_duration is not None and t3 > max_duration:
+        raise TrapezoidError('Trapezoid takes {:.3f} s which is longer than wave duration of {:.3f} s.'.format(
+                             t3, max_duration))
+
+    return TrapezoidProfile(vmax, amax, dx, (t1, t2, t3), coefficients)
+
+def plan_trapezoids(vmax, amax, dx, max_duration=None):
+    '''
+    Vectorized plan_trapezoid() for many profiles at once. Arguments are arrays (or scalars) that broadcast
+    together. Returns (segment_times, coefficients, feasible) with shapes (N, 3), (N, 3, 3) and (N,).
+    Rows that aren't feasible are NaN.
+    '''
+    import numpy as np
+
+    vmax, amax, dx = [np.ravel(a).astype(float) for a in np.broadcast_arrays(vmax, amax, dx)]
+    feasible = np.isfinite(vmax) & np.isfinite(amax) & np.isfinite(dx) & (vmax > 0) & (amax > 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+
+        direction = np.where(dx >= 0, 1.0, -1.0)
+        distance = np.abs(dx)
+
+        reaches_vmax = distance * amax >= vmax ** 2
+        peak_velocity = np.where(reaches_vmax, vmax, np.sqrt(distance * amax))
+        accel_time = peak_velocity / amax
+        cruise_time = np.where(reaches_vmax, (distance - vmax ** 2 / amax) / vmax, 0.0)
+
+        segment_times = np.cumsum(np.column_stack((accel_time, cruise_time, accel_time)), axis=1)
+
+        x1 = direction * 0.5 * peak_velocity * accel_time
+        x2 = x1 + direction * peak_velocity * cruise_time
+        zeros = np.zeros_like(x1)
+
+        coefficients = np.stack((np.column_stack((zeros, zeros, direction * 0.5 * amax)),
+                                 np.column_stack((x1, direction * peak_velocity, zeros)),
+                                 np.column_stack((x2, direction * peak_velocity, -direction * 0.5 * amax))), axis=1)
+
+    if max_duration is not None:
+        feasible &= segment_times[:, 2] <= max_duration
+
+    segment_times[~feasible] = np.nan
+    coefficients[~feasible] = np.nan
+
+    return segment_times, coefficients, feasible
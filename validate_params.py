@@ -1,5 +1,5 @@
 
-from eeva_glob import PidParams, CaptureCommand, Request
+from eeva_glob import PidParams, CaptureCommand
 
 # Data capture parameters
 DEFAULT_NUM_SAMPLES = 500
@@ -11,6 +11,11 @@ DEFAULT_WAVE_OFFSET = 0
 DEFAULT_WAVE_FREQ = 1
 DEFAULT_WAVE_DURATION = 5
 
+# Trapezoid wave parameters
+DEFAULT_TRAPEZOID_VMAX = 0.5
+DEFAULT_TRAPEZOID_AMAX = 1
+DEFAULT_TRAPEZOID_DX = 1
+
 # Manual command parameters
 DEFAULT_MANUAL_COMMAND = 0
 DEFAULT_MANUAL_INCREMENT = 1
@@ -52,7 +57,7 @@ def validate_capture_parameters(controller, view):
             # Pass capture parameters to robot for validation.
             capture_command = CaptureCommand(is_start=0, paused=0, freq=rate, desired_samples=samples, total_samples=0)
             controller.link.send(capture_command)
-            controller.link.send(Request(CaptureCommand.id))
+            controller.requests.request(CaptureCommand.id, fresh=True)
     
     return duration
 
@@ -72,6 +77,20 @@ def validate_wave_parameters(view):
     view.set_wave_freq(freq)
     view.set_wave_duration(duration)
     
+def validate_trapezoid_parameters(view):
+    
+    view_params = view.get_trapezoid_parameters()
+    vmax = try_parse(view_params['vmax'], float, DEFAULT_TRAPEZOID_VMAX)
+    vmax = limit(vmax, 1e-6, 1e10)
+    amax = try_parse(view_params['amax'], float, DEFAULT_TRAPEZOID_AMAX)
+    amax = limit(amax, 1e-6, 1e10)
+    dx = try_parse(view_params['dx'], float, DEFAULT_TRAPEZOID_DX)
+    dx = limit(dx, -1e10, 1e10)
+    
+    view.set_trapezoid_parameters({'vmax': vmax, 'amax': amax, 'dx': dx})
+    
+    return vmax, amax, dx
+    
 def validate_pid_parameters(controller, send=False):
     
     view = controller.view
@@ -96,9 +115,8 @@ def validate_pid_parameters(controller, send=False):
     if send:
         # Save before sending so we can keep what we have stored in sync with what user is seeing.
         controller.pid_params[pid_number] = params
-        controller.link.send(params)
-        # Request new gains just to verify that robot got new gains.
-        controller.link.send(Request(PidParams.id, instance=params.instance))
+        # Only sent if different from what robot already has. Robot is then asked for gains back to verify.
+        controller.pid_cache.update(pid_number, params)
     
 def validate_manual_command_parameters(view):
     
@@ -0,0 +1,103 @@
+'''
+Excitation signals computed on the host for streaming to the robot (see wave_stream.py).
+Every function returns a numpy array of samples at the given sample rate.
+'''
+import os
+import numpy as np
+
+def sample_times(duration, sample_rate):
+    return np.arange(int(round(duration * sample_rate))) / float(sample_rate)
+
+def chirp(f0, f1, duration, sample_rate, mag=1.0, offset=0.0, logarithmic=False):
+    '''Sine sweeping from f0 to f1 Hz over duration seconds.'''
+
+    t = sample_times(duration, sample_rate)
+
+    if logarithmic:
+        if f0 <= 0 or f1 <= 0:
+            raise ValueError('Logarithmic chirp needs frequencies above zero.')
+        k = (float(f1) / f0) ** (1.0 / duration)
+        if k == 1:
+            phase = 2 * np.pi * f0 * t
+        else:
+            phase = 2 * np.pi * f0 * (k ** t - 1) / np.log(k)
+    else:
+        phase = 2 * np.pi * (f0 * t + 0.5 * (f1 - f0) / duration * t ** 2)
+
+    return offset + mag * np.sin(phase)
+
+# Feedback taps (1-based) for maximum length sequences, by register length.
+prbs_taps = {2: (2, 1), 3: (3, 2), 4: (4, 3), 5: (5, 3), 6: (6, 5), 7: (7, 6), 8: (8, 6, 5, 4),
+             9: (9, 5), 10: (10, 7), 11: (11, 9), 12: (12, 11, 10, 4), 13: (13, 12, 11, 8),
+             14: (14, 13, 12, 2), 15: (15, 14), 16: (16, 15, 13, 4)}
+
+def prbs(order, bit_rate, sample_rate, mag=1.0, offset=0.0, num_periods=1):
+    '''
+    Pseudo random binary sequence switching between offset-mag and offset+mag. One period is 2^order - 1 bits,
+    each held for sample_rate / bit_rate samples.
+    '''
+    if order not in prbs_taps:
+        raise ValueError('PRBS order must be between {} and {}.'.format(min(prbs_taps), max(prbs_taps)))
+
+    taps = prbs_taps[order]
+    length = 2 ** order - 1
+
+    # Shift register has to be run bit by bit, but the rest is vectorized.
+    register = (1 << order) - 1
+    bits = np.empty(length, dtype=np.int8)
+    for i in xrange(length):
+        bits[i] = register & 1
+        feedback = 0
+        for tap in taps:
+            feedback ^= (register >> (order - tap)) & 1
+        register = (register >> 1) | (feedback << (order - 1))
+
+    samples_per_bit = float(sample_rate) / bit_rate
+    if samples_per_bit < 1:
+        raise ValueError('Bit rate can not be higher than sample rate.')
+
+    num_samples = int(round(length * num_periods * samples_per_bit))
+    bit_index = (np.arange(num_samples) / samples_per_bit).astype(int) % length
+
+    return offset + mag * (2.0 * bits[bit_index] - 1.0)
+
+def multisine(freqs, duration, sample_rate, mag=1.0, offset=0.0, amplitudes=None):
+    '''
+    Sum of sines at freqs (Hz) with Schroeder phases to keep peak value low, scaled so peak is mag.
+    Amplitudes are relative weights of each frequency (all equal by default).
+    '''
+    freqs = np.asarray(freqs, dtype=float)
+    if amplitudes is None:
+        amplitudes = np.ones(len(freqs))
+    amplitudes = np.asarray(amplitudes, dtype=float)
+
+    k = np.arange(1, len(freqs) + 1)
+    phases = -np.pi * k * (k - 1) / len(freqs)
+
+    t = sample_times(duration, sample_rate)
+    signal = (amplitudes[:, np.newaxis] * np.sin(2 * np.pi * freqs[:, np.newaxis] * t + phases[:, np.newaxis])).sum(axis=0)
+
+    peak = np.abs(signal).max() if len(signal) else 0
+    if peak > 0:
+        signal *= mag / peak
+
+    return offset + signal
+
+def load_signal(filepath, column=0):
+    '''Load samples from .npy file or from column of text/csv file (a header row is skipped).'''
+
+    if os.path.splitext(filepath)[1].lower() == '.npy':
+        values = np.load(filepath)
+        return values if values.ndim == 1 else values[:, column]
+
+    with open(filepath, 'r') as infile:
+        first_line = infile.readline()
+    delimiter = ',' if ',' in first_line else None
+    try:
+        [float(v) for v in first_line.split(delimiter)]
+        skip_rows = 0
+    except ValueError:
+        skip_rows = 1 # header
+
+    values = np.loadtxt(filepath, delimiter=delimiter, skiprows=skip_rows, ndmin=2)
+    return values[:, column]
@@ -0,0 +1,151 @@
+import time
+from eeva_glob import Wave, WaveChunk, WaveBufferStatus
+
+# How often robot's buffer level is checked while streaming if robot hasn't reported it on its own.
+BUFFER_STATUS_INTERVAL = 0.05 # seconds
+
+# If robot still hasn't received a chunk this long after it was sent then it's assumed lost and sent again.
+CHUNK_RESEND_TIMEOUT = 0.15 # seconds
+
+class WaveStreamer(object):
+    '''
+    Streams a precomputed wave to the robot in WaveChunk globs.  Chunks are only sent when robot reports
+    enough free space in its buffer (WaveBufferStatus), and if robot reports it's still waiting on a chunk
+    that should have arrived then everything from that chunk on is sent again.
+    '''
+
+    def __init__(self, link, scheduler, requests):
+
+        self.link = link
+        self.scheduler = scheduler
+        self.requests = requests
+
+        self.values = []
+        self.sample_rate = 0
+        self.streaming = False
+        self.finished_callback = None
+
+        # Incremented every time stream starts or stops so old timers know to do nothing.
+        self.generation = 0
+
+        self.reset_stats()
+
+    def reset_stats(self):
+
+        # Index of next sample to send.
+        self.next_index = 0
+
+        # Start index of chunk -> time it was (last) sent.
+        self.chunk_send_times = {}
+
+        # Last status robot reported, None until first one arrives.
+        self.last_status = None
+        self.last_status_time = 0
+
+        self.num_chunks_sent = 0
+        self.num_chunks_resent = 0
+        self.num_underruns = 0
+
+    def start(self, values, sample_rate, finished_callback=None):
+        '''
+        Tell robot to play values (list or numpy array) at sample_rate (Hz) and start filling its buffer.
+        Robot starts playing when it's started like any other wave. finished_callback(streamer) is called
+        once robot has played every sample.
+        '''
+        self.stop()
+
+        self.values = values
+        self.sample_rate = float(sample_rate)
+        self.finished_callback = finished_callback
+        self.reset_stats()
+        self.streaming = True
+        self.generation += 1
+
+        self.send_wave_settings()
+        self.poll_buffer_status(self.generation)
+
+    def stop(self):
+
+        self.streaming = False
+        self.generation += 1
+
+    def send_wave_settings(self):
+
+        duration = len(self.values) / self.sample_rate
+        self.link.send(Wave(wave_type=Wave.streamed, freq=self.sample_rate, duration=duration, wave_time=0))
+
+    @property
+    def duration(self):
+        return len(self.values) / self.sample_rate if self.sample_rate else 0
+
+    @property
+    def progress(self):
+        '''Fraction of wave robot has played.'''
+        if len(self.values) == 0 or self.last_status is None:
+            return 0.0
+        return min(1.0, self.last_status.samples_played / float(len(self.values)))
+
+    def buffer_status_received(self, status):
+        '''Should be called with every WaveBufferStatus from robot.'''
+
+        if not self.streaming:
+            return
+
+        self.last_status = status
+        self.last_status_time = time.time()
+        self.num_underruns = status.num_underruns
+
+        if status.samples_played >= len(self.values):
+            self.finish()
+            return
+
+        # Robot drops chunks that don't start where it expects, so go back to the first one it's missing.
+        if status.next_index < self.next_index:
+            sent_time = self.chunk_send_times.get(status.next_index)
+            if sent_time is None or time.time() - sent_time > CHUNK_RESEND_TIMEOUT:
+                self.next_index = status.next_index
+                self.num_chunks_resent += 1
+
+        self.send_chunks(status)
+
+    def send_chunks(self, status):
+
+        # Samples sent that robot hasn't reported receiving yet still need room in its buffer.
+        in_flight = self.next_index - status.next_index
+        free_space = status.free_space - in_flight
+
+        while self.next_index < len(self.values):
+
+            # Wait for room for a full chunk unless it's the end of the wave, otherwise lots of tiny chunks get sent.
+            remaining = len(self.values) - self.next_index
+            if free_space < min(WaveChunk.max_samples, remaining):
+                break
+
+            end_index = min(self.next_index + min(free_space, WaveChunk.max_samples), len(self.values))
+            values = self.values[self.next_index : end_index]
+            if hasattr(values, 'tolist'):
+                values = values.tolist() # numpy array
+
+            flags = WaveChunk.last_chunk if end_index == len(self.values) else 0
+            self.link.send(WaveChunk(self.next_index, values, flags))
+
+            self.chunk_send_times[self.next_index] = time.time()
+            self.num_chunks_sent += 1
+            free_space -= end_index - self.next_index
+            self.next_index = end_index
+
+    def poll_buffer_status(self, generation):
+
+        if generation != self.generation or not self.streaming:
+            return
+
+        if time.time() - self.last_status_time >= BUFFER_STATUS_INTERVAL:
+            self.requests.request(WaveBufferStatus.id)
+
+        self.scheduler.call_later(BUFFER_STATUS_INTERVAL, lambda: self.poll_buffer_status(generation))
+
+    def finish(self):
+
+        self.stop()
+        if self.finished_callback:
+            self.finished_callback(self)